@@ -0,0 +1,128 @@
+"""
+Benchmarks of the generation pipeline stages on synthetic vocal takes.
+
+Run them with pytest-benchmark, the song lengths (seconds) come from
+BENCH_SECONDS (default "30,300", use "30,120,600,1800" for the full range).
+The timings depend on the machine, so no baseline is committed: save one
+on the commit before a change, it is stored in .benchmarks/<machine>/
+
+    pytest benchmarks/bench_pipeline.py --benchmark-autosave
+
+then compare the change against the last saved run (or a run number):
+
+    pytest benchmarks/bench_pipeline.py --benchmark-compare --benchmark-compare-fail=mean:25%
+    pytest benchmarks/bench_pipeline.py --benchmark-compare=0001
+
+The stages only read and write wav files, ffmpeg is not needed.
+
+The peak python memory of each stage is kept in the extra_info of the
+benchmark json.
+"""
+import os
+import tracemalloc
+import numpy as np
+import pytest
+from synthetic import make_key_table, make_melody_midi, make_time_section, make_vocal_wav
+from data_process.generatemusic import (ChordGenerator, DrumAccompanimentMode1, MIDIFile, Mixer,
+                                        PianoAccompanimentMode1)
+from data_process.hmm_model_generate import (caculate_emission_probability, ensemble_hmm_model,
+                                             generate_duration_probability, generate_emission_matrix)
+from data_process.song_analyze import split_midi_to_measure, split_time_section
+
+song_seconds = [int(i) for i in os.environ.get("BENCH_SECONDS", "30,300").split(",")]
+tempo = 100
+
+
+def run_benchmark(benchmark, function, *args):
+    """
+    Runs the stage once under tracemalloc to record its peak memory, then
+    times it.
+    """
+    tracemalloc.start()
+    function(*args)
+    benchmark.extra_info["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+
+    return benchmark.pedantic(function, args=args, rounds=3, iterations=1)
+
+
+@pytest.fixture(params=song_seconds, ids=lambda seconds: f"{seconds}s")
+def song(request, tmp_path):
+    """
+    A synthetic song: melody midi, measures, notes per measure and key table.
+    """
+    seconds = request.param
+    midi_file = make_melody_midi(str(tmp_path / "vocal.mid"), seconds, tempo)
+    time_section = make_time_section(seconds, tempo)
+    chord_list, transition_matrix, observation_matrix = make_key_table(26)
+
+    return {"seconds": seconds, "tmp_path": tmp_path, "midi_file": midi_file, "time_section": time_section,
+            "split_notes_list": split_midi_to_measure(midi_file, time_section), "chord_list": chord_list,
+            "transition_matrix": transition_matrix, "observation_matrix": observation_matrix}
+
+
+def test_split_midi_to_measure(benchmark, song):
+    run_benchmark(benchmark, split_midi_to_measure, song["midi_file"], song["time_section"])
+
+
+def test_caculate_emission_probability(benchmark, song):
+    run_benchmark(benchmark, caculate_emission_probability, song["split_notes_list"], song["observation_matrix"])
+
+
+def test_decoding(benchmark, song):
+    emission_matrix = generate_emission_matrix(
+        caculate_emission_probability(song["split_notes_list"], song["observation_matrix"]))
+    model = ensemble_hmm_model(song["transition_matrix"], emission_matrix, song["chord_list"], "C:maj")
+
+    def decode():
+        return ChordGenerator(model, song["split_notes_list"], song["chord_list"]).generate()
+
+    chord_sequence = run_benchmark(benchmark, decode)
+    assert len(chord_sequence) == len(song["time_section"])
+
+
+def test_beat_decoding(benchmark, song):
+    split_notes_list = split_midi_to_measure(song["midi_file"], split_time_section(song["time_section"], 4))
+    emission_matrix = generate_emission_matrix(
+        caculate_emission_probability(split_notes_list, song["observation_matrix"]))
+    model = ensemble_hmm_model(song["transition_matrix"], emission_matrix, song["chord_list"], "C:maj")
+
+    def decode():
+        return ChordGenerator(model, split_notes_list, song["chord_list"],
+                              duration_probability=generate_duration_probability(4)).generate()
+
+    chord_sequence = run_benchmark(benchmark, decode)
+    assert len(chord_sequence) == 4 * len(song["time_section"])
+
+
+def test_accompaniment(benchmark, song):
+    chord_sequence = list(np.resize(song["chord_list"], len(song["time_section"])))
+
+    def accompany():
+        PianoAccompanimentMode1(tempo, chord_sequence).generate()
+        DrumAccompanimentMode1(tempo, chord_sequence).generate()
+
+    run_benchmark(benchmark, accompany)
+
+
+def test_midi_write(benchmark, song):
+    chord_sequence = list(np.resize(song["chord_list"], len(song["time_section"])))
+
+    def write():
+        piano = PianoAccompanimentMode1(tempo, chord_sequence).generate()
+        MIDIFile(str(song["tmp_path"] / "piano.mid"), piano).write()
+
+    run_benchmark(benchmark, write)
+
+
+def test_mixing(benchmark, song):
+    seconds = song["seconds"]
+    vocal_file = make_vocal_wav(str(song["tmp_path"] / "vocal.wav"), seconds, tempo=tempo)
+    piano_file = make_vocal_wav(str(song["tmp_path"] / "piano.wav"), seconds, tempo=tempo, seed=1)
+    drum_file = make_vocal_wav(str(song["tmp_path"] / "drum.wav"), seconds, tempo=tempo, seed=2)
+
+    def mix():
+        mixer = Mixer(vocal_file, piano_file, drum_file, 0.0)
+        return mixer.mix_instruments().overlay(mixer.voice)
+
+    run_benchmark(benchmark, mix)
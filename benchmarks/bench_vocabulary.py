@@ -0,0 +1,79 @@
+"""
+Benchmark of the beam decoder over growing chord vocabularies, with the
+sparse transition matrix of the large vocabulary model (a few successors
+per chord).
+
+    pytest benchmarks/bench_vocabulary.py --benchmark-autosave
+
+test_scaling checks the decoding time grows sub-quadratically with the
+vocabulary size, the time of each size and the slope are kept in the
+extra_info of the saved benchmark.
+"""
+import timeit
+import numpy as np
+import pytest
+from scipy import sparse
+from data_process.decoder import beam_viterbi
+
+vocabulary_sizes = [100, 500, 2000, 8000]
+n_measures = 120
+successors = 20
+
+
+def make_sparse_model(n_chords: int, seed: int = 0) -> (np.array, np.array, sparse.csr_matrix, np.array):
+    """
+    the function to generate a random sparse chord model
+
+    Args:
+        n_chords (int): the vocabulary size
+        seed (int): the random seed
+
+    Returns:
+        log_emission, start_probability, transition, unigram
+    """
+
+    rng = np.random.default_rng(seed)
+    log_emission = np.log(rng.random((n_measures, n_chords)))
+    start_probability = np.full(n_chords, 1 / n_chords)
+
+    rows = np.repeat(np.arange(n_chords), successors)
+    cols = rng.integers(0, n_chords, n_chords * successors)
+    transition = sparse.csr_matrix((rng.random(len(rows)), (rows, cols)), shape=(n_chords, n_chords))
+    transition = sparse.diags(1 / np.asarray(transition.sum(axis=1)).ravel()) @ transition
+
+    unigram = rng.random(n_chords)
+    unigram /= unigram.sum()
+
+    return log_emission, start_probability, transition.tocsr(), unigram
+
+
+@pytest.mark.parametrize("n_chords", vocabulary_sizes)
+def test_beam_viterbi(benchmark, n_chords):
+    log_emission, start_probability, transition, unigram = make_sparse_model(n_chords)
+
+    logprob, chord_sequence = benchmark.pedantic(
+        beam_viterbi, args=(log_emission, start_probability, transition, 64, 0.05, unigram), rounds=3, iterations=1)
+    assert len(chord_sequence) == n_measures
+
+
+def test_scaling(benchmark):
+    models = {n_chords: make_sparse_model(n_chords) for n_chords in vocabulary_sizes}
+
+    def decode(n_chords):
+        log_emission, start_probability, transition, unigram = models[n_chords]
+        return beam_viterbi(log_emission, start_probability, transition, 64, 0.05, unigram)
+
+    # the best of a few warmed up rounds of each size, not a single cold run
+    timings = []
+    for n_chords in vocabulary_sizes:
+        decode(n_chords)
+        timings.append(min(timeit.repeat(lambda: decode(n_chords), number=1, repeat=5)))
+
+    # the slope of log time over log vocabulary size
+    slope = np.polyfit(np.log(vocabulary_sizes), np.log(timings), 1)[0]
+    benchmark.extra_info["decoding_time"] = dict(zip(map(str, vocabulary_sizes), timings))
+    benchmark.extra_info["slope"] = float(slope)
+
+    # the largest vocabulary is the benchmarked run
+    benchmark.pedantic(decode, args=(vocabulary_sizes[-1],), rounds=3, warmup_rounds=1, iterations=1)
+    assert slope < 2
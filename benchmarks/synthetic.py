@@ -0,0 +1,150 @@
+import numpy as np
+import pretty_midi
+from scipy.io import wavfile
+
+# c major scale tones around the singing range
+scale_midi_notes = [60, 62, 64, 65, 67, 69, 71, 72]
+
+
+def make_melody_notes(seconds: float, tempo: float = 100, seed: int = 0) -> list:
+    """
+    the function to generate a random diatonic melody of quarter and
+    eighth notes
+
+    Args:
+        seconds (float): the length of the melody
+        tempo (float): the tempo in beats per minute
+        seed (int): the random seed
+
+    Returns:
+        list of (start, end, midi pitch)
+    """
+
+    rng = np.random.default_rng(seed)
+    beat = 60 / tempo
+
+    notes = []
+    start = 0.0
+    while start < seconds:
+        length = beat * rng.choice([0.5, 1.0])
+        notes.append((start, min(start + length * 0.9, seconds), int(rng.choice(scale_midi_notes))))
+        start += length
+
+    return notes
+
+
+def make_melody_midi(midi_file: str, seconds: float, tempo: float = 100, seed: int = 0) -> str:
+    """
+    the function to write a synthetic vocal melody midi file, laid out like
+    the basic-pitch transcription (one instrument)
+
+    Args:
+        midi_file (str): the midi file name
+        seconds (float): the length of the melody
+        tempo (float): the tempo in beats per minute
+        seed (int): the random seed
+
+    Returns:
+        the midi file name
+    """
+
+    midi_data = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    voice = pretty_midi.Instrument(program=0)
+    for start, end, pitch in make_melody_notes(seconds, tempo, seed):
+        voice.notes.append(pretty_midi.Note(velocity=100, pitch=pitch, start=start, end=end))
+    midi_data.instruments.append(voice)
+    midi_data.write(midi_file)
+
+    return midi_file
+
+
+def make_vocal_audio(seconds: float, sr: int = 22050, tempo: float = 100, seed: int = 0) -> np.array:
+    """
+    the function to synthesize the melody as decaying sine tones
+
+    Args:
+        seconds (float): the length of the audio
+        sr (int): the sampling rate
+        tempo (float): the tempo in beats per minute
+        seed (int): the random seed
+
+    Returns:
+        the float32 mono waveform
+    """
+
+    audio = np.zeros(int(seconds * sr), dtype=np.float32)
+    for start, end, pitch in make_melody_notes(seconds, tempo, seed):
+        begin = int(start * sr)
+        t = np.arange(int(end * sr) - begin) / sr
+        frequency = 440 * 2 ** ((pitch - 69) / 12)
+        audio[begin:begin + len(t)] += (0.3 * np.sin(2 * np.pi * frequency * t) * np.exp(-3 * t)).astype(np.float32)
+
+    return audio
+
+
+def make_vocal_wav(wav_file: str, seconds: float, sr: int = 22050, tempo: float = 100, seed: int = 0) -> str:
+    """
+    the function to write the synthetic vocal as 16 bit wav
+
+    Args:
+        wav_file (str): the wav file name
+        seconds (float): the length of the audio
+        sr (int): the sampling rate
+        tempo (float): the tempo in beats per minute
+        seed (int): the random seed
+
+    Returns:
+        the wav file name
+    """
+
+    audio = make_vocal_audio(seconds, sr, tempo, seed)
+    wavfile.write(wav_file, sr, (audio * 32767).astype(np.int16))
+
+    return wav_file
+
+
+def make_time_section(seconds: float, tempo: float = 100, beats_per_bar: int = 4) -> list:
+    """
+    the function to generate the measure boundaries of a steady tempo,
+    like get_beat_info
+
+    Args:
+        seconds (float): the length of the song
+        tempo (float): the tempo in beats per minute
+        beats_per_bar (int): the number of beats per measure
+
+    Returns:
+        the time section list
+    """
+
+    down_beat = np.arange(0, seconds, 60 / tempo * beats_per_bar)
+    time_section = [[down_beat[i], down_beat[i + 1]] for i in range(len(down_beat) - 1)]
+    time_section.append([down_beat[-1], seconds])
+
+    return time_section
+
+
+def make_key_table(n_chords: int, seed: int = 0) -> (list, np.array, np.array):
+    """
+    the function to generate a random chord vocabulary with its transition
+    and melody observation matrices, shaped like get_key_table
+
+    Args:
+        n_chords (int): the number of chords
+        seed (int): the random seed
+
+    Returns:
+        chord_list, transition_matrix, observation_matrix
+    """
+
+    rng = np.random.default_rng(seed)
+    roots = ['C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
+    qualities = ['maj', 'min', '7', 'maj7', 'min7', 'sus2', 'sus4', 'dim', 'maj6']
+    chord_list = [root + ':' + quality for quality in qualities for root in roots][:n_chords]
+
+    transition_matrix = rng.random((len(chord_list), len(chord_list)))
+    transition_matrix /= transition_matrix.sum(axis=1, keepdims=True)
+    observation_matrix = rng.random((len(chord_list), 12)) + 0.1
+    observation_matrix /= observation_matrix.sum(axis=1, keepdims=True)
+
+    return chord_list, transition_matrix, observation_matrix
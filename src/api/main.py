@@ -1,17 +1,44 @@
+import asyncio
 import shutil
-from basic_pitch.inference import predict_and_save
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydub import AudioSegment
 from pathlib import Path
 import os
-from auto_accompany.song_convert import convert_to_midi
-from data_process.generatemusic import generate_music
-app = FastAPI()
+import time
+from auto_accompany.pipeline import (analyze_vocal, get_result_file, process_vocal, reharmonize_vocal, remix_vocal,
+                                     warm_up)
+from data_process.delivery import encode_audio, encoded_formats, get_etag, iter_file, parse_range
+from data_process.profiling import metrics, track_stages
 
+# the state of the warm up, reported by /ready
+warm_up_state = {"ready": False, "cold_start": None, "stages": [], "error": None}
 
-app.mount("/static", StaticFiles(directory="C:/Users/Hsieh/Documents/nccucs/specialTopic/special_topic/src/api/"), name="static")
+
+def run_warm_up(started):
+    try:
+        warm_up_state["stages"] = warm_up()
+        warm_up_state["ready"] = True
+    except Exception as e:
+        print(e)
+        warm_up_state["error"] = str(e)
+    warm_up_state["cold_start"] = time.perf_counter() - started
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # warm up off the event loop, the server answers /ready meanwhile
+    asyncio.get_running_loop().run_in_executor(None, run_warm_up, time.perf_counter())
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+app.mount("/static", StaticFiles(directory=os.path.dirname(os.path.realpath(__file__))), name="static")
 
 
 origins = [
@@ -66,15 +93,169 @@ async def upload_file(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 
+# the handlers running the pipeline are plain functions, fastapi runs them in
+# its thread pool instead of blocking the event loop
 @app.get("/process")
-async def process_file():
+def process_file(pitch_correction: bool = False, profile: bool = False, segments_per_measure: int = 1,
+                 n_best: int = 1):
+    if segments_per_measure not in (1, 2, 4):
+        raise HTTPException(
+            status_code=400, detail="segments_per_measure must be 1, 2 or 4.")
+    if not 1 <= n_best <= 10:
+        raise HTTPException(
+            status_code=400, detail="n_best must be between 1 and 10.")
+    if n_best > 1 and segments_per_measure > 1:
+        raise HTTPException(
+            status_code=400, detail="n_best needs one chord per measure.")
+
+    script_directory = Path(__file__).resolve().parent
+    vocal_file = script_directory / "uploaded_files" / "wqeqweqwe.wav"
+    vocal_midi_output = os.path.join(script_directory, "midi", "wqeqweqwe.mid")
+
+    # dump the cProfile stats of this request on demand
+    profile_file = None
+    if profile:
+        profile_folder = script_directory / "profiles"
+        profile_folder.mkdir(exist_ok=True)
+        profile_file = str(profile_folder / f"process_{int(time.time())}.prof")
+
+    try:
+        with track_stages(profile_file) as timer:
+            progressions = process_vocal(vocal_file, vocal_midi_output, pitch_correction,
+                                         segments_per_measure=segments_per_measure, n_best=n_best)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
+    return {"status": "success", "stages": timer.as_dict(), "profile": profile_file,
+            "progressions": [{"rank": rank, "logprob": logprob, "chords": chords}
+                             for rank, (logprob, chords) in enumerate(progressions)]}
+
+
+@app.get("/analyze")
+def analyze_file(pitch_correction: bool = False, segments_per_measure: int = 1, n_best: int = 1):
+    if segments_per_measure not in (1, 2, 4):
+        raise HTTPException(
+            status_code=400, detail="segments_per_measure must be 1, 2 or 4.")
+    if not 1 <= n_best <= 10:
+        raise HTTPException(
+            status_code=400, detail="n_best must be between 1 and 10.")
+    if n_best > 1 and segments_per_measure > 1:
+        raise HTTPException(
+            status_code=400, detail="n_best needs one chord per measure.")
+
+    script_directory = Path(__file__).resolve().parent
+    vocal_file = script_directory / "uploaded_files" / "wqeqweqwe.wav"
+    vocal_midi_output = os.path.join(script_directory, "midi", "wqeqweqwe.mid")
+
+    # no rendering, the audio stages are cached for a later /process
+    try:
+        with track_stages() as timer:
+            analysis = analyze_vocal(vocal_file, vocal_midi_output, pitch_correction,
+                                     segments_per_measure=segments_per_measure, n_best=n_best)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
+    return {"status": "success", "stages": timer.as_dict(), "key": analysis["key"],
+            "time_signature": analysis["time_signature"], "tempo": analysis["tempo"],
+            "downbeats": analysis["downbeats"], "chords": analysis["chord_sequence"],
+            "progressions": [{"rank": rank, "logprob": logprob, "chords": chords}
+                             for rank, (logprob, chords) in enumerate(analysis["progressions"])]}
+
+
+@app.post("/reharmonize")
+def reharmonize_file(pins: dict[int, str] = Body(..., embed=True), pitch_correction: bool = False):
     script_directory = Path(__file__).resolve().parent
     vocal_file = script_directory / "uploaded_files" / "wqeqweqwe.wav"
     vocal_midi_output = os.path.join(script_directory, "midi", "wqeqweqwe.mid")
+
+    # the measures between the pins are decoded again, only the changed bars are rendered
+    try:
+        with track_stages() as timer:
+            logprob, chords = reharmonize_vocal(vocal_file, vocal_midi_output, pins, pitch_correction)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Error: {e}")
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
+    return {"status": "success", "stages": timer.as_dict(), "logprob": logprob, "chords": chords}
+
+
+@app.get("/remix")
+def remix_file(vocal_gain: float = None, piano_gain: float = None, drum_gain: float = None,
+               mute: list[str] = Query([]), stream: bool = False):
+    if not set(mute) <= {"vocal", "piano", "drum"}:
+        raise HTTPException(
+            status_code=400, detail="mute must be vocal, piano or drum.")
+
+    # only the given gains replace the default mix
+    gains = {name: gain for name, gain in [("vocal", vocal_gain), ("piano", piano_gain), ("drum", drum_gain)]
+             if gain is not None}
     try:
-        convert_to_midi(vocal_file, vocal_midi_output)
-        generate_music(vocal_file, vocal_midi_output)
+        if stream:
+            # the wav blocks are sent while they are mixed
+            return StreamingResponse(remix_vocal(gains, mute, streaming=True), media_type="audio/wav")
+        with track_stages() as timer:
+            output_file = remix_vocal(gains, mute)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=409, detail=f"Error: {e}, process the song first.")
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=f"Error: {e}")
-    return {"status": "success"}
+    return {"status": "success", "stages": timer.as_dict(), "output_file": output_file}
+
+
+def file_response(request: Request, file, media_type):
+    # the file with its ETag, a single byte range is served as 206
+    etag = get_etag(file)
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    size = os.path.getsize(file)
+    range_header = request.headers.get("range")
+    if range_header is None or request.headers.get("if-range", etag) != etag:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file(file), media_type=media_type, headers=headers)
+
+    byte_range = parse_range(range_header, size)
+    if byte_range is None:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+    return StreamingResponse(iter_file(file, start, end), status_code=206, media_type=media_type, headers=headers)
+
+
+@app.get("/result")
+async def get_result(request: Request, format: str = "wav"):
+    if format != "wav" and format not in encoded_formats:
+        raise HTTPException(
+            status_code=400, detail=f"format must be wav or one of {', '.join(encoded_formats)}.")
+
+    combined_file = get_result_file()
+    if not os.path.exists(combined_file):
+        raise HTTPException(status_code=404, detail="No mix yet, process the song first.")
+    if format == "wav":
+        return file_response(request, combined_file, "audio/wav")
+
+    # the encoded file is kept until the mix changes
+    encoded_file = os.path.splitext(combined_file)[0] + f".{format}"
+    media_type = encoded_formats[format][1]
+    if os.path.exists(encoded_file) and os.stat(encoded_file).st_mtime_ns >= os.stat(combined_file).st_mtime_ns:
+        return file_response(request, encoded_file, media_type)
+
+    # encoded on the fly, the first bytes are sent before the encoder is done
+    if shutil.which("ffmpeg") is None:
+        raise HTTPException(status_code=501, detail="ffmpeg is needed to encode the mix.")
+    return StreamingResponse(encode_audio(iter_file(combined_file), format, encoded_file), media_type=media_type)
+
+
+@app.get("/ready")
+async def ready():
+    if not warm_up_state["ready"]:
+        return JSONResponse(status_code=503, content=warm_up_state)
+    return warm_up_state
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
@@ -0,0 +1,161 @@
+from wave import open
+import numpy as np
+import AutoTune
+from pychord.utils import note_to_val
+from auto_accompany.shared_buffer import SharedArray, attach
+
+FORM_CORR = 0
+SCALE_ROTATE = 0
+LFO_QUANT = 0
+CONCERT_A = 440.0
+FIXED_PITCH = 2.0
+FIXED_PULL = 0.1
+CORR_STR = 1.0
+CORR_SMOOTH = 0.0
+PITCH_SHIFT = 0.0
+LFO_DEPTH = 0.1
+LFO_RATE = 1.0
+LFO_SHAPE = 0.0
+LFO_SYMM = 0.0
+FORM_WARP = 0.0
+MIX = 1.0
+CHUNK = 4096
+
+# int16 full scale
+SCALE = 1 << 15
+
+
+def tune_chunk(signal_chunk: np.array, fs: int, key: str = "f") -> np.array:
+    """
+    Pitch corrects one mono chunk.
+
+    :param signal_chunk: float32 samples in [-1, 1)
+    :param fs: the sampling frequency
+    :param key: the key given to AutoTune.Tuner
+    :return: the tuned float samples
+    """
+
+    signal_chunk = np.ascontiguousarray(signal_chunk, dtype=np.float32)
+    raw_from_c = AutoTune.Tuner(signal_chunk, fs, len(signal_chunk), SCALE_ROTATE, LFO_QUANT, FORM_CORR, CONCERT_A,
+                                FIXED_PITCH, FIXED_PULL, CORR_STR, CORR_SMOOTH, PITCH_SHIFT, LFO_DEPTH, LFO_RATE,
+                                LFO_SHAPE, LFO_SYMM, FORM_WARP, MIX, key.encode())
+
+    return np.asarray(raw_from_c, dtype=np.float32)
+
+
+def get_autotune_key(key_signature: str) -> str:
+    """
+    Converts a key signature to the key character of AutoTune.Tuner: the
+    lower case letter for a natural major key and the upper case letter for
+    the sharp one above it ("c" is C major, "C" is C# major). A minor key
+    uses its relative major, which has the same scale tones.
+
+    :param key_signature: the key signature, e.g. 'Bb:maj' or 'A:min'
+    :return: the AutoTune key
+    """
+
+    tonic, quality = key_signature.split(':')
+    tonic = note_to_val(tonic)
+    if quality == 'min':
+        tonic = (tonic + 3) % 12
+
+    return ['c', 'C', 'd', 'D', 'e', 'f', 'F', 'g', 'G', 'a', 'A', 'b'][tonic]
+
+
+def tune_buffer(signal: np.array, fs: int, key: str = "f", chunk: int = CHUNK, out: np.array = None) -> np.array:
+    """
+    Pitch corrects a mono float buffer already in memory.
+
+    :param signal: float32 samples in [-1, 1)
+    :param fs: the sampling frequency
+    :param key: the key given to AutoTune.Tuner
+    :param chunk: the number of samples per call of the tuner
+    :param out: the float32 buffer to write the tuned samples to, allocated if None
+    :return: the tuned float32 buffer
+    """
+
+    tuned = np.empty(len(signal), dtype=np.float32) if out is None else out
+    for i in range(0, len(signal), chunk):
+        tuned[i:i+chunk] = tune_chunk(signal[i:i+chunk], fs, key)
+
+    return tuned
+
+
+def tune_shared(signal_buffer: SharedArray, tuned_buffer: SharedArray, fs: int, key: str = "f") -> None:
+    """
+    Pitch corrects a buffer in shared memory into another one, so a worker
+    process neither receives nor sends back the samples.
+
+    :param signal_buffer: the handle of the float32 samples
+    :param tuned_buffer: the handle of the float32 buffer of the tuned samples
+    :param fs: the sampling frequency
+    :param key: the key given to AutoTune.Tuner
+    :return: None
+    """
+
+    with attach(signal_buffer) as signal, attach(tuned_buffer) as tuned:
+        tune_buffer(signal, fs, key, out=tuned)
+        # drop the views, so the blocks are closed on the way out
+        del signal, tuned
+
+    return None
+
+
+def tune_blocks(wave_reader, key: str = "f", chunk: int = CHUNK):
+    """
+    Reads a 16 bit wav in fixed blocks and yields the tuned blocks, so
+    memory stays constant for long recordings.
+
+    :param wave_reader: the opened wave file
+    :param key: the key given to AutoTune.Tuner
+    :param chunk: the number of frames per block
+    :return: generator of int16 arrays shaped (frames, channels)
+    """
+
+    if wave_reader.getsampwidth() != 2:
+        raise ValueError("Only 16 bit wav files are supported")
+
+    n_channels = wave_reader.getnchannels()
+    fs = wave_reader.getframerate()
+
+    while True:
+        frames = wave_reader.readframes(chunk)
+        if not frames:
+            break
+
+        # de-interleave the channels and tune each one
+        signal = np.frombuffer(frames, dtype=np.int16).reshape(-1, n_channels)
+        tuned = np.empty(signal.shape, dtype=np.float32)
+        for channel in range(n_channels):
+            tuned[:, channel] = tune_chunk(signal[:, channel] / SCALE, fs, key)
+
+        yield np.clip(tuned * SCALE, -SCALE, SCALE - 1).astype(np.int16)
+
+
+def auto_tune(in_file, out_file, key="f", chunk=CHUNK):
+    """
+    Pitch corrects a 16 bit wav file block by block.
+
+    :param in_file: the input .wav file
+    :param out_file: the output .wav file
+    :param key: the key given to AutoTune.Tuner
+    :param chunk: the number of frames per block
+    :return: None
+    """
+
+    with open(in_file, 'rb') as wf, open(out_file, 'wb') as fout:
+
+        #### Setup to Write an Out Wav File####
+        fout.setnchannels(wf.getnchannels())
+        fout.setsampwidth(2)  # Sample is 2 Bytes (2) if int16 = short int
+        fout.setframerate(wf.getframerate())  # Sampling Frequency
+        fout.setcomptype('NONE', 'Not Compressed')
+
+        for block in tune_blocks(wf, key, chunk):
+            # interleaved int16 bytes without unpacking every sample
+            fout.writeframesraw(block.tobytes())
+
+
+if __name__ == "__main__":
+    import sys
+    auto_tune(sys.argv[1], sys.argv[2], *sys.argv[3:])
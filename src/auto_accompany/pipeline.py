@@ -0,0 +1,269 @@
+import importlib
+import multiprocessing
+import os
+
+# keep the numba compiled librosa functions across restarts, must be set
+# before librosa is imported
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "auto_accompany", "numba"))
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from auto_accompany.shared_buffer import get_array, release, share_array
+from auto_accompany.song_convert import (AUDIO_SAMPLE_RATE, load_model, transcribe_active_spans, transcribe_audio,
+                                         transcribe_audio_chunked)
+from data_process.profiling import stage, track_stages
+
+# the modules imported by the warm up instead of at import time
+heavy_modules = ["librosa", "music21", "pretty_midi", "data_process.generatemusic"]
+
+# recordings longer than this (seconds) are transcribed in chunks across cores
+chunked_transcription_seconds = 300
+
+# the worker pool of the cpu bound stages, created on first use
+_pool = None
+
+# the audio stages of the recent jobs, shared by the analysis and the full render
+max_cached_jobs = 8
+_stage_cache = OrderedDict()
+
+# the analysis of the recent jobs for each decoding setting, kept for the edits
+_analysis_cache = OrderedDict()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    Gets the worker pool shared by the requests.
+    :return: the process pool
+    """
+
+    global _pool
+    if _pool is None:
+        # spawned, the warm up has started tensorflow in this process
+        _pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def get_job_key(vocal_file, pitch_correction) -> tuple:
+    """
+    Gets the key of a job in the stage cache, a new upload of the vocal
+    (size or modification time) is a new job.
+    :param vocal_file: the path to the vocal file
+    :param pitch_correction: the vocal is pitch corrected
+    :return: the job key
+    """
+
+    status = os.stat(vocal_file)
+    return os.path.abspath(vocal_file), status.st_size, status.st_mtime_ns, pitch_correction
+
+
+def prepare_vocal(vocal_file, vocal_midi_output, pitch_correction=False):
+    """
+    Runs the audio stages of a job (load, beat tracking, pitch correction,
+    transcription) once, the result is kept in the stage cache. The audio is
+    loaded once and the same buffer is used by every stage.
+    :param vocal_file: the path to the .mp3 or .wav vocal file
+    :param vocal_midi_output: the path of the transcribed vocal .mid file, only written when
+        the note activations are not kept (chunked transcription)
+    :param pitch_correction: pitch correct the vocal before the transcription
+    :return: beat_info, note_activation (None if not kept by the transcription)
+    """
+
+    job_key = get_job_key(vocal_file, pitch_correction)
+    if job_key in _stage_cache:
+        _stage_cache.move_to_end(job_key)
+        beat_info, note_activation, midi_data = _stage_cache[job_key]
+        # the midi path is shared by the jobs, the notes of this one are written again
+        if midi_data is not None:
+            midi_data.write(vocal_midi_output)
+        return beat_info, note_activation
+
+    # the heavy modules are imported by the first request (or the warm up)
+    import librosa
+    from data_process.song_analyze import detect_voice_activity, estimate_key_from_audio, get_beat_info_from_audio
+
+    # the shared in-memory buffer, basic-pitch and librosa both use 22050 Hz
+    with stage("load"):
+        audio, sr = librosa.load(vocal_file, sr=AUDIO_SAMPLE_RATE, mono=True)
+
+    # the buffers exchanged with the workers by name, freed after the transcription
+    shared_buffers = []
+    try:
+        tuned_future = None
+        if pitch_correction:
+            # the AutoTune extension is only needed by this optional stage
+            from auto_accompany.autoTune import get_autotune_key, tune_shared
+
+            # the tuner runs in the pool while the beats are tracked here
+            with stage("audio_key_detection"):
+                key_signature = estimate_key_from_audio(audio, sr)
+            shared_buffers = [share_array(audio), share_array(shape=audio.shape, dtype=np.float32)]
+            tuned_future = get_pool().submit(tune_shared, *shared_buffers, sr, get_autotune_key(key_signature))
+
+        with stage("beat_tracking"):
+            beat_info = get_beat_info_from_audio(audio, sr)
+
+        if tuned_future is not None:
+            with stage("pitch_correction"):
+                tuned_future.result()
+                audio = get_array(shared_buffers[1])
+
+        # the silent lead-ins and gaps are not transcribed
+        with stage("voice_activity"):
+            spans = detect_voice_activity(audio, sr)
+            active_seconds = sum(end - start for start, end in spans)
+
+        # the chord emission is read from the note activations of the model when
+        # they are kept, no notes or midi are made for them. The chunked
+        # transcription only sends the notes back, they are written to the midi.
+        note_activation = None
+        midi_data = None
+        with stage("transcription"):
+            chunked = active_seconds > chunked_transcription_seconds
+            if active_seconds < 0.9 * len(audio) / sr:
+                note_activation, midi_data, _ = transcribe_active_spans(
+                    audio, spans, vocal_midi_output if chunked else None, chunked, extract_notes=False)
+            elif chunked:
+                midi_data, _ = transcribe_audio_chunked(audio, vocal_midi_output)
+            else:
+                model_output, _, _ = transcribe_audio(audio, extract_notes=False)
+                note_activation = model_output["note"]
+    finally:
+        for shared_buffer in shared_buffers:
+            release(shared_buffer)
+
+    _stage_cache[job_key] = beat_info, note_activation, midi_data
+    while len(_stage_cache) > max_cached_jobs:
+        _stage_cache.popitem(last=False)
+
+    return beat_info, note_activation
+
+
+def analyze_vocal(vocal_file, vocal_midi_output, pitch_correction=False, transition_order=1, segments_per_measure=1,
+                  n_best=1):
+    """
+    Runs the pipeline up to the chord decoding, nothing is rendered. The
+    audio stages are shared with process_vocal through the stage cache.
+    :param vocal_file: the path to the .mp3 or .wav vocal file
+    :param vocal_midi_output: the path to write the transcribed vocal .mid file
+    :param pitch_correction: pitch correct the vocal before the transcription
+    :param transition_order: the order of the chord transition model
+    :param segments_per_measure: 1 chord per measure, 2 per half bar or 4 per beat at most
+    :param n_best: the number of alternative chord progressions
+    :return: the analysis dict of analyze_music
+    """
+
+    from data_process.generatemusic import analyze_music
+
+    beat_info, note_activation = prepare_vocal(vocal_file, vocal_midi_output, pitch_correction)
+
+    analysis = analyze_music(vocal_file, vocal_midi_output, transition_order, beat_info,
+                             segments_per_measure=segments_per_measure, n_best=n_best, note_activation=note_activation)
+
+    analysis_key = get_job_key(vocal_file, pitch_correction), transition_order, segments_per_measure
+    _analysis_cache[analysis_key] = analysis
+    while len(_analysis_cache) > max_cached_jobs:
+        _analysis_cache.popitem(last=False)
+
+    return analysis
+
+
+def process_vocal(vocal_file, vocal_midi_output, pitch_correction=False, transition_order=1, segments_per_measure=1,
+                  n_best=1):
+    """
+    Runs the whole accompaniment pipeline on a vocal take.
+    :param vocal_file: the path to the .mp3 or .wav vocal file
+    :param vocal_midi_output: the path to write the transcribed vocal .mid file
+    :param pitch_correction: pitch correct the vocal before the transcription
+    :param transition_order: the order of the chord transition model
+    :param segments_per_measure: 1 chord per measure, 2 per half bar or 4 per beat at most
+    :param n_best: the number of alternative chord progressions to render
+    :return: the list of (logprob, chord progression) from the best
+    """
+
+    from data_process.generatemusic import generate_music
+
+    analysis = analyze_vocal(vocal_file, vocal_midi_output, pitch_correction, transition_order,
+                             segments_per_measure, n_best)
+
+    return generate_music(vocal_file, vocal_midi_output, analysis=analysis)
+
+
+def reharmonize_vocal(vocal_file, vocal_midi_output, pins, pitch_correction=False, transition_order=1):
+    """
+    Decodes the job again with some measures pinned to a chord and
+    re-renders only the changed bars. The last analysis of the job is used,
+    the job is analyzed first if it is not cached.
+    :param vocal_file: the path to the .mp3 or .wav vocal file
+    :param vocal_midi_output: the path to write the transcribed vocal .mid file
+    :param pins: measure index to the chord name it is pinned to
+    :param pitch_correction: pitch correct the vocal before the transcription
+    :param transition_order: the order of the chord transition model
+    :return: logprob, the new chord progression
+    """
+
+    from data_process.generatemusic import reharmonize_music
+
+    analysis_key = get_job_key(vocal_file, pitch_correction), transition_order, 1
+    analysis = _analysis_cache.get(analysis_key)
+    if analysis is None:
+        analysis = analyze_vocal(vocal_file, vocal_midi_output, pitch_correction, transition_order)
+
+    return reharmonize_music(vocal_file, analysis, pins)
+
+
+def remix_vocal(gains=None, mutes=(), streaming=False):
+    """
+    Mixes the stems of the last rendered job again, with the gain of each
+    stem in dB and some stems muted.
+    :param gains: stem name (vocal, piano, drum) to its gain in dB
+    :param mutes: the stem names left out of the mix
+    :param streaming: return the chunks of the wav file while it is mixed
+    :return: the file name of the mix, or the iterator of its chunks if streaming
+    """
+
+    from data_process.generatemusic import remix_music
+
+    return remix_music(gains, mutes, streaming)
+
+
+def get_result_file():
+    """
+    Gets the wav file of the last mix.
+    :return: the file name of the mix
+    """
+
+    from data_process.generatemusic import combined_file
+
+    return combined_file
+
+
+def warm_up():
+    """
+    Imports the heavy modules, loads the models and compiles the numba
+    functions, so the first request does not pay for them.
+    :return: the timing of each warm up stage
+    """
+
+    with track_stages() as timer:
+        with stage("warm_up_import"):
+            for module in heavy_modules:
+                importlib.import_module(module)
+            from data_process.model_artifact import load_chord_table, load_key_tables
+            from data_process.song_analyze import get_beat_info_from_audio
+
+        with stage("warm_up_model_artifact"):
+            load_key_tables()
+            load_chord_table()
+
+        # a few seconds of noise run through the numba compiled beat tracker
+        audio = np.random.default_rng(0).standard_normal(4 * AUDIO_SAMPLE_RATE).astype(np.float32) * 0.1
+        with stage("warm_up_numba"):
+            get_beat_info_from_audio(audio, AUDIO_SAMPLE_RATE)
+
+        # the first call of the saved model traces its graph
+        with stage("warm_up_transcription_model"):
+            load_model()
+            transcribe_audio(audio)
+
+    return timer.as_dict()
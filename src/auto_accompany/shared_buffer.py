@@ -0,0 +1,170 @@
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+
+# the shared buffers created by this process, name -> [shared memory, reference count, address]
+_owned = {}
+_lock = threading.Lock()
+
+# the blocks freed or detached while an array still viewed them, closed later
+_pending_close = []
+
+
+class SharedArray:
+    """
+    The handle of a numpy array in shared memory, only the name, shape and
+    dtype are pickled when it is sent to a worker.
+
+    Attributes:
+        name (str): the name of the shared memory block
+        shape (tuple): the shape of the array
+        dtype (str): the dtype of the array
+
+    Examples usage:
+        buffer = share_array(audio)
+        future = pool.submit(worker, buffer)
+        ...
+        release(buffer)
+    """
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+
+    def __repr__(self):
+        return f"SharedArray({self.name!r}, {self.shape}, {self.dtype!r})"
+
+
+def share_array(array=None, shape=None, dtype=np.float32) -> SharedArray:
+    """
+    Puts an array in shared memory with a reference count of one. An array
+    already backed by a shared buffer of this process is not copied, its
+    buffer is retained instead.
+    :param array: the array to copy in, an empty buffer of shape and dtype if None
+    :param shape: the shape of the empty buffer
+    :param dtype: the dtype of the empty buffer
+    :return: the handle of the buffer
+    """
+
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        with _lock:
+            for name, entry in _owned.items():
+                if array.nbytes and entry[2] == array.ctypes.data and entry[0].size >= array.nbytes:
+                    entry[1] += 1
+                    return SharedArray(name, array.shape, array.dtype)
+        shape, dtype = array.shape, array.dtype
+
+    nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    block = shared_memory.SharedMemory(create=True, size=nbytes)
+    handle = SharedArray(block.name, shape, dtype)
+    view = get_array(handle, block)
+    if array is not None:
+        view[...] = array
+
+    with _lock:
+        _owned[block.name] = [block, 1, view.ctypes.data]
+
+    return handle
+
+
+def retain(handle) -> SharedArray:
+    """
+    Adds a reference to a buffer of this process, e.g. for a second stage
+    that reads it.
+    :param handle: the handle of the buffer
+    :return: the handle
+    """
+
+    with _lock:
+        _owned[handle.name][1] += 1
+    return handle
+
+
+def release(handle) -> None:
+    """
+    Drops a reference to a buffer of this process, the shared memory is
+    freed with the last one.
+    :param handle: the handle of the buffer
+    :return: None
+    """
+
+    with _lock:
+        entry = _owned[handle.name]
+        entry[1] -= 1
+        if entry[1] > 0:
+            return None
+        del _owned[handle.name]
+
+    entry[0].unlink()
+    _close(entry[0])
+
+    return None
+
+
+def _close(block) -> None:
+    """
+    Closes a shared memory block, or keeps it for a later try while an array
+    still views it. The blocks kept before are tried again.
+    :param block: the shared memory block, None to only try the kept ones
+    :return: None
+    """
+
+    with _lock:
+        blocks = _pending_close + ([block] if block is not None else [])
+        _pending_close.clear()
+        for i in blocks:
+            try:
+                i.close()
+            except BufferError:
+                _pending_close.append(i)
+
+    return None
+
+
+def get_array(handle, block=None) -> np.array:
+    """
+    Gets the array of a buffer created by this process, without a copy.
+    :param handle: the handle of the buffer
+    :param block: the shared memory block, looked up if None
+    :return: the array viewing the shared memory
+    """
+
+    if block is None:
+        with _lock:
+            block = _owned[handle.name][0]
+    return _view(handle, block)
+
+
+def _view(handle, block) -> np.array:
+    """
+    Views a shared memory block as the array of the handle. The array holds
+    an export of the block buffer (np.ndarray(buffer=...) does not), so the
+    block is not closed under it.
+    :param handle: the handle of the buffer
+    :param block: the shared memory block
+    :return: the array viewing the shared memory
+    """
+
+    count = int(np.prod(handle.shape))
+    return np.frombuffer(block.buf, dtype=handle.dtype, count=count).reshape(handle.shape)
+
+
+@contextmanager
+def attach(handle):
+    """
+    Attaches a worker to a buffer of another process. The parent owns the
+    buffer, so it is only closed here, never unlinked.
+    :param handle: the handle of the buffer
+    :return: the array viewing the shared memory
+    """
+
+    # the pool workers share the resource tracker of the parent, which
+    # keeps one entry per name, so attaching does not change who frees it
+    block = shared_memory.SharedMemory(name=handle.name)
+    try:
+        yield _view(handle, block)
+    finally:
+        _close(block)
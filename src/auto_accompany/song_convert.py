@@ -1,5 +1,15 @@
+import multiprocessing
 import os
-from basic_pitch.inference import predict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import numpy as np
+from auto_accompany.shared_buffer import attach, release, share_array
+
+# basic_pitch.constants of basic-pitch 0.2.4, repeated here so the module (the
+# note stitching, the pipeline) imports without basic-pitch and tensorflow
+AUDIO_SAMPLE_RATE = 22050
+FFT_HOP = 256
+AUDIO_N_SAMPLES = AUDIO_SAMPLE_RATE * 2 - FFT_HOP
 
 
 def convert_to_midi(file_path, midi_path):
@@ -10,11 +20,292 @@ def convert_to_midi(file_path, midi_path):
     :return: None
     """
 
+    # basic_pitch.inference imports tensorflow, only pay for it here
+    from basic_pitch.inference import predict
+
     model_output, midi_data, note_events = predict(file_path)
 
     midi_data.write(midi_path)
     print("success")
 
 
+@lru_cache(maxsize=None)
+def load_model():
+    """
+    Loads the basic-pitch model once per process.
+    :return: the loaded model
+    """
+
+    import tensorflow as tf
+    from basic_pitch import ICASSP_2022_MODEL_PATH
+
+    return tf.saved_model.load(str(ICASSP_2022_MODEL_PATH))
+
+
+def window_audio(audio, overlap_len, hop_size):
+    """
+    Splits the audio into the overlapping windows fed to the model, the
+    same way as basic_pitch.inference.get_audio_input but from memory.
+    :param audio: the mono waveform at basic-pitch's sampling rate
+    :param overlap_len: the number of samples shared by two windows
+    :param hop_size: the number of samples between two windows
+    :return: the (n_windows, AUDIO_N_SAMPLES, 1) windows
+    """
+
+    audio = np.concatenate([np.zeros(overlap_len // 2, dtype=np.float32), audio.astype(np.float32)])
+
+    n_windows = int(np.ceil(len(audio) / hop_size))
+    audio = np.pad(audio, (0, (n_windows - 1) * hop_size + AUDIO_N_SAMPLES - len(audio)))
+    windows = np.lib.stride_tricks.sliding_window_view(audio, AUDIO_N_SAMPLES)[::hop_size]
+
+    return windows[:n_windows, :, None]
+
+
+def transcribe_audio(audio, midi_path=None, onset_threshold=0.5, frame_threshold=0.3, minimum_note_length=58,
+                     extract_notes=True):
+    """
+    Transcribes an in-memory mono waveform sampled at AUDIO_SAMPLE_RATE,
+    so a processed buffer (e.g. pitch corrected) needs no file round trip.
+    :param audio: the mono waveform
+    :param midi_path: the path to write the .mid file, not written if None
+    :param onset_threshold: the minimum energy required for an onset
+    :param frame_threshold: the minimum energy requirement for a frame
+    :param minimum_note_length: the minimum allowed note length in ms
+    :param extract_notes: create the note events and the midi, only the model output is kept if False
+    :return: model_output, midi_data, note_events as basic_pitch.inference.predict,
+        midi_data and note_events are None if not extract_notes
+    """
+
+    from basic_pitch.inference import unwrap_output
+
+    n_overlapping_frames = 30
+    overlap_len = n_overlapping_frames * FFT_HOP
+    hop_size = AUDIO_N_SAMPLES - overlap_len
+
+    output = load_model()(window_audio(audio, overlap_len, hop_size))
+    model_output = {k: unwrap_output(output[k], len(audio), n_overlapping_frames) for k in output}
+    if not extract_notes:
+        return model_output, None, None
+
+    # the note creation pulls in librosa, resampy and mir_eval
+    from basic_pitch import note_creation as infer
+
+    min_note_len = int(np.round(minimum_note_length / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+    midi_data, note_events = infer.model_output_to_notes(
+        model_output, onset_thresh=onset_threshold, frame_thresh=frame_threshold, min_note_len=min_note_len,
+        min_freq=None, max_freq=None, multiple_pitch_bends=False, melodia_trick=True)
+
+    if midi_path is not None:
+        midi_data.write(midi_path)
+
+    return model_output, midi_data, note_events
+
+
+# the transcription workers, created on first use for a worker count and thread budget
+_transcription_pools = {}
+
+
+def _set_thread_budget(threads_per_worker):
+    """
+    Limits the threads of tensorflow in a transcription worker, run before
+    the model is loaded.
+    :param threads_per_worker: the intra-op threads of each worker
+    :return: None
+    """
+
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads_per_worker)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def get_transcription_pool(n_workers, threads_per_worker):
+    """
+    Gets the process pool of the chunked transcription.
+    :param n_workers: the number of worker processes
+    :param threads_per_worker: the intra-op threads of each worker
+    :return: the process pool
+    """
+
+    key = (n_workers, threads_per_worker)
+    if key not in _transcription_pools:
+        # spawned, a fork would copy the tensorflow context (and its thread
+        # pools) the warm up already started in this process
+        _transcription_pools[key] = ProcessPoolExecutor(
+            n_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_set_thread_budget, initargs=(threads_per_worker,))
+    return _transcription_pools[key]
+
+
+def _transcribe_chunk(audio_buffer, window_start, window_end, onset_threshold, frame_threshold, minimum_note_length):
+    """
+    Transcribes one chunk in a worker, the chunk is read from the shared
+    buffer of the song and only the note events are sent back.
+    :return: the note events of the chunk, times relative to the chunk
+    """
+
+    with attach(audio_buffer) as audio:
+        model_output, midi_data, note_events = transcribe_audio(
+            audio[window_start:window_end], None, onset_threshold, frame_threshold, minimum_note_length)
+        # drop the view, so the block is closed on the way out
+        del audio
+    return note_events
+
+
+def stitch_note_events(chunk_events, chunk_bounds, tolerance=0.05):
+    """
+    Joins the note events of overlapping chunks. A chunk keeps the notes
+    starting in the part of the song it owns, plus the notes starting in its
+    leading overlap and still sounding at the start of its part (a note the
+    previous chunk cut at its window end). Only the notes crossing a chunk
+    boundary are merged with the same pitch note they overlap, a note sung
+    again right after itself inside a chunk is kept.
+    :param chunk_events: the note events of each chunk, times relative to the chunk
+    :param chunk_bounds: (window_start, owned_start, owned_end) of each chunk in seconds
+    :param tolerance: the gap in seconds under which two same pitch notes are merged
+    :return: the note events of the whole song sorted by start time
+    """
+
+    # each note with whether it crosses the start or the end of the owned part
+    note_events = []
+    for events, (window_start, owned_start, owned_end) in zip(chunk_events, chunk_bounds):
+        for start, end, pitch, amplitude, bends in events:
+            start, end = start + window_start, end + window_start
+            continued = window_start < owned_start and start < owned_start < end
+            if owned_start <= start < owned_end or continued:
+                note_events.append(((start, end, pitch, amplitude, bends), continued or end > owned_end))
+
+    # merge the duplicates and the continued notes of each pitch
+    note_events.sort(key=lambda item: (item[0][2], item[0][0]))
+    merged = []
+    for event, boundary in note_events:
+        if merged and (boundary or merged[-1][1]) and merged[-1][0][2] == event[2] \
+                and event[0] <= merged[-1][0][1] + tolerance:
+            start, end, pitch, amplitude, bends = merged[-1][0]
+            merged[-1] = (start, max(end, event[1]), pitch, max(amplitude, event[3]), bends), True
+        else:
+            merged.append((event, boundary))
+
+    return sorted((event for event, _ in merged), key=lambda event: (event[0], event[2]))
+
+
+def transcribe_audio_chunked(audio, midi_path=None, chunk_seconds=60.0, overlap_seconds=2.0, n_workers=None,
+                             threads_per_worker=1, onset_threshold=0.5, frame_threshold=0.3, minimum_note_length=58):
+    """
+    Transcribes a long recording in overlapping chunks across a process pool,
+    so the run time scales with the cores and the memory with the chunk size.
+    :param audio: the mono waveform at AUDIO_SAMPLE_RATE
+    :param midi_path: the path to write the .mid file, not written if None
+    :param chunk_seconds: the length of the part of the song each chunk owns
+    :param overlap_seconds: the context added on both sides of each chunk
+    :param n_workers: the number of worker processes, the cpu count if None
+    :param threads_per_worker: the tensorflow intra-op threads of each worker
+    :param onset_threshold: the minimum energy required for an onset
+    :param frame_threshold: the minimum energy requirement for a frame
+    :param minimum_note_length: the minimum allowed note length in ms
+    :return: midi_data, note_events
+    """
+
+    from basic_pitch import note_creation as infer
+
+    if n_workers is None:
+        n_workers = max((os.cpu_count() or 1) // threads_per_worker, 1)
+
+    chunk_len = int(chunk_seconds * AUDIO_SAMPLE_RATE)
+    overlap_len = int(overlap_seconds * AUDIO_SAMPLE_RATE)
+
+    # the workers read their chunk from shared memory, the samples are not pickled
+    audio_buffer = share_array(np.asarray(audio, dtype=np.float32))
+    try:
+        chunk_bounds = []
+        futures = []
+        pool = get_transcription_pool(n_workers, threads_per_worker)
+        for owned_start in range(0, max(len(audio), 1), chunk_len):
+            window_start = max(owned_start - overlap_len, 0)
+            window_end = min(owned_start + chunk_len + overlap_len, len(audio))
+            chunk_bounds.append((window_start / AUDIO_SAMPLE_RATE, owned_start / AUDIO_SAMPLE_RATE,
+                                 (owned_start + chunk_len) / AUDIO_SAMPLE_RATE))
+            futures.append(pool.submit(_transcribe_chunk, audio_buffer, window_start, window_end,
+                                       onset_threshold, frame_threshold, minimum_note_length))
+
+        note_events = stitch_note_events([future.result() for future in futures], chunk_bounds)
+    finally:
+        release(audio_buffer)
+    midi_data = infer.note_events_to_midi(note_events, False)
+
+    if midi_path is not None:
+        midi_data.write(midi_path)
+
+    return midi_data, note_events
+
+
+def transcribe_active_spans(audio, spans, midi_path=None, chunked=False, gap_seconds=0.5, extract_notes=True,
+                            **thresholds):
+    """
+    Transcribes only the sung parts of the take: the active spans are put
+    back to back (with a short silence between them) in one buffer, and the
+    note times (and the frame note activations) are mapped back to the take.
+    :param audio: the mono waveform at AUDIO_SAMPLE_RATE
+    :param spans: the active [start, end] in seconds, from detect_voice_activity
+    :param midi_path: the path to write the .mid file, not written if None
+    :param chunked: transcribe the gated buffer with transcribe_audio_chunked
+    :param gap_seconds: the silence put between two spans
+    :param extract_notes: create the note events and the midi, always done if chunked
+    :param thresholds: onset_threshold, frame_threshold and minimum_note_length
+    :return: note_activation (frames x 88 of the take, None if chunked), midi_data, note_events,
+        midi_data and note_events are None if the notes are not extracted
+    """
+
+    gap = np.zeros(int(gap_seconds * AUDIO_SAMPLE_RATE), dtype=np.float32)
+    pieces = []
+    gated_starts = []
+    take_starts = []
+    position = 0
+    for start, end in spans:
+        piece = audio[int(start * AUDIO_SAMPLE_RATE):int(end * AUDIO_SAMPLE_RATE)]
+        gated_starts.append(position / AUDIO_SAMPLE_RATE)
+        take_starts.append(start)
+        pieces += [piece, gap]
+        position += len(piece) + len(gap)
+
+    note_events = []
+    note_activation = None
+    if pieces:
+        gated = np.concatenate(pieces)
+        if chunked:
+            _, note_events = transcribe_audio_chunked(gated, **thresholds)
+        else:
+            model_output, _, note_events = transcribe_audio(gated, extract_notes=extract_notes, **thresholds)
+
+            # the frames of each span back to the take, silence elsewhere
+            gated_activation = model_output["note"]
+            note_activation = np.zeros((int(np.ceil(len(audio) / FFT_HOP)), gated_activation.shape[1]),
+                                       dtype=gated_activation.dtype)
+            for (start, end), gated_start in zip(spans, gated_starts):
+                take_frame = int(round(start * AUDIO_SAMPLE_RATE / FFT_HOP))
+                gated_frame = int(round(gated_start * AUDIO_SAMPLE_RATE / FFT_HOP))
+                n_frames = min(int(round((end - start) * AUDIO_SAMPLE_RATE / FFT_HOP)),
+                               len(note_activation) - take_frame, len(gated_activation) - gated_frame)
+                if n_frames > 0:
+                    note_activation[take_frame:take_frame + n_frames] = \
+                        gated_activation[gated_frame:gated_frame + n_frames]
+            if not extract_notes:
+                return note_activation, None, None
+
+    from basic_pitch import note_creation as infer
+
+    # shift every note by the offset of its span
+    shift = np.array(take_starts) - np.array(gated_starts)
+    note_events = [(start + shift[i], end + shift[i], pitch, amplitude, bends)
+                   for start, end, pitch, amplitude, bends in note_events
+                   for i in [max(np.searchsorted(gated_starts, start, side='right') - 1, 0)]]
+
+    midi_data = infer.note_events_to_midi(note_events, False)
+    if midi_path is not None:
+        midi_data.write(midi_path)
+
+    return note_activation, midi_data, note_events
+
+
 if __name__ == '__main__':
     convert_to_midi()
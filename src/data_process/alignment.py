@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import numpy as np
+from scipy import signal
+from pydub import AudioSegment
+
+
+def audio_segment_to_array(segment: AudioSegment) -> (np.array, int):
+    """
+    the function to get the mono samples of an AudioSegment
+
+    Args:
+        segment (AudioSegment): the audio
+
+    Returns:
+        samples (np.array) the mono float samples
+        frame_rate (int) the sampling rate
+    """
+
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    samples = samples.reshape(-1, segment.channels).mean(axis=1)
+
+    return samples, segment.frame_rate
+
+
+def get_onset_envelope(samples: np.array, sr: int, hop_seconds: float = 0.005) -> (np.array, np.array):
+    """
+    the function to get a downsampled onset envelope, the rise of the log
+    energy of every hop
+
+    Args:
+        samples (np.array): the mono samples
+        sr (int): the sampling rate
+        hop_seconds (float): the time between two envelope frames
+
+    Returns:
+        envelope (np.array) the onset strength of each frame
+        frame_times (np.array) the time of each frame in seconds
+    """
+
+    hop = max(int(sr * hop_seconds), 1)
+    n_frames = len(samples) // hop
+    energy = np.sqrt((samples[:n_frames * hop].reshape(n_frames, hop) ** 2).mean(axis=1))
+    log_energy = np.log1p(energy)
+    envelope = np.maximum(np.diff(log_energy, prepend=log_energy[:1]), 0)
+
+    return envelope, np.arange(n_frames) * hop / sr
+
+
+def estimate_offset(reference: np.array, reference_sr: int, vocal: np.array, vocal_sr: int,
+                    hop_seconds: float = 0.005, max_lag_seconds: float = 0.5) -> int:
+    """
+    the function to estimate how late the vocal is against the reference
+    (the rendered beat grid), by the FFT cross-correlation of the onset
+    envelopes on a common time grid
+
+    Args:
+        reference (np.array): the mono samples of the accompaniment
+        reference_sr (int): the sampling rate of the accompaniment
+        vocal (np.array): the mono samples of the vocal
+        vocal_sr (int): the sampling rate of the vocal
+        hop_seconds (float): the resolution of the envelopes
+        max_lag_seconds (float): the largest offset searched
+
+    Returns:
+        the offset in vocal samples, positive when the vocal is late
+    """
+
+    # both envelopes on the same time grid, the sampling rates may differ
+    reference_envelope, reference_times = get_onset_envelope(reference, reference_sr, hop_seconds)
+    vocal_envelope, vocal_times = get_onset_envelope(vocal, vocal_sr, hop_seconds)
+    grid = np.arange(0, min(reference_times[-1], vocal_times[-1]), hop_seconds)
+    if len(grid) < 3:
+        return 0
+    reference_envelope = np.interp(grid, reference_times, reference_envelope)
+    vocal_envelope = np.interp(grid, vocal_times, vocal_envelope)
+
+    correlation = signal.correlate(vocal_envelope - vocal_envelope.mean(),
+                                   reference_envelope - reference_envelope.mean(), mode='full', method='fft')
+    lags = signal.correlation_lags(len(vocal_envelope), len(reference_envelope), mode='full')
+
+    max_lag = int(max_lag_seconds / hop_seconds)
+    window = np.flatnonzero(np.abs(lags) <= max_lag)
+    peak = window[correlation[window].argmax()]
+
+    # parabolic interpolation between the envelope frames
+    lag = float(lags[peak])
+    if 0 < peak < len(correlation) - 1:
+        left, center, right = correlation[peak - 1:peak + 2]
+        curvature = left - 2 * center + right
+        if curvature < 0:
+            lag += 0.5 * (left - right) / curvature
+
+    return int(round(lag * hop_seconds * vocal_sr))
+
+
+class AlignmentCache:
+    """
+    The class to keep the vocal offset of each job, so mixing the same vocal
+    with a new accompaniment does not estimate the offset again.
+
+    The offset only depends on the vocal and the beat grid, the key is the
+    path, size and modification time of the vocal, its start time and the
+    content hash of the beat grid, so rendering the same grid again hits.
+    Only the max_entries most recent offsets are kept.
+
+    Attributes:
+        cache_file (str): the json file of the offsets, in memory only if None
+        max_entries (int): the number of offsets kept
+        offsets (dict): the key of the inputs to the offset in vocal samples
+
+    Examples usage:
+        alignment_cache = AlignmentCache('job/alignment.json')
+        offset = alignment_cache.get_offset('drum.wav', 'vocal.wav', 1.2, grid_file='drum.mid')
+    """
+
+    def __init__(self, cache_file=None, max_entries=64):
+        """
+        Args:
+            cache_file (str): The json file of the offsets.
+            max_entries (int): The number of offsets kept.
+        """
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.offsets = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file) as f:
+                self.offsets = json.load(f)
+
+    @staticmethod
+    def get_key(grid_file, vocal_file, vocal_start_time) -> str:
+        """
+        Get the cache key of the beat grid content and the vocal file.
+        """
+        with open(grid_file, "rb") as f:
+            grid_hash = hashlib.sha1(f.read()).hexdigest()
+        status = os.stat(vocal_file)
+
+        return f"{grid_hash}|{os.path.abspath(vocal_file)}:{status.st_size}:{status.st_mtime_ns}|{vocal_start_time:.6f}"
+
+    def get_offset(self, reference_file, vocal_file, vocal_start_time, grid_file=None) -> int:
+        """
+        Get the offset of the vocal after its start time, estimated on the
+        first call.
+
+        Args:
+            reference_file (str): The rendered beat grid (drum track).
+            vocal_file (str): The vocal file.
+            vocal_start_time (float): The first downbeat of the vocal in seconds.
+            grid_file (str): The file the beat grid is rendered from (drum midi),
+                the reference file if None.
+
+        Returns:
+            the offset in vocal samples
+        """
+        key = self.get_key(grid_file or reference_file, vocal_file, vocal_start_time)
+        if key in self.offsets:
+            # the most recent offsets are kept at the end
+            self.offsets[key] = self.offsets.pop(key)
+            return self.offsets[key]
+
+        reference, reference_sr = audio_segment_to_array(AudioSegment.from_file(reference_file))
+        vocal, vocal_sr = audio_segment_to_array(AudioSegment.from_file(vocal_file))
+        vocal = vocal[int(round(vocal_start_time * vocal_sr)):]
+
+        self.offsets[key] = estimate_offset(reference, reference_sr, vocal, vocal_sr)
+        for stale_key in list(self.offsets)[:-self.max_entries]:
+            del self.offsets[stale_key]
+        if self.cache_file is not None:
+            with open(self.cache_file, "w") as f:
+                json.dump(self.offsets, f)
+
+        return self.offsets[key]
@@ -0,0 +1,239 @@
+import threading
+from functools import lru_cache
+import numpy as np
+from pychord import Chord
+from pychord.utils import note_to_val
+
+# intervals of the Harte chord shorthands, used for the symbols pychord
+# cannot parse (slash chords, extensions in parentheses, ...)
+harte_shorthand_intervals = {
+    'maj': [0, 4, 7], 'min': [0, 3, 7], 'dim': [0, 3, 6], 'aug': [0, 4, 8],
+    'maj7': [0, 4, 7, 11], 'min7': [0, 3, 7, 10], '7': [0, 4, 7, 10],
+    'dim7': [0, 3, 6, 9], 'hdim7': [0, 3, 6, 10], 'minmaj7': [0, 3, 7, 11],
+    'maj6': [0, 4, 7, 9], 'min6': [0, 3, 7, 9], '9': [0, 4, 7, 10, 2],
+    'maj9': [0, 4, 7, 11, 2], 'min9': [0, 3, 7, 10, 2], '11': [0, 4, 7, 10, 2, 5],
+    'min11': [0, 3, 7, 10, 2, 5], '13': [0, 4, 7, 10, 2, 9], 'maj13': [0, 4, 7, 11, 2, 9],
+    'min13': [0, 3, 7, 10, 2, 9], 'sus2': [0, 2, 7], 'sus4': [0, 5, 7], '': [],
+}
+harte_degree_semitones = {'1': 0, '2': 2, '3': 4, '4': 5, '5': 7, '6': 9, '7': 11,
+                          '9': 2, '11': 5, '13': 9}
+sharp_note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+flat_note_names = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
+
+# the no-chord symbols of the annotations, no components and no root
+no_chord_names = ('N', 'X')
+
+
+def convert_to_note_name(chord_str) -> str:
+    """
+    the function to convert the chord name to adjust chord name
+
+    Args:
+        chord_str (str): the chord name
+
+    Returns:
+        the adjust chord name
+    """
+    chord_parts = chord_str.split(':')
+    chord_name = chord_parts[0]
+    chord_type = chord_parts[1]
+
+    if 'min' in chord_type:
+        # replace min with m
+        chord_type = chord_type.replace('min', 'm')
+
+    # if last character is 6
+    if chord_type[-1] == '6':
+        chord_type = chord_type.replace('6', '')
+    # if last character is not num
+    if chord_type[-1].isdigit() == False:
+        if "maj" in chord_type:
+            chord_type = chord_type.replace('maj', '')
+    return chord_name + chord_type
+
+
+def _harte_degree(degree: str) -> int:
+    """
+    the function to convert a Harte degree like 'b7' or '#9' to semitones
+
+    Args:
+        degree (str): the degree
+
+    Returns:
+        the semitones above the root
+    """
+
+    semitones = harte_degree_semitones[degree.lstrip('b#')]
+    semitones -= degree.count('b')
+    semitones += degree.count('#')
+
+    return semitones % 12
+
+
+def parse_harte_chord(chord_str: str) -> (tuple, int, str):
+    """
+    the function to parse a Harte chord symbol with extensions and bass,
+    e.g. 'C:min7(9)/b3', the bass note comes first in the components
+
+    Args:
+        chord_str (str): the chord name
+
+    Returns:
+        components (tuple) the note names of the chord
+        root (int) the pitch class of the root
+        quality (str) the quality of the chord, e.g. 'min7(9)/b3'
+    """
+
+    root_name, _, quality = chord_str.partition(':')
+    shorthand, _, bass = quality.partition('/')
+    shorthand, _, extensions = shorthand.partition('(')
+
+    intervals = list(harte_shorthand_intervals[shorthand if shorthand or not extensions else 'maj'])
+    for degree in filter(None, extensions.rstrip(')').split(',')):
+        if degree.startswith('*'):
+            intervals = [i for i in intervals if i != _harte_degree(degree[1:])]
+        elif _harte_degree(degree) not in intervals:
+            intervals.append(_harte_degree(degree))
+
+    if bass:
+        bass_interval = _harte_degree(bass)
+        intervals = [bass_interval] + [i for i in intervals if i != bass_interval]
+
+    root = note_to_val(root_name)
+    note_names = sharp_note_names if '#' in root_name else flat_note_names
+    components = tuple(note_names[(root + i) % 12] for i in intervals)
+
+    return components, root, quality
+
+
+@lru_cache(maxsize=None)
+def parse_chord(chord_str: str) -> (tuple, int, str):
+    """
+    the function to parse a chord symbol once, later calls are memoized
+
+    Args:
+        chord_str (str): the chord name, e.g. 'Bb:maj7'
+
+    Returns:
+        components (tuple) the note names of the chord, empty for a no-chord
+        root (int) the pitch class of the root, -1 for a no-chord
+        quality (str) the quality of the chord, e.g. 'maj7'
+    """
+
+    if chord_str in no_chord_names:
+        return (), -1, ''
+
+    root_name, _, quality = chord_str.partition(':')
+    if '/' in quality or '(' in quality or quality not in harte_shorthand_intervals:
+        return parse_harte_chord(chord_str)
+
+    try:
+        components = tuple(Chord(convert_to_note_name(chord_str)).components())
+    except ValueError:
+        return parse_harte_chord(chord_str)
+
+    return components, note_to_val(root_name), quality
+
+
+class ChordTable:
+    """
+    The class to hold the parsed chord vocabulary, so chord lookups are
+    array indexing instead of chord parsing
+
+    Attributes:
+        chord_list (list): the chord vocabulary
+        index (dict): chord name to row index
+        components (list): the note names of each chord
+        masks (np.array): S x 12 pitch class mask of each chord
+        roots (np.array): the pitch class of the root of each chord, -1 for a no-chord
+        qualities (list): the quality of each chord
+
+    The table may be shared by threads, rows are only appended under a lock.
+
+    Examples usage:
+        table = ChordTable(['C:maj', 'A:min'])
+        table.get_components(['A:min', 'C:maj'])
+    """
+
+    def __init__(self, chord_list):
+        """
+        Args:
+            chord_list (list): The chord vocabulary.
+        """
+        self.chord_list = []
+        self.index = {}
+        self.components = []
+        self.masks = np.zeros((0, 12), dtype=bool)
+        self.roots = np.zeros(0, dtype=int)
+        self.qualities = []
+        self._lock = threading.Lock()
+
+        self.add(chord_list)
+
+    def add(self, chord_list) -> None:
+        """
+        Parse and append the chords not in the table yet.
+
+        Args:
+            chord_list (list): The chord names.
+        """
+        chord_list = list(chord_list)
+        if all(i in self.index for i in chord_list):
+            return None
+
+        with self._lock:
+            new_chords = [i for i in dict.fromkeys(chord_list) if i not in self.index]
+            parsed = [parse_chord(i) for i in new_chords]
+
+            masks = np.zeros((len(new_chords), 12), dtype=bool)
+            for row, (components, root, quality) in enumerate(parsed):
+                masks[row, [note_to_val(i) for i in components]] = True
+            self.masks = np.concatenate([self.masks, masks])
+            self.roots = np.concatenate([self.roots, np.array([root for _, root, _ in parsed], dtype=int)])
+
+            # the index entry last, a reader only sees complete rows
+            for chord_name, (components, root, quality) in zip(new_chords, parsed):
+                self.chord_list.append(chord_name)
+                self.components.append(list(components))
+                self.qualities.append(quality)
+                self.index[chord_name] = len(self.chord_list) - 1
+
+        return None
+
+    def lookup(self, chord_sequence) -> np.array:
+        """
+        Get the row index of each chord, unknown chords are added once.
+
+        Args:
+            chord_sequence (list): The chord names.
+
+        Returns:
+            the row index of each chord
+        """
+        self.add(chord_sequence)
+
+        return np.array([self.index[i] for i in chord_sequence], dtype=int)
+
+    def get_components(self, chord_sequence) -> list:
+        """
+        Get the note names of each chord.
+
+        Args:
+            chord_sequence (list): The chord names.
+
+        Returns:
+            the list of chord components
+        """
+        return [self.components[i] for i in self.lookup(chord_sequence)]
+
+    def in_scale(self, scale_mask) -> np.array:
+        """
+        Check which chords have all of their pitch classes in the scale.
+
+        Args:
+            scale_mask (np.array): The 12 pitch class mask of the scale.
+
+        Returns:
+            the boolean mask over the table rows
+        """
+        return ~(self.masks & ~np.asarray(scale_mask, dtype=bool)).any(axis=1)
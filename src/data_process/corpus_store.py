@@ -0,0 +1,179 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# relative path
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+# the corpora written by the training pipelines, the simplified chord
+# corpus of POP909 is shipped
+chord_corpus_dir = os.path.join(dir_path, 'transition__chord_matrix', 'corpus', 'all_chord')
+full_chord_corpus_dir = os.path.join(dir_path, 'transition__chord_matrix', 'corpus', 'all_chord_full')
+melody_corpus_dir = os.path.join(dir_path, 'melody observation matrix', 'corpus', 'all_melody')
+
+# bump when the on-disk layout changes
+corpus_format_version = 1
+
+meta_file_name = 'meta.json'
+
+
+def _code_dtype(n_categories: int) -> np.dtype:
+    """
+    the function to get the smallest integer dtype able to hold the codes
+
+    Args:
+        n_categories (int): the number of categories
+
+    Returns:
+        the dtype of the codes
+    """
+
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def write_corpus(df: pd.DataFrame, corpus_dir: str) -> dict:
+    """
+    the function to write a corpus DataFrame as one .npy file per column,
+    string columns are stored as categorical codes with their categories
+    kept in the metadata header
+
+    Args:
+        df (pd.DataFrame): the corpus, e.g. all_df of the chord pipeline
+        corpus_dir (str): the directory to write the corpus
+
+    Returns:
+        the metadata header
+    """
+
+    os.makedirs(corpus_dir, exist_ok=True)
+
+    meta = {'format': corpus_format_version, 'n_rows': len(df), 'columns': {}}
+
+    for column in df.columns:
+        values = df[column]
+        column_meta = {'file': f'{column}.npy'}
+
+        # numbers kept in object columns (e.g. after concat with a Series.T)
+        if values.dtype == object:
+            numeric = pd.to_numeric(values, errors='coerce')
+            if numeric.notna().all():
+                values = numeric
+
+        if values.dtype == object or isinstance(values.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            codes, categories = pd.factorize(values.astype(str), sort=True)
+            array = codes.astype(_code_dtype(len(categories)))
+            column_meta['categories'] = categories.tolist()
+        elif pd.api.types.is_float_dtype(values):
+            array = values.to_numpy(dtype=np.float32)
+        else:
+            array = values.to_numpy(dtype=np.int32)
+
+        column_meta['dtype'] = array.dtype.str
+        np.save(os.path.join(corpus_dir, column_meta['file']), array)
+        meta['columns'][column] = column_meta
+
+    with open(os.path.join(corpus_dir, meta_file_name), 'w') as f:
+        json.dump(meta, f)
+
+    return meta
+
+
+def has_corpus(corpus_dir: str) -> bool:
+    """
+    the function to check a corpus was written to the directory
+
+    Args:
+        corpus_dir (str): the corpus directory
+
+    Returns:
+        True if the metadata header exists
+    """
+
+    return os.path.exists(os.path.join(corpus_dir, meta_file_name))
+
+
+def read_corpus_meta(corpus_dir: str) -> dict:
+    """
+    the function to read the metadata header of a corpus
+
+    Args:
+        corpus_dir (str): the corpus directory
+
+    Returns:
+        the metadata header
+    """
+
+    with open(os.path.join(corpus_dir, meta_file_name)) as f:
+        meta = json.load(f)
+
+    if meta['format'] != corpus_format_version:
+        raise ValueError(f"Unsupported corpus format {meta['format']}")
+
+    return meta
+
+
+def read_categories(corpus_dir: str, column: str) -> list:
+    """
+    the function to read the categories of a categorical column without
+    loading any row
+
+    Args:
+        corpus_dir (str): the corpus directory
+        column (str): the column name
+
+    Returns:
+        the sorted categories
+    """
+
+    return read_corpus_meta(corpus_dir)['columns'][column]['categories']
+
+
+def read_corpus_columns(corpus_dir: str, columns: list = None) -> dict:
+    """
+    the function to memory map only the needed columns of a corpus
+
+    Args:
+        corpus_dir (str): the corpus directory
+        columns (list): the columns to read, all columns if None
+
+    Returns:
+        dict of column name to the raw array (categorical codes for string
+        columns)
+    """
+
+    meta = read_corpus_meta(corpus_dir)
+    columns = list(meta['columns']) if columns is None else columns
+
+    return {column: np.load(os.path.join(corpus_dir, meta['columns'][column]['file']), mmap_mode='r')
+            for column in columns}
+
+
+def read_corpus(corpus_dir: str, columns: list = None) -> pd.DataFrame:
+    """
+    the function to read a corpus as DataFrame, string columns come back
+    as pd.Categorical so no text is parsed
+
+    Args:
+        corpus_dir (str): the corpus directory
+        columns (list): the columns to read, all columns if None
+
+    Returns:
+        the corpus DataFrame
+    """
+
+    meta = read_corpus_meta(corpus_dir)
+    arrays = read_corpus_columns(corpus_dir, columns)
+
+    data = {}
+    for column, array in arrays.items():
+        categories = meta['columns'][column].get('categories')
+        if categories is None:
+            data[column] = np.asarray(array)
+        else:
+            data[column] = pd.Categorical.from_codes(np.asarray(array), categories=categories)
+
+    return pd.DataFrame(data)
@@ -0,0 +1,387 @@
+import numpy as np
+from scipy import sparse
+
+
+def _log(x) -> np.array:
+    """
+    the function to take log of probabilities, zero becomes -inf
+
+    Args:
+        x: the probabilities
+
+    Returns:
+        the log probabilities
+    """
+
+    with np.errstate(divide='ignore'):
+        return np.log(x)
+
+
+def second_order_viterbi(log_emission: np.array, start_probability: np.array, transition_matrix: np.array,
+                         second_order: sparse.csr_matrix, interpolation: float = 0.7) -> (float, np.array):
+    """
+    the function to decode the best chord sequence with a second order
+    (chord pair -> chord) transition model
+
+    the second order model is sparse, so P(k | i, j) is interpolated with the
+    first order model: interpolation * P2(k | i, j) + (1 - interpolation) * P1(k | j),
+    and falls back to P1(k | j) when the pair (i, j) was never seen.
+    The max over the unseen part only depends on j, so each step costs
+    O(S^2 + nnz) instead of O(S^3).
+
+    Args:
+        log_emission (np.array): T x S log emission of each measure for each chord
+        start_probability (np.array): S start probability
+        transition_matrix (np.array): S x S first order transition matrix
+        second_order (sparse.csr_matrix): S*S x S second order transition matrix,
+            row i * S + j holds P(k | i, j)
+        interpolation (float): the weight of the second order model
+
+    Returns:
+        logprob (float) the log probability of the best sequence
+        chord_sequence (np.array) the index of the chord of each measure
+    """
+
+    n_measures, n_states = log_emission.shape
+
+    delta = _log(start_probability) + log_emission[0]
+    if n_measures == 1:
+        return float(delta.max()), np.array([delta.argmax()])
+
+    log_first = _log(transition_matrix)
+
+    # weight left to the first order model for each pair (i, j)
+    seen = np.diff(second_order.indptr) > 0
+    log_backoff = np.where(seen, _log(1 - interpolation), 0).reshape(n_states, n_states)
+
+    # explicit second order edges (i, j) -> (j, k)
+    coo = second_order.tocoo()
+    edge_source = coo.row
+    edge_target = (coo.row % n_states) * n_states + coo.col
+    edge_log_prob = _log(interpolation * coo.data +
+                         (1 - interpolation) * transition_matrix[coo.row % n_states, coo.col])
+
+    # pair state (j, k) of the first two measures
+    delta = delta[:, None] + log_first + log_emission[1][None, :]
+    backpointer = []
+
+    for t in range(2, n_measures):
+        # backoff part, the best i for every j
+        backoff_score = delta + log_backoff
+        best_source = backoff_score.argmax(axis=0)
+        new_delta = (backoff_score.max(axis=0)[:, None] + log_first).ravel()
+        new_backpointer = np.repeat(best_source, n_states)
+
+        # explicit sparse part
+        candidate = delta.ravel()[edge_source] + edge_log_prob
+        np.maximum.at(new_delta, edge_target, candidate)
+        winner = candidate == new_delta[edge_target]
+        new_backpointer[edge_target[winner]] = edge_source[winner] // n_states
+
+        delta = new_delta.reshape(n_states, n_states) + log_emission[t][None, :]
+        backpointer.append(new_backpointer.reshape(n_states, n_states))
+
+    # backtrack the pair state
+    j, k = np.unravel_index(delta.argmax(), delta.shape)
+    logprob = float(delta[j, k])
+    chord_sequence = [k, j]
+    for bp in reversed(backpointer):
+        j, k = bp[j, k], j
+        chord_sequence.append(j)
+
+    return logprob, np.array(chord_sequence[::-1])
+
+
+def beam_viterbi(log_emission: np.array, start_probability: np.array, transition: sparse.csr_matrix,
+                 beam_width: int = 64, backoff: float = 0.05, unigram: np.array = None) -> (float, np.array):
+    """
+    the function to decode the best chord sequence over a large chord
+    vocabulary with a sparse transition matrix and a pruned beam
+
+    P(j | i) = (1 - backoff) * T(j | i) + backoff * unigram(j), so unseen
+    transitions keep a small probability. Only the beam_width best chords
+    of each measure are expanded: the sparse rows of these chords plus the
+    backoff part, whose max only needs the best score. A step costs
+    O(S + beam_width * nnz per row), linear in the vocabulary size S.
+
+    Args:
+        log_emission (np.array): T x S log emission of each measure for each chord
+        start_probability (np.array): S start probability
+        transition (sparse.csr_matrix): S x S sparse transition matrix
+        beam_width (int): the number of chords kept per measure
+        backoff (float): the weight of the unigram backoff
+        unigram (np.array): S chord probability of the backoff, uniform if None
+
+    Returns:
+        logprob (float) the log probability of the best sequence
+        chord_sequence (np.array) the index of the chord of each measure
+    """
+
+    n_measures, n_states = log_emission.shape
+    if unigram is None:
+        unigram = np.full(n_states, 1 / n_states)
+    log_backoff = _log(backoff * unigram)
+
+    score = _log(start_probability) + log_emission[0]
+    beam = np.argpartition(-score, min(beam_width, n_states) - 1)[:beam_width]
+    beam_score = score[beam]
+
+    history = []
+    for t in range(1, n_measures):
+        # backoff part, every chord can follow the best chord of the beam
+        best = beam_score.argmax()
+        score = beam_score[best] + log_backoff
+        backpointer = np.full(n_states, beam[best])
+
+        # sparse part, only the rows of the chords in the beam
+        rows = transition[beam].tocoo()
+        candidate = beam_score[rows.row] + _log((1 - backoff) * rows.data + backoff * unigram[rows.col])
+        np.maximum.at(score, rows.col, candidate)
+        winner = candidate == score[rows.col]
+        backpointer[rows.col[winner]] = beam[rows.row[winner]]
+
+        score = score + log_emission[t]
+
+        # prune to the best chords
+        beam = np.argpartition(-score, min(beam_width, n_states) - 1)[:beam_width]
+        beam_score = score[beam]
+        history.append((beam, backpointer[beam]))
+
+    # backtrack
+    best = beam_score.argmax()
+    logprob = float(beam_score[best])
+    state = beam[best]
+    chord_sequence = [state]
+    for beam, backpointer in reversed(history):
+        state = backpointer[np.flatnonzero(beam == state)[0]]
+        chord_sequence.append(state)
+
+    return logprob, np.array(chord_sequence[::-1])
+
+
+def semi_markov_viterbi(log_emission: np.array, start_probability: np.array, transition_matrix: np.array,
+                        duration_probability: np.array) -> (float, np.array):
+    """
+    the function to decode the best chord sequence over beat (or half bar)
+    segments with an explicit chord duration, so the decoder chooses where
+    the chords change
+
+    the score of chord j over the segments [s, e) is a difference of the
+    cumulative sum of the log emission, so every duration of every chord
+    ending at e is scored at once and a step costs O(D * S + S^2).
+
+    Args:
+        log_emission (np.array): T x S log emission of each segment for each chord
+        start_probability (np.array): S start probability
+        transition_matrix (np.array): S x S transition matrix
+        duration_probability (np.array): D probability of a chord lasting 1..D segments
+
+    Returns:
+        logprob (float) the log probability of the best sequence
+        chord_sequence (np.array) the index of the chord of each segment
+    """
+
+    n_segments, n_states = log_emission.shape
+    max_duration = len(duration_probability)
+    log_transition = _log(transition_matrix)
+    log_duration = _log(duration_probability)[:, None]
+
+    # cumulative[e] - cumulative[s] is the emission score of the segments [s, e)
+    cumulative = np.vstack([np.zeros(n_states), np.cumsum(log_emission, axis=0)])
+
+    # enter[s, j] is the best score of a chord j starting at segment s
+    enter = np.full((n_segments, n_states), -np.inf)
+    enter[0] = _log(start_probability)
+    enter_from = np.zeros((n_segments, n_states), dtype=int)
+
+    best_duration = np.zeros((n_segments + 1, n_states), dtype=int)
+    end_score = np.full((n_segments + 1, n_states), -np.inf)
+
+    for e in range(1, n_segments + 1):
+        duration = np.arange(1, min(max_duration, e) + 1)
+        start = e - duration
+
+        # every duration of every chord ending at e
+        score = cumulative[e] - cumulative[start] + enter[start] + log_duration[duration - 1]
+        best_index = score.argmax(axis=0)
+        end_score[e] = score[best_index, np.arange(n_states)]
+        best_duration[e] = duration[best_index]
+
+        if e < n_segments:
+            # the next chord starts at e
+            candidate = end_score[e][:, None] + log_transition
+            enter_from[e] = candidate.argmax(axis=0)
+            enter[e] = candidate.max(axis=0)
+
+    # backtrack the segments
+    state = int(end_score[n_segments].argmax())
+    logprob = float(end_score[n_segments, state])
+    chord_sequence = np.zeros(n_segments, dtype=int)
+    e = n_segments
+    while e > 0:
+        start = e - best_duration[e, state]
+        chord_sequence[start:e] = state
+        state, e = enter_from[start, state], start
+
+    return logprob, chord_sequence
+
+
+def k_best_viterbi(log_emission: np.array, start_probability: np.array, transition_matrix: np.array,
+                   k: int) -> list:
+    """
+    the function to decode the k best chord sequences in one pass (parallel
+    list Viterbi), every state keeps its k best partial sequences
+
+    Args:
+        log_emission (np.array): T x S log emission of each measure for each chord
+        start_probability (np.array): S start probability
+        transition_matrix (np.array): S x S transition matrix
+        k (int): the number of sequences
+
+    Returns:
+        the list of (logprob, chord_sequence) from the best, at most k
+        distinct sequences with a non zero probability
+    """
+
+    n_measures, n_states = log_emission.shape
+    log_transition = _log(transition_matrix)
+
+    # delta[i, r] is the score of the r-th best sequence ending in chord i
+    delta = np.full((n_states, k), -np.inf)
+    delta[:, 0] = _log(start_probability) + log_emission[0]
+
+    backpointer = []
+    for t in range(1, n_measures):
+        # (i, r) -> j, then keep the k best (i, r) for every j
+        candidate = (delta[:, :, None] + log_transition[:, None, :]).reshape(n_states * k, n_states)
+        top = np.argpartition(-candidate, k - 1, axis=0)[:k]
+        score = np.take_along_axis(candidate, top, axis=0)
+        order = np.argsort(-score, axis=0, kind='stable')
+        top = np.take_along_axis(top, order, axis=0)
+
+        delta = np.take_along_axis(score, order, axis=0).transpose() + log_emission[t][:, None]
+        backpointer.append(top.transpose())
+
+    # the k best end points over every chord
+    final = delta.ravel()
+    ends = np.argsort(-final, kind='stable')[:k]
+
+    sequences = []
+    for end in ends:
+        if final[end] == -np.inf:
+            break
+        state, rank = divmod(int(end), k)
+        chord_sequence = [state]
+        for bp in reversed(backpointer):
+            state, rank = divmod(int(bp[state, rank]), k)
+            chord_sequence.append(state)
+        sequences.append((float(final[end]), np.array(chord_sequence[::-1])))
+
+    return sequences
+
+
+def viterbi_messages(log_emission: np.array, start_probability: np.array,
+                     transition_matrix: np.array) -> (np.array, np.array, np.array, np.array):
+    """
+    the function to compute the forward and backward max messages of the
+    first order model once, so a decoding with pinned chords only has to
+    recompute the measures between the pins
+
+    Args:
+        log_emission (np.array): T x S log emission of each measure for each chord
+        start_probability (np.array): S start probability
+        transition_matrix (np.array): S x S transition matrix
+
+    Returns:
+        forward (np.array) T x S best score of the measures [0, t] ending in each chord
+        forward_pointer (np.array) T x S best chord of the measure before
+        backward (np.array) T x S best score of the measures (t, T) after each chord
+        backward_pointer (np.array) T x S best chord of the measure after
+    """
+
+    n_measures, n_states = log_emission.shape
+    log_transition = _log(transition_matrix)
+
+    forward = np.zeros((n_measures, n_states))
+    forward_pointer = np.zeros((n_measures, n_states), dtype=int)
+    forward[0] = _log(start_probability) + log_emission[0]
+    for t in range(1, n_measures):
+        candidate = forward[t - 1][:, None] + log_transition
+        forward_pointer[t] = candidate.argmax(axis=0)
+        forward[t] = candidate.max(axis=0) + log_emission[t]
+
+    backward = np.zeros((n_measures, n_states))
+    backward_pointer = np.zeros((n_measures, n_states), dtype=int)
+    for t in range(n_measures - 2, -1, -1):
+        candidate = log_transition + (log_emission[t + 1] + backward[t + 1])[None, :]
+        backward_pointer[t] = candidate.argmax(axis=1)
+        backward[t] = candidate.max(axis=1)
+
+    return forward, forward_pointer, backward, backward_pointer
+
+
+def constrained_viterbi(log_emission: np.array, start_probability: np.array, transition_matrix: np.array,
+                        pins: dict, messages: tuple = None) -> (float, np.array):
+    """
+    the function to decode the best chord sequence of the first order model
+    with some measures pinned to a chord
+
+    the best path splits at the pins: the part before the first pin is the
+    backtrack of the forward messages, the part after the last pin follows
+    the backward messages, so only the windows between two pins are decoded
+    again, O(window * S^2) instead of O(T * S^2).
+
+    Args:
+        log_emission (np.array): T x S log emission of each measure for each chord
+        start_probability (np.array): S start probability
+        transition_matrix (np.array): S x S transition matrix
+        pins (dict): measure index to the chord index it is pinned to
+        messages (tuple): the result of viterbi_messages, computed if None
+
+    Returns:
+        logprob (float) the log probability of the best sequence
+        chord_sequence (np.array) the index of the chord of each measure
+    """
+
+    if messages is None:
+        messages = viterbi_messages(log_emission, start_probability, transition_matrix)
+    forward, forward_pointer, backward, backward_pointer = messages
+    n_measures = len(log_emission)
+
+    if not pins:
+        state = int(forward[-1].argmax())
+        pins = {n_measures - 1: state}
+
+    pinned = sorted(pins)
+    chord_sequence = np.zeros(n_measures, dtype=int)
+
+    # before the first pin
+    first = pinned[0]
+    chord_sequence[first] = pins[first]
+    for t in range(first, 0, -1):
+        chord_sequence[t - 1] = forward_pointer[t, chord_sequence[t]]
+    logprob = forward[first, pins[first]]
+
+    # between two pins, a viterbi pass from one pinned chord to the next
+    log_transition = _log(transition_matrix)
+    for begin, end in zip(pinned[:-1], pinned[1:]):
+        delta = np.full(log_emission.shape[1], -np.inf)
+        delta[pins[begin]] = 0
+        backpointer = []
+        for t in range(begin + 1, end + 1):
+            candidate = delta[:, None] + log_transition
+            backpointer.append(candidate.argmax(axis=0))
+            delta = candidate.max(axis=0) + log_emission[t]
+
+        chord_sequence[end] = pins[end]
+        for t, bp in zip(range(end, begin, -1), reversed(backpointer)):
+            chord_sequence[t - 1] = bp[chord_sequence[t]]
+        logprob += delta[pins[end]]
+
+    # after the last pin
+    last = pinned[-1]
+    for t in range(last, n_measures - 1):
+        chord_sequence[t + 1] = backward_pointer[t, chord_sequence[t]]
+    logprob += backward[last, pins[last]]
+
+    return float(logprob), chord_sequence
@@ -0,0 +1,145 @@
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+# the compressed formats of the mix, ffmpeg muxer and media type
+encoded_formats = {
+    "mp3": ("mp3", "audio/mpeg"),
+    "ogg": ("ogg", "audio/ogg"),
+    "flac": ("flac", "audio/flac"),
+}
+
+
+def get_etag(file) -> str:
+    """
+    the function to get the entity tag of a file from its size and
+    modification time
+
+    Args:
+        file (str): the file name
+
+    Returns:
+        the quoted entity tag
+    """
+
+    status = os.stat(file)
+    return f'"{status.st_size:x}-{status.st_mtime_ns:x}"'
+
+
+def parse_range(range_header: str, size: int) -> (int, int):
+    """
+    the function to parse a single HTTP byte range, e.g. 'bytes=100-199',
+    'bytes=100-' or 'bytes=-500'
+
+    Args:
+        range_header (str): the Range header
+        size (int): the size of the file
+
+    Returns:
+        the first and last byte (inclusive), None if the range cannot be served
+    """
+
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+
+    if match.group(1) == "":
+        # the last bytes of the file
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+
+    if start > end or start >= size:
+        return None
+
+    return start, end
+
+
+def iter_file(file, start=0, end=None, chunk_size=2 ** 16):
+    """
+    the function to read the bytes [start, end] of a file chunk by chunk
+
+    Args:
+        file (str): the file name
+        start (int): the first byte
+        end (int): the last byte (inclusive), the end of the file if None
+        chunk_size (int): the bytes read at a time
+
+    Yields:
+        the chunks of the file
+    """
+
+    if end is None:
+        end = os.path.getsize(file) - 1
+
+    with open(file, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def encode_audio(chunks, audio_format, output_file, chunk_size=2 ** 16):
+    """
+    the function to encode the chunks of a wav file with ffmpeg while they
+    are read, the encoded bytes are yielded as soon as ffmpeg writes them
+    and kept in output_file once the whole file is encoded
+
+    Args:
+        chunks (iterable): the bytes of the wav file
+        audio_format (str): a key of encoded_formats
+        output_file (str): the file name of the encoded mix
+        chunk_size (int): the bytes read from ffmpeg at a time
+
+    Yields:
+        the chunks of the encoded file
+    """
+
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is needed to encode the mix")
+
+    muxer = encoded_formats[audio_format][0]
+    process = subprocess.Popen(["ffmpeg", "-loglevel", "error", "-i", "pipe:0", "-f", muxer, "pipe:1"],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    # feed ffmpeg from a thread, so reading its output never blocks the input
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    partial_file = output_file + ".part"
+    try:
+        with open(partial_file, "wb") as f:
+            while True:
+                chunk = process.stdout.read1(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                yield chunk
+    finally:
+        # the client may stop reading, ffmpeg is stopped with it
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        feeder.join()
+
+    if process.returncode == 0:
+        os.replace(partial_file, output_file)
+    elif os.path.exists(partial_file):
+        os.remove(partial_file)
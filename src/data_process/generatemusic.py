@@ -1,9 +1,14 @@
-from hmmlearn import hmm
+import os
 import numpy as np
-from data_process.hmm_model_generate import hmm_pipeline
-from music21 import *
+from data_process.hmm_model_generate import generate_duration_probability, generate_second_order_transition_matrix, hmm_pipeline
+from data_process.decoder import (constrained_viterbi, k_best_viterbi, second_order_viterbi, semi_markov_viterbi,
+                                  viterbi_messages)
+from data_process.profiling import stage
+from data_process.alignment import AlignmentCache
+from data_process.stems import StemStore
+from music21 import chord, duration, instrument, meter, note, stream, tempo
 from midi2audio import FluidSynth
-from data_process.song_analyze import get_each_chord_componetns
+from data_process.song_analyze import get_beat_info, get_each_chord_componetns
 from pydub import AudioSegment
 
 
@@ -15,26 +20,37 @@ class ChordGenerator:
         model (hmm.CategoricalHMM): the hmm model
         measure_list_vector (list): the list of measure vector
         chord_list (list): the trimmed chord list
+        second_order (scipy.sparse.csr_matrix): the optional second order transition matrix
+        duration_probability (np.array): the optional chord duration prior of the segments
 
     Methods:
         generate: generate the chord sequence        
-
+        generate_n_best: generate the n best chord sequences
+        reharmonize: generate the chord sequence through the pinned chords
 
     Examples usage:
         insatnce = ChordGenerator(model, measure_list_vector, chord_list)
         chord_progression =  insatnce.generate()
     """
 
-    def __init__(self, model, measure_list_vector, chord_list):
+    def __init__(self, model, measure_list_vector, chord_list, second_order=None, duration_probability=None):
         """
         Args:
             model (hmm.CategoricalHMM): The HMM model.
             measure_list_vector (list): The list of measure vector.
             chord_list (list): The trimmed chord list.
+            second_order (scipy.sparse.csr_matrix): The second order transition matrix,
+                decode with the first order model if None.
+            duration_probability (np.array): The probability of a chord lasting 1..D segments,
+                decode one chord per segment if None.
         """
         self.model = model
         self.measure_list_vector = measure_list_vector
         self.chord_list = chord_list
+        self.second_order = second_order
+        self.duration_probability = duration_probability
+        # the forward and backward messages of the last decoded measures
+        self.messages = None
 
     def generate(self) -> list:
         """
@@ -43,14 +59,25 @@ class ChordGenerator:
         Returns: chord_progression (list): the chord sequence
 
         """
-        observations_variable = self.measure_list_vector
-
         # given the observation, predict the state
 
-        user_sing_action = np.array(
-            [[i for i in range(len(observations_variable))]])
-        logprob, chord_sequence = self.model.decode(
-            user_sing_action.transpose(), algorithm="viterbi")
+        # only the sung measures are decoded
+        active_measures = self.get_active_measures()
+        user_sing_action = np.array([active_measures])
+        if self.second_order is None and self.duration_probability is None:
+            logprob, chord_sequence = self.model.decode(
+                user_sing_action.transpose(), algorithm="viterbi")
+        else:
+            with np.errstate(divide='ignore'):
+                log_emission = np.log(self.model.emissionprob_).transpose()[user_sing_action[0]]
+            if self.duration_probability is not None:
+                logprob, chord_sequence = semi_markov_viterbi(
+                    log_emission, self.model.startprob_, self.model.transmat_, self.duration_probability)
+            else:
+                logprob, chord_sequence = second_order_viterbi(
+                    log_emission, self.model.startprob_, self.model.transmat_, self.second_order)
+
+        chord_sequence = self.hold_silent_measures(chord_sequence, active_measures)
 
         print("logprob", logprob)
         print("chord_sequence", chord_sequence)
@@ -62,6 +89,126 @@ class ChordGenerator:
 
         return chord_sequence_name
 
+    def generate_n_best(self, n_best) -> list:
+        """
+        Generate the n best distinct chord sequences of the first order
+        model in one decoding pass
+
+        Args:
+            n_best (int): the number of chord sequences
+
+        Returns: the list of (logprob, chord_progression) from the best
+
+        """
+        if self.second_order is not None or self.duration_probability is not None:
+            raise ValueError("n best decoding needs the first order measure model")
+
+        active_measures = self.get_active_measures()
+        with np.errstate(divide='ignore'):
+            log_emission = np.log(self.model.emissionprob_).transpose()[active_measures]
+
+        sequences = k_best_viterbi(log_emission, self.model.startprob_, self.model.transmat_, n_best)
+
+        return [(logprob, [self.chord_list[i] for i in self.hold_silent_measures(chord_sequence, active_measures)])
+                for logprob, chord_sequence in sequences]
+
+    def reharmonize(self, pins) -> (float, list):
+        """
+        Generate the best chord sequence of the first order model with some
+        measures pinned to a chord. The forward and backward messages are
+        kept, so an edit only decodes the measures between the pins again.
+
+        Args:
+            pins (dict): measure index to the chord name it is pinned to
+
+        Returns: logprob (float), chord_progression (list)
+
+        """
+        if self.second_order is not None or self.duration_probability is not None:
+            raise ValueError("re-harmonization needs the first order measure model")
+        for measure, chord_name in pins.items():
+            if not 0 <= measure < len(self.measure_list_vector):
+                raise ValueError(f"measure {measure} is out of the song")
+            if chord_name not in self.chord_list:
+                raise ValueError(f"{chord_name} is not in the chord list of the song")
+
+        # a pinned silent measure is decoded like a sung one
+        active_measures = np.union1d(self.get_active_measures(), list(pins)).astype(int)
+        with np.errstate(divide='ignore'):
+            log_emission = np.log(self.model.emissionprob_).transpose()[active_measures]
+
+        if self.messages is None or not np.array_equal(self.messages[0], active_measures):
+            self.messages = active_measures, viterbi_messages(
+                log_emission, self.model.startprob_, self.model.transmat_)
+
+        active_pins = {int(np.searchsorted(active_measures, measure)): self.chord_list.index(chord_name)
+                       for measure, chord_name in pins.items()}
+        logprob, chord_sequence = constrained_viterbi(
+            log_emission, self.model.startprob_, self.model.transmat_, active_pins, self.messages[1])
+
+        chord_sequence = self.hold_silent_measures(chord_sequence, active_measures)
+
+        return logprob, [self.chord_list[i] for i in chord_sequence]
+
+    def get_active_measures(self) -> np.array:
+        """
+        Get the index of the measures with sung notes, every measure when
+        the whole take is silent or the beat level decoder places the changes.
+
+        Returns: the index of the active measures
+        """
+        n_measures = len(self.measure_list_vector)
+        if self.duration_probability is not None:
+            return np.arange(n_measures)
+
+        active_measures = np.flatnonzero([self.is_active(measure) for measure in self.measure_list_vector])
+        if len(active_measures) == 0:
+            return np.arange(n_measures)
+
+        return active_measures
+
+    @staticmethod
+    def is_active(measure) -> bool:
+        """
+        Check whether a measure has sung notes, the measure is either the
+        note names of the midi path or the chroma row of the activations.
+
+        Args:
+            measure (list | np.array): the note names or the chroma of the measure
+
+        Returns: True if the measure has sung notes
+        """
+        if len(measure) == 0:
+            return False
+        measure = np.asarray(measure)
+        if measure.dtype.kind not in 'biuf':
+            return True
+
+        return bool(measure.any())
+
+    def hold_silent_measures(self, chord_sequence, active_measures) -> np.array:
+        """
+        Expand the chords of the active measures to every measure, a silent
+        measure holds the chord before it (the first chord for a lead-in).
+
+        Args:
+            chord_sequence (np.array): the chord index of each active measure
+            active_measures (np.array): the index of the active measures
+
+        Returns: the chord index of every measure
+        """
+        previous_active = np.searchsorted(active_measures, np.arange(len(self.measure_list_vector)), side='right') - 1
+
+        return np.asarray(chord_sequence)[np.maximum(previous_active, 0)]
+
+
+# the drum hit of each beat of the bar
+drum_patterns = {
+    '4/4': [36, 38, 36, 38],
+    '3/4': [36, 38, 38],
+    '6/8': [36, 42, 42, 38, 42, 42],
+}
+
 
 class Accompaniment:
     """
@@ -70,30 +217,62 @@ class Accompaniment:
     Attributes:
         instrument (str): The instrument for the accompaniment. 
 
-        bpm (float): The beats per minute of the accompaniment.
+        bpm (float or list): The beats per minute of the accompaniment, or of each measure.
         main_stream (stream.Stream): The music21 stream object for the accompaniment. 
+        chord_length (float): The number of beats of each chord of the sequence.
+        time_signature (str): The time signature, e.g. '3/4'.
+        beats_per_bar (int): The number of beats of each measure.
+        beat_length (float): The quarter length of a beat, 0.5 for 6/8.
 
     Methods:
         generate(chords): Generate the accompaniment given the chords.
+        insert_meter(): Insert the time signature and the tempo of the beat.
     """
 
-    def __init__(self, bpm, chord_sequence=None):
+    def __init__(self, bpm, chord_sequence=None, chord_length=4, time_signature='4/4'):
         """
         Constructs all the necessary attributes for the accompaniment object.
 
         Args:
             instrument (str): The instrument for the accompaniment.
-            bpm (float): The beats per minute of the accompaniment.
+            bpm (float or list): The beats per minute of the accompaniment, a list is the
+                tempo map with the tempo of each measure.
             main_stream (stream.Stream): The music21 stream object for the accompaniment. 
+            chord_length (float): The number of beats of each chord of the sequence,
+                4 for one chord per measure, 1 for one chord per beat.
+            time_signature (str): The time signature, the beat is its denominator.
         """
 
         self.bpm = bpm
         self.main_stream = stream.Stream()
         self.chord_sequence = chord_sequence
+        self.chord_length = chord_length
+        self.time_signature = time_signature
+
+        numerator, denominator = time_signature.split('/')
+        self.beats_per_bar = int(numerator)
+        self.beat_length = 4 / int(denominator)
 
     def generate(self, chords):
         pass
 
+    def insert_meter(self):
+        """
+        Insert the time signature and the tempo, the tracked beats are the
+        denominator of the time signature. A tempo map gets a tempo mark at
+        every measure whose tempo changes, so each measure starts on its
+        detected downbeat.
+        """
+        self.main_stream.insert(0, meter.TimeSignature(self.time_signature))
+
+        bar_length = self.beats_per_bar * self.beat_length
+        previous_bpm = None
+        for measure, bpm in enumerate(np.atleast_1d(self.bpm)):
+            if previous_bpm is None or abs(bpm - previous_bpm) > 0.01:
+                self.main_stream.insert(measure * bar_length, tempo.MetronomeMark(
+                    number=round(float(bpm), 2), referent=duration.Duration(self.beat_length)))
+                previous_bpm = bpm
+
 
 class PianoAccompanimentMode1(Accompaniment):
     """
@@ -109,16 +288,18 @@ class PianoAccompanimentMode1(Accompaniment):
         generate(chords): Generate the piano accompaniment in mode 1 given the chords.
     """
 
-    def __init__(self, bpm, chord_sequence):
+    def __init__(self, bpm, chord_sequence, chord_length=4, time_signature='4/4'):
         """
         Constructs all the necessary attributes for the piano accompaniment in mode 1 object.
 
         Args:
             bpm (float): The beats per minute of the accompaniment.
             chord_sequence (list): The chord sequence for the accompaniment.
+            chord_length (float): The number of beats of each chord of the sequence.
+            time_signature (str): The time signature, e.g. '3/4'.
         """
 
-        super().__init__(bpm, chord_sequence)
+        super().__init__(bpm, chord_sequence, chord_length, time_signature)
 
         self.left_hand = stream.Part()
         self.right_hand = stream.Part()
@@ -142,37 +323,40 @@ class PianoAccompanimentMode1(Accompaniment):
             # left hand
 
             root_note = note.Note(root_note_str+'3')
-            root_note.duration.type = 'whole'
+            root_note.duration = duration.Duration(self.chord_length * self.beat_length)
 
             self.left_hand.append(root_note)
 
-            # right hand
-            for i in range(4):
+            # right hand, one chord each beat
+            hits = max(int(self.chord_length), 1)
+            for i in range(hits):
 
                 right_notes = chord.Chord(
                     [root_note_str+'4', third_note_str+'4', fifth_note_str+'4'])
-                right_notes.duration.type = 'quarter'
+                right_notes.duration = duration.Duration(self.chord_length * self.beat_length / hits)
 
                 self.right_hand.append(right_notes)
 
         self.main_stream.insert(0, self.left_hand)
         self.main_stream.insert(0, self.right_hand)
-        self.main_stream.insert(0, tempo.MetronomeMark(int(self.bpm)))
+        self.insert_meter()
 
         return self.main_stream
 
 
 class PianoAccompanimentMode2(Accompaniment):
-    def __init__(self, bpm, chord_sequence):
+    def __init__(self, bpm, chord_sequence, chord_length=4, time_signature='4/4'):
         """
         Constructs all the necessary attributes for the piano accompaniment in mode 1 object.
 
         Args:
             bpm (float): The beats per minute of the accompaniment.
             chord_sequence (list): The chord sequence for the accompaniment.
+            chord_length (float): The number of beats of each chord of the sequence.
+            time_signature (str): The time signature, e.g. '3/4'.
         """
 
-        super().__init__(bpm, chord_sequence)
+        super().__init__(bpm, chord_sequence, chord_length, time_signature)
 
         self.left_hand = stream.Part()
         self.right_hand = stream.Part()
@@ -190,26 +374,27 @@ class PianoAccompanimentMode2(Accompaniment):
             # left hand
 
             root_note = note.Note(root_note_str+'3')
-            root_note.duration.type = 'whole'
+            root_note.duration = duration.Duration(self.chord_length * self.beat_length)
 
             self.left_hand.append(root_note)
 
             # right hand
-            for i in range(4):
+            hits = max(int(self.chord_length), 1)
+            for i in range(hits):
                 if i % 2 == 0:
                     right_notes = chord.Chord(
                         [third_note_str+'4', fifth_note_str+'4'])
-                    right_notes.duration.type = 'quarter'
+                    right_notes.duration = duration.Duration(self.chord_length * self.beat_length / hits)
                     self.right_hand.append(right_notes)
                 else:
                     r_note = note.Note(root_note_str+'4')
-                    r_note.duration.type = 'quarter'
+                    r_note.duration = duration.Duration(self.chord_length * self.beat_length / hits)
 
                     self.right_hand.append(r_note)
 
         self.main_stream.insert(0, self.left_hand)
         self.main_stream.insert(0, self.right_hand)
-        self.main_stream.insert(0, tempo.MetronomeMark(int(self.bpm)))
+        self.insert_meter()
 
         return self.main_stream
 
@@ -229,16 +414,18 @@ class DrumAccompanimentMode1(Accompaniment):
 
     """
 
-    def __init__(self, bpm, chord_sequence):
+    def __init__(self, bpm, chord_sequence, chord_length=4, time_signature='4/4'):
         """
         Constructs all the necessary attributes for the drum accompaniment in mode 1 object.
 
         Args:
             bpm(float): The beats per minute of the accompaniment.
+            chord_length (float): The number of beats of each chord of the sequence.
+            time_signature (str): The time signature, e.g. '3/4'.
         """
-        super().__init__(bpm, chord_sequence)
+        super().__init__(bpm, chord_sequence, chord_length, time_signature)
         self.main_stream = stream.Stream()
-        self.num_measures = len(chord_sequence)
+        self.num_measures = round(len(chord_sequence) * chord_length / self.beats_per_bar)
         self.bpm = bpm
 
     def generate(self):
@@ -248,22 +435,16 @@ class DrumAccompanimentMode1(Accompaniment):
         Returns:
             main_stream (stream.Stream): The music21 stream object for the drum accompaniment in mode 1.
         """
-        pattern = [
-            (36, ),
-            (38, ),
-            (36,),
-            (38,)
-        ]
+        pattern = drum_patterns[self.time_signature]
 
         # Create the drum track
         for _ in range(self.num_measures):
-            for p in pattern:
-                for midi_pitch in p:
-                    n = note.Note()
-                    n.pitch.midi = midi_pitch
-                    n.duration = duration.Duration(1)
-                    self.main_stream.append(n)
-        self.main_stream.insert(0, tempo.MetronomeMark(int(self.bpm)))
+            for midi_pitch in pattern:
+                n = note.Note()
+                n.pitch.midi = midi_pitch
+                n.duration = duration.Duration(self.beat_length)
+                self.main_stream.append(n)
+        self.insert_meter()
         return self.main_stream
 
 
@@ -360,7 +541,7 @@ class Mixer:
 
     """
 
-    def __init__(self, vocal_file, piano_file, drum_file, vocal_start_time_in_ms):
+    def __init__(self, vocal_file, piano_file, drum_file, vocal_start_time, alignment_offset=0):
         """
         Constructs all the necessary attributes for the mixer object.
 
@@ -368,12 +549,20 @@ class Mixer:
             vocal_file (str): The filename of the vocal file.
             piano_file (str): The filename of the piano file.
             drum_file (str): The filename of the drum file.
-            vocal_start_time_in_ms (float): The start time of the vocal file in ms.
+            vocal_start_time (float): The start time of the vocal file in seconds.
+            alignment_offset (int): The offset of the vocal against the accompaniment
+                in vocal samples, from AlignmentCache.
 
         """
 
-        self.voice = AudioSegment.from_mp3(
-            vocal_file)[vocal_start_time_in_ms * 1000:]
+        # cut the vocal at the sample of its first downbeat
+        self.voice = AudioSegment.from_file(vocal_file)
+        start_sample = int(round(vocal_start_time * self.voice.frame_rate)) + alignment_offset
+        if start_sample >= 0:
+            self.voice = self.voice.get_sample_slice(start_sample, None)
+        else:
+            self.voice = AudioSegment.silent(
+                -start_sample * 1000 / self.voice.frame_rate, self.voice.frame_rate) + self.voice
         self.piano = AudioSegment.from_wav(piano_file)
         self.drum = AudioSegment.from_wav(drum_file)
         self.min_length = min(len(self.voice), len(self.piano), len(self.drum))
@@ -382,6 +571,20 @@ class Mixer:
         self.piano = self.piano[:self.min_length]
         self.drum = self.drum[:self.min_length]
 
+    def save_stems(self, stem_store):
+        """
+        the function to keep the aligned vocal, piano and drum before any
+        gain, so the song can be mixed again with other gains.
+
+        Args:
+            stem_store (StemStore): the stems of the job.
+        Returns:
+              None
+        """
+        stem_store.write({"vocal": self.voice, "piano": self.piano, "drum": self.drum})
+
+        return None
+
     def mix_instruments(self):
         """
         the function to mix the piano and drum.
@@ -408,12 +611,14 @@ class Mixer:
         print("mixing instruments successfully!")
         return mixed
 
-    def mix_vocal_instrumental(self, intrument_mixed):
+    def mix_vocal_instrumental(self, intrument_mixed,
+                               output_file="C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\uploaded_files\\combined.wav"):
         """
         the function to mix the vocal and instrumental.
 
         Args:
             intrument_mixed (AudioSegment): AudioSegment of the instrumental file.
+            output_file (str): the file name of the mixed song.
         Returns:
               None
         """
@@ -432,52 +637,370 @@ class Mixer:
 
         # export the file
 
-        mixed.export(
-            "C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\uploaded_files\\combined.wav", format="wav")
+        mixed.export(output_file, format="wav")
 
         return None
 
 
-def generate_music(vocal_file, vocal_midi_file):
-    # file adress
+class BarRenderCache:
+    """
+    The class to render the piano bar of each chord once, the piano track of
+    any chord sequence is then the concatenation of the cached bars, so the
+    n best progressions only render the distinct chords. With a tempo map
+    the bars are rendered at the median tempo and placed at the sample
+    offset of their measure.
 
-    midi_piano_file = 'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\midi\\piano.mid'
-    midi_drum_file = 'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\midi\\drum.mid'
-    wav_piano_file = "C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\wav\\piano.wav"
-    wav_drum_file = "C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\wav\\drum.wav"
-    model, vocal_tempo, the_start_time, chord_list, split_notes_list = hmm_pipeline(
-        vocal_file, vocal_midi_file)
+    Attributes:
+        SoundFont (str): The SoundFont file.
+        bpm (float or list): The beats per minute of the accompaniment, or of each measure.
+        work_dir (str): The folder of the rendered bars.
+        chord_length (float): The number of beats of each chord.
+        time_signature (str): The time signature, e.g. '3/4'.
+        bars (dict): chord name to the AudioSegment of its bar.
 
-    # generate the chord sequence
-    my_chord_generator = ChordGenerator(model, split_notes_list, chord_list)
-    chord_sequence = my_chord_generator.generate()
+    Examples usage:
+        bar_cache = BarRenderCache(SoundFont, 100, work_dir)
+        bar_cache.render(['C:maj', 'G:maj'], 'piano_1.wav')
+        bar_cache.update(['C:maj', 'G:maj'], ['C:maj', 'F:maj'], 'piano_1.wav')
+    """
 
-    # generate the piano accompaniment
-    my_piano_accompaniment = PianoAccompanimentMode1(
-        vocal_tempo, chord_sequence)
-    piano_accompaniment = my_piano_accompaniment.generate()
+    def __init__(self, SoundFont, bpm, work_dir, chord_length=4, time_signature='4/4'):
+        """
+        Constructs all the necessary attributes for the bar render cache object.
+        """
+        self.SoundFont = SoundFont
+        self.bpm = bpm
+        self.work_dir = work_dir
+        self.chord_length = chord_length
+        self.time_signature = time_signature
+        self.bars = {}
 
-    # generate the drum accompaniment
-    my_drum_accompaniment = DrumAccompanimentMode1(vocal_tempo, chord_sequence)
-    drum_accompaniment = my_drum_accompaniment.generate()
+    def get_bar(self, chord_name):
+        """
+        The function to get the rendered bar of the chord, rendering it on
+        the first call.
+
+        Args:
+            chord_name (str): the chord name
+
+        Returns:
+            AudioSegment of the bar
+        """
+        if chord_name not in self.bars:
+            midi_file = os.path.join(self.work_dir, f"bar_{len(self.bars)}.mid")
+            wav_file = os.path.join(self.work_dir, f"bar_{len(self.bars)}.wav")
+
+            bar = PianoAccompanimentMode1(float(np.median(self.bpm)), [chord_name], self.chord_length,
+                                          self.time_signature).generate()
+            MIDIFile(midi_file, bar).write()
+            WAVFile(self.SoundFont, midi_file, wav_file).convert_and_write()
+
+            self.bars[chord_name] = AudioSegment.from_wav(wav_file)
+
+        return self.bars[chord_name]
+
+    def render(self, chord_sequence, wav_file):
+        """
+        The function to write the piano track of the chord sequence.
+
+        Args:
+            chord_sequence (list): the chord sequence
+            wav_file (str): the file name of the piano track
+
+        Returns:
+            the file name of the piano track
+        """
+        chord_start = self.get_chord_start(len(chord_sequence))
+
+        track = AudioSegment.empty()
+        for i, chord_name in enumerate(chord_sequence):
+            track += self.get_bar_slice(chord_name, chord_start[i], chord_start[i + 1])
+
+        track.export(wav_file, format="wav")
+
+        return wav_file
+
+    def update(self, previous_sequence, chord_sequence, wav_file):
+        """
+        The function to replace only the changed bars of a rendered piano
+        track, the rest of the track is kept as it is.
+
+        Args:
+            previous_sequence (list): the chord sequence of the rendered track
+            chord_sequence (list): the new chord sequence, of the same length
+            wav_file (str): the file name of the piano track, overwritten
+
+        Returns:
+            the file name of the piano track
+        """
+        changed = np.flatnonzero([i != j for i, j in zip(previous_sequence, chord_sequence)])
+        if len(changed) == 0:
+            return wav_file
+
+        chord_start = self.get_chord_start(len(chord_sequence))
+        track = AudioSegment.from_wav(wav_file)
+
+        # each run of changed chords is spliced in once
+        runs = np.split(changed, np.flatnonzero(np.diff(changed) > 1) + 1)
+        for run in runs:
+            begin, end = round(chord_start[run[0]]), round(chord_start[run[-1] + 1])
+            bars = AudioSegment.empty()
+            for i in run:
+                bars += self.get_bar_slice(chord_sequence[i], chord_start[i], chord_start[i + 1])
+            bars = bars.set_channels(track.channels).set_frame_rate(track.frame_rate)
+            track = track[:begin] + bars + track[end:]
+
+        track.export(wav_file, format="wav")
+
+        return wav_file
+
+    def get_chord_start(self, n_chords) -> np.array:
+        """
+        The function to get the start time of each chord (and the end of the
+        last one) in milliseconds from the tempo map.
+
+        Args:
+            n_chords (int): the number of chords
+
+        Returns:
+            the n_chords + 1 start times
+        """
+        # the tempo of each chord, chords_per_bar chords share a measure
+        tempo_map = np.atleast_1d(self.bpm)
+        chords_per_bar = max(round(int(self.time_signature.split('/')[0]) / self.chord_length), 1)
+        chord_tempo = tempo_map[np.minimum(np.arange(n_chords) // chords_per_bar, len(tempo_map) - 1)]
+
+        return np.concatenate([[0], np.cumsum(self.chord_length * 60000 / chord_tempo)])
+
+    def get_bar_slice(self, chord_name, start, end):
+        """
+        The function to get the bar of the chord cut (or padded) to the
+        chord span.
+
+        Args:
+            chord_name (str): the chord name
+            start (float): the start of the chord in milliseconds
+            end (float): the end of the chord in milliseconds
+
+        Returns:
+            AudioSegment of the chord span
+        """
+        # cut on the rounded cumulative time, so the bars do not drift
+        length = round(end) - round(start)
+        bar = self.get_bar(chord_name)[:length]
+        if len(bar) < length:
+            bar = bar + AudioSegment.silent(length - len(bar), frame_rate=bar.frame_rate)
+
+        return bar
+
+
+# file adress
+midi_piano_file = 'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\midi\\piano.mid'
+midi_drum_file = 'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\midi\\drum.mid'
+wav_piano_file = "C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\wav\\piano.wav"
+wav_drum_file = "C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\wav\\drum.wav"
+combined_file = "C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\api\\uploaded_files\\combined.wav"
+piano_sound_font = 'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\data_process\\soundfont\\Nice-Steinway-v3.9.sf2'
+stem_dir = os.path.join(os.path.dirname(wav_piano_file), "stems")
+drum_sound_font = 'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\data_process\\soundfont\\Ultimate Acoustic Session Kit.sf2'
+
+
+def analyze_music(vocal_file, vocal_midi_file, transition_order=1, beat_info=None, large_vocabulary=False,
+                  segments_per_measure=1, n_best=1, note_activation=None) -> dict:
+    """
+    the function to run the analysis stages only, up to the chord decoding,
+    nothing is rendered
+
+    Args:
+        vocal_file (str): the vocal file name
+        vocal_midi_file (str): the transcribed vocal midi file name
+        transition_order (int): the order of the chord transition model
+        beat_info (tuple): the result of get_beat_info if already computed
+        large_vocabulary (bool): use the sparse model of the full chord vocabulary
+        segments_per_measure (int): split each measure into beats or half bars
+        n_best (int): the number of chord progressions
+        note_activation (np.array): the frame note activations of the transcription model
+
+    Returns:
+        the analysis dict with key, time_signature, tempo (of each measure), start_time,
+        downbeats, chord_length, chord_sequence, progressions (list of (logprob, chords))
+        and the chord_generator kept for the re-harmonization
+    """
+
+    if beat_info is None:
+        with stage("beat_tracking"):
+            beat_info = get_beat_info(vocal_file)
+    time_section = beat_info[1]
+
+    model, vocal_tempo, the_start_time, chord_list, split_notes_list, time_signature, key_signature = hmm_pipeline(
+        vocal_file, vocal_midi_file, beat_info, large_vocabulary, segments_per_measure, note_activation)
+    chord_length = int(time_signature.split('/')[0]) / segments_per_measure
+
+    # generate the chord sequence
+    with stage("decoding"):
+        second_order = None
+        if transition_order == 2 and not large_vocabulary:
+            second_order = generate_second_order_transition_matrix(chord_list)
+        # beat level decoding chooses where the chords change
+        duration_probability = None
+        if segments_per_measure > 1 and not large_vocabulary:
+            duration_probability = generate_duration_probability(segments_per_measure)
+        my_chord_generator = ChordGenerator(
+            model, split_notes_list, chord_list, second_order, duration_probability)
+        if n_best > 1:
+            progressions = my_chord_generator.generate_n_best(n_best)
+            chord_sequence = progressions[0][1]
+        else:
+            chord_sequence = my_chord_generator.generate()
+            progressions = [(None, chord_sequence)]
+
+    return {"key": key_signature, "time_signature": time_signature, "tempo": [float(i) for i in vocal_tempo],
+            "start_time": float(the_start_time), "downbeats": [float(i[0]) for i in time_section],
+            "chord_length": chord_length, "chord_sequence": list(chord_sequence),
+            "progressions": [(None if logprob is None else float(logprob), list(chords))
+                             for logprob, chords in progressions],
+            "chord_generator": my_chord_generator}
+
+
+def generate_music(vocal_file, vocal_midi_file, transition_order=1, beat_info=None, large_vocabulary=False,
+                   segments_per_measure=1, n_best=1, note_activation=None, analysis=None):
+    # the analysis stages, skipped when an analysis of the job is given
+    if analysis is None:
+        analysis = analyze_music(vocal_file, vocal_midi_file, transition_order, beat_info, large_vocabulary,
+                                 segments_per_measure, n_best, note_activation)
+
+    vocal_tempo = analysis["tempo"]
+    the_start_time = analysis["start_time"]
+    time_signature = analysis["time_signature"]
+    chord_length = analysis["chord_length"]
+    chord_sequence = analysis["chord_sequence"]
+    progressions = analysis["progressions"]
+
+    with stage("accompaniment"):
+        # generate the piano accompaniment
+        my_piano_accompaniment = PianoAccompanimentMode1(
+            vocal_tempo, chord_sequence, chord_length, time_signature)
+        piano_accompaniment = my_piano_accompaniment.generate()
+
+        # generate the drum accompaniment
+        my_drum_accompaniment = DrumAccompanimentMode1(vocal_tempo, chord_sequence, chord_length, time_signature)
+        drum_accompaniment = my_drum_accompaniment.generate()
 
     # write the MIDI file
-    piano_midi_file = MIDIFile(midi_piano_file, piano_accompaniment)
-    piano_midi_file.write()
+    with stage("midi_write"):
+        piano_midi_file = MIDIFile(midi_piano_file, piano_accompaniment)
+        piano_midi_file.write()
 
-    drum_midi_file = MIDIFile(midi_drum_file, drum_accompaniment)
-    drum_midi_file.write()
+        drum_midi_file = MIDIFile(midi_drum_file, drum_accompaniment)
+        drum_midi_file.write()
 
     # convert the MIDI file to WAV file
-    piano_wav_file = WAVFile(
-        'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\data_process\\soundfont\\Nice-Steinway-v3.9.sf2', midi_piano_file, wav_piano_file)
-    piano_wav_file.convert_and_write()
-
-    drum_wav_file = WAVFile(
-        'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\data_process\\soundfont\\Ultimate Acoustic Session Kit.sf2', midi_drum_file, wav_drum_file)
-    drum_wav_file.convert_and_write()
+    with stage("render"):
+        bar_cache = None
+        if len(progressions) > 1:
+            # every progression is put together from the bars of its chords
+            bar_cache = BarRenderCache(piano_sound_font, vocal_tempo,
+                                       os.path.dirname(wav_piano_file), chord_length, time_signature)
+            wav_piano_files = [bar_cache.render(progression, wav_piano_file.replace(".wav", f"_{rank}.wav"))
+                               for rank, (_, progression) in enumerate(progressions)]
+        else:
+            piano_wav_file = WAVFile(
+                piano_sound_font, midi_piano_file, wav_piano_file)
+            piano_wav_file.convert_and_write()
+            wav_piano_files = [wav_piano_file]
+
+        # what is on disk, for the later edits of the job
+        analysis.update(rendered_sequence=list(chord_sequence), piano_file=wav_piano_files[0], bar_cache=bar_cache)
+
+        drum_wav_file = WAVFile(
+            drum_sound_font, midi_drum_file, wav_drum_file)
+        drum_wav_file.convert_and_write()
+
+    # the offset of the vocal against the drum beat grid, once per job
+    with stage("alignment"):
+        alignment_cache = AlignmentCache(os.path.join(os.path.dirname(wav_drum_file), "alignment.json"))
+        alignment_offset = alignment_cache.get_offset(wav_drum_file, vocal_file, the_start_time, midi_drum_file)
 
     # mix
-    my_mixer = Mixer(vocal_file,
-                     wav_piano_file, wav_drum_file, the_start_time)
-    my_mixer.mix_vocal_instrumental(my_mixer.mix_instruments())
+    with stage("mix"):
+        for rank, piano_file in enumerate(wav_piano_files):
+            output_file = combined_file if rank == 0 else combined_file.replace(".wav", f"_{rank}.wav")
+            my_mixer = Mixer(vocal_file,
+                             piano_file, wav_drum_file, the_start_time, alignment_offset)
+            if rank == 0:
+                # the stems of the song for a later remix
+                my_mixer.save_stems(StemStore(stem_dir))
+            my_mixer.mix_vocal_instrumental(my_mixer.mix_instruments(), output_file)
+
+    return progressions
+
+
+def reharmonize_music(vocal_file, analysis, pins) -> (float, list):
+    """
+    the function to decode the song again with some measures pinned to a
+    chord, only the changed bars of the rendered piano track are replaced
+    and the song is mixed again
+
+    Args:
+        vocal_file (str): the vocal file name
+        analysis (dict): the analysis of the job, from analyze_music, updated in place
+        pins (dict): measure index to the chord name it is pinned to
+
+    Returns:
+        logprob (float) the log probability of the new chord sequence
+        chord_sequence (list) the new chord sequence
+    """
+
+    with stage("decoding"):
+        logprob, chord_sequence = analysis["chord_generator"].reharmonize(pins)
+    analysis.update(chord_sequence=chord_sequence, progressions=[(logprob, chord_sequence)])
+
+    # nothing rendered yet, render the whole song
+    if "piano_file" not in analysis:
+        generate_music(vocal_file, None, analysis=analysis)
+        return logprob, chord_sequence
+
+    with stage("render"):
+        if analysis["bar_cache"] is None:
+            analysis["bar_cache"] = BarRenderCache(piano_sound_font, analysis["tempo"],
+                                                   os.path.dirname(wav_piano_file), analysis["chord_length"],
+                                                   analysis["time_signature"])
+        analysis["bar_cache"].update(analysis["rendered_sequence"], chord_sequence, analysis["piano_file"])
+        analysis["rendered_sequence"] = list(chord_sequence)
+
+    # the drum track does not change, its offset is cached
+    with stage("alignment"):
+        alignment_cache = AlignmentCache(os.path.join(os.path.dirname(wav_drum_file), "alignment.json"))
+        alignment_offset = alignment_cache.get_offset(wav_drum_file, vocal_file, analysis["start_time"],
+                                                      midi_drum_file)
+
+    with stage("mix"):
+        my_mixer = Mixer(vocal_file, analysis["piano_file"], wav_drum_file, analysis["start_time"], alignment_offset)
+        my_mixer.save_stems(StemStore(stem_dir))
+        my_mixer.mix_vocal_instrumental(my_mixer.mix_instruments(), combined_file)
+
+    return logprob, chord_sequence
+
+
+def remix_music(gains=None, mutes=(), streaming=False):
+    """
+    the function to mix the stems of the last rendered song again with other
+    gains, nothing is rendered
+
+    Args:
+        gains (dict): stem name (vocal, piano, drum) to its gain in dB
+        mutes (list): the stem names left out of the mix
+        streaming (bool): return the chunks of the wav file while it is mixed
+
+    Returns:
+        the file name of the mix, or the iterator of its chunks if streaming
+    """
+
+    stem_store = StemStore(stem_dir)
+    if stem_store.layout is None:
+        raise FileNotFoundError(f"no stems in {stem_dir}")
+    if streaming:
+        return stem_store.stream_mix(combined_file, gains, mutes)
+
+    with stage("mix"):
+        return stem_store.mix(combined_file, gains, mutes)
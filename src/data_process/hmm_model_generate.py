@@ -1,108 +1,27 @@
 import pandas as pd
-from pychord import Chord
-from data_process.song_analyze import convert_to_note_name, get_beat_info, get_scale_tones_enharmonic_equivalent, predict_key_of_song, split_midi_to_measure
+from pychord.utils import note_to_val
+from data_process.song_analyze import (estimate_key_from_chroma, get_beat_info, get_tempo_map, predict_key_of_song,
+                                      split_activation_to_measure, split_midi_to_measure, split_time_section)
+from data_process.model_artifact import (get_key_table, load_second_order_model, load_vocabulary_model,
+                                         model_artifact_file, split_chord_list)
+from data_process.decoder import beam_viterbi
+from data_process.profiling import stage
+from scipy import sparse
 from scipy.special import softmax
 from hmmlearn import hmm
 import numpy as np
+import warnings
 
 
-def get_the_chord_list(chord_file: str) -> list:
-    """
-    the function to get the chord list from the chord dataset
-
-    Args:
-        chord_file (str): the chord file name
-
-    Returns:
-        the chord list
-    """
-
-    chord = pd.read_csv(chord_file)
-    chord_list = chord['chord'].unique()
-    chord_list.sort()
-
-    # remove the last two chord
-    chord_list = list(chord_list[:len(chord_list)-2])
-
-    return chord_list
-
-
-def trim_the_chord(chord_list: list, adjust_key_tonic_name: list) -> (list, int):
-    """
-    this stage is to check chord's component is in the scale or not
-    if not, remove it
-
-    Args:
-        chord_list (list): the chord list
-        adjust_key_tonic_name (list): the adjust key tonic name with enharmonic equivalent
-
-    Returns:
-        chord_list (list) the trim chord list  
-        chord_len (int) the length of chord list  
-    """
-
-    for i in chord_list:
-
-        c = Chord(convert_to_note_name(i))
-
-        # if chord's component is not in the scale, add to chord_list
-        if c.components() not in adjust_key_tonic_name:
-
-            # # 50 %chance to delete
-            # if np.random.randint(0, 2) == 0:
-            chord_list.remove(i)
-
-    return chord_list, len(chord_list)
-
-
-def preprocess_melody_observation_matrix(melody_file: str, chord_list: list) -> pd.DataFrame:
-    """
-    read the melody_observation_matrix and preprocess for emission probability 
-    in hmm model
-
-    Args:
-        melody_file (str): the melody observation matrix file name
-        chord_list (list): the chord list
-    Returns: 
-        the melody observation matrix
-    """
-    # read all_pitch_sorted.csv as dataframe
-    df_pitch = pd.read_csv(melody_file)
-
-    # preprocess dataframe
-    df_pitch.rename(columns={'Unnamed: 0': 'chord'}, inplace=True)
-    # remove row with chord = 'start_chord' ro 'end_chord'
-
-    df_pitch = df_pitch[df_pitch['chord'] != 'start_chord']
-    df_pitch = df_pitch[df_pitch['chord'] != 'end_chord']
-
-    # reset index
-    df_pitch.reset_index(drop=True, inplace=True)
-    # sort by chord column
-    df_pitch.sort_values(by=['chord'], inplace=True)
-
-    """Since certain notes are very unlikely to appear when certain
-    chords are playing, many combinations of notes and chords
-    will have no observed data. We add a few “imaginary”
-    instances of every note observed for a short duration over
-    every chord"""
-
-    # add 1 to column except 'chord' column
-    df_pitch.iloc[:, 1:] = df_pitch.iloc[:, 1:].apply(lambda x: x + 1)
-
-    # remove the row with chord not in chord_list
-    df_pitch = df_pitch[df_pitch['chord'].isin(chord_list)]
-
-    return df_pitch
-
-
-def caculate_emission_probability(split_notes_list: list, df_pitch: pd.DataFrame) -> list:
+def caculate_emission_probability(split_notes_list: list, df_pitch) -> list:
     """
     the function to caculate the emission probability
 
     Args:
         split_notes_list (list): the list of notes already split 
         by the measure
+        df_pitch (pd.DataFrame or np.array): the melody observation matrix,
+        either the DataFrame with the chord column or the precomputed key table
 
     Returns:
         emission matrix probability as loglikelihood_list
@@ -114,11 +33,10 @@ def caculate_emission_probability(split_notes_list: list, df_pitch: pd.DataFrame
 
     # create 12 dim vector for each measure
     measure_list_vector = []
-    loglikelihood_list = []
     for measure in split_notes_list:
         temp_list = []
         for pitch in pitch_names:
-            temp_list.append(measure.count(pitch)/len(measure) + 1e-10)
+            temp_list.append(measure.count(pitch)/max(len(measure), 1) + 1e-10)
         measure_list_vector.append(temp_list)
 
     """
@@ -129,13 +47,38 @@ def caculate_emission_probability(split_notes_list: list, df_pitch: pd.DataFrame
     observation probabilities. 
     """
 
-    for measure_vector in measure_list_vector:
-        temp_list = []
+    if isinstance(df_pitch, pd.DataFrame):
+        observation_matrix = df_pitch.iloc[:, 1:].to_numpy().astype(float)
+    else:
+        observation_matrix = np.asarray(df_pitch, dtype=float)
 
-        for i in range(len(df_pitch)):
-            temp_list.append(np.dot(measure_vector, np.log2(
-                df_pitch.iloc[i, 1:].to_numpy().astype(float))))
-        loglikelihood_list.append(temp_list)
+    # all measures against all chords in one matrix product
+    loglikelihood_list = (np.array(measure_list_vector) @
+                          np.log2(observation_matrix).transpose()).tolist()
+
+    return loglikelihood_list
+
+
+def caculate_chroma_emission_probability(measure_chroma: np.array, observation_matrix: np.array) -> list:
+    """
+    the function to caculate the emission probability from the chroma of
+    each measure instead of the note counts, the same dot product with the
+    log of the melody observation matrix
+
+    Args:
+        measure_chroma (np.array): the measures x 12 chroma
+        observation_matrix (np.array): the melody observation matrix of the chord list
+
+    Returns:
+        emission matrix probability as loglikelihood_list
+    """
+
+    # the pitch class distribution of each measure
+    totals = measure_chroma.sum(axis=1, keepdims=True)
+    measure_list_vector = measure_chroma / np.maximum(totals, 1e-10) + 1e-10
+
+    loglikelihood_list = (measure_list_vector @
+                          np.log2(np.asarray(observation_matrix, dtype=float)).transpose()).tolist()
 
     return loglikelihood_list
 
@@ -164,9 +107,7 @@ def generate_emission_matrix(loglikelihood_list: list) -> np.array:
     emission_matrix = loglikelihood_list_matrix.transpose()
 
     # normalize emission matrix each row to 1 ues softmax
-
-    for i in range(len(emission_matrix)):
-        emission_matrix[i] = softmax(emission_matrix[i])
+    emission_matrix = softmax(emission_matrix, axis=1)
 
     # convert nan to 0
     emission_matrix = np.nan_to_num(emission_matrix)
@@ -177,43 +118,66 @@ def generate_emission_matrix(loglikelihood_list: list) -> np.array:
     return emission_matrix
 
 
-def generate_transition_matrix(transition__chord_matrix_file: str, chord_list: list) -> np.array:
+def generate_second_order_transition_matrix(chord_list: list, artifact_file: str = model_artifact_file) -> sparse.csr_matrix:
     """
-    the function to generate the transition matrix
+    the function to generate the second order transition matrix of the
+    trimmed chord list from the sparse model in the artifact, the pairs of
+    chords the model has never seen get empty rows so the decoder backs off
+    to the first order transition
 
     Args:
-        transition__chord_matrix_file (str): the transition chord matrix file name
         chord_list (list): the trimmed chord list
+        artifact_file (str): the model artifact file name
     Returns:
-        the transition matrix
+        the second order transition matrix, row i * len(chord_list) + j holds P(k | i, j),
+        or None if the artifact has no second order model
     """
 
-    transition_matrix = pd.read_csv(transition__chord_matrix_file)
-    # preprocess dataframe
-    transition_matrix.rename(columns={'Unnamed: 0': 'chord'}, inplace=True)
-    # remove the row with chord not in chord_list
-    transition_matrix = transition_matrix[transition_matrix['chord'].isin(
-        chord_list)]
-    # remove the column's name not in chord_list but remain the column "chord"
-    transition_matrix = transition_matrix[transition_matrix.columns.intersection(
-        chord_list)]
+    second_order_model = load_second_order_model(artifact_file)
+    if second_order_model is None:
+        warnings.warn("the model artifact has no second order transition, decoding with the first order")
+        return None
+
+    all_chord_list, transitions = second_order_model
 
-    # remove the % in each element
-    transition_matrix = transition_matrix.apply(
-        lambda x: x.str.replace('%', ''))
+    # select matrix of the trimmed chords, all zero for an unknown chord
+    position = {chord: i for i, chord in enumerate(all_chord_list)}
+    index = np.array([position.get(chord, -1) for chord in chord_list])
+    known = np.flatnonzero(index >= 0)
+    select = sparse.csr_matrix((np.ones(len(known)), (known, index[known])),
+                               shape=(len(chord_list), len(all_chord_list)))
 
-    # convert to numpy array
-    transition_matrix = np.array(transition_matrix)
+    # keep the rows and columns of the trimmed chords
+    transitions = sparse.kron(select, select, format='csr') @ transitions @ select.T
 
-    # normalize transition matrix each row to 1
-    for i in range(len(transition_matrix)):
-        transition_matrix[i] = transition_matrix[i].astype(float)
-        transition_matrix[i] = transition_matrix[i]/sum(transition_matrix[i])
+    # normalize each row to 1
+    row_sum = np.asarray(transitions.sum(axis=1)).ravel()
+    transitions = sparse.diags(np.divide(1, row_sum, out=np.zeros_like(row_sum), where=row_sum > 0)) @ transitions
 
-    # change dtype to float
-    transition_matrix = transition_matrix.astype(float)
+    return transitions.tocsr()
 
-    return transition_matrix
+
+def get_key_chord_index(chord_list: list, key_signature: str) -> int:
+    """
+    the function to find the tonic chord of the key in the chord list by
+    root pitch class, so 'Db:maj' matches the expanded 'C#:maj'
+
+    Args:
+        chord_list (list): the chord list
+        key_signature (str): the key signature, e.g. 'Db:maj'
+
+    Returns:
+        the index of the tonic chord, None if it is not in the chord list
+    """
+
+    tonic, _, quality = key_signature.partition(':')
+    roots, quality_code, qualities = split_chord_list(chord_list)
+    if quality not in qualities:
+        return None
+
+    match = np.flatnonzero((roots == note_to_val(tonic)) & (quality_code == qualities.index(quality)))
+
+    return int(match[0]) if len(match) else None
 
 
 def ensemble_hmm_model(transition_matrix: np.array, emission_matrix: np.array, chord_list: list, key_signature: str) -> hmm.CategoricalHMM:
@@ -237,11 +201,12 @@ def ensemble_hmm_model(transition_matrix: np.array, emission_matrix: np.array, c
     start_probability = np.full(n_states, 1/n_states)
 
     # observation that is note vector
-    if key_signature in chord_list:
+    key_index = get_key_chord_index(chord_list, key_signature)
+    if key_index is not None:
 
         classic_factor = 1
         start_probability = np.full(n_states, 0, dtype=float)
-        start_probability[chord_list.index(key_signature)] = classic_factor
+        start_probability[key_index] = classic_factor
 
         for i in range(len(start_probability)):
             if start_probability[i] == 0:
@@ -265,56 +230,172 @@ def ensemble_hmm_model(transition_matrix: np.array, emission_matrix: np.array, c
     return model
 
 
-def hmm_pipeline(vocal_file, vocal_midi_file) -> (hmm.CategoricalHMM, float, float, list, list):
+class SparseChordModel:
+    """
+    The class of the chord HMM over a large vocabulary, with the same
+    attributes and decode method as hmm.CategoricalHMM but a sparse
+    transition matrix decoded with a pruned beam
+
+    Attributes:
+        startprob_ (np.array): the start probability
+        transmat_ (sparse.csr_matrix): the sparse transition matrix
+        emissionprob_ (np.array): the emission matrix
+        unigram_ (np.array): the chord frequency used as backoff
+        beam_width (int): the number of chords kept per measure
     """
-    the pipeline to generate the hmm model
 
+    def __init__(self, startprob, transmat, emissionprob, unigram, beam_width=64):
+        """
+        Args:
+            startprob (np.array): The start probability.
+            transmat (sparse.csr_matrix): The sparse transition matrix.
+            emissionprob (np.array): The emission matrix.
+            unigram (np.array): The chord frequency used as backoff.
+            beam_width (int): The number of chords kept per measure.
+        """
+        self.startprob_ = startprob
+        self.transmat_ = transmat
+        self.emissionprob_ = emissionprob
+        self.unigram_ = unigram
+        self.beam_width = beam_width
+
+    def decode(self, X, algorithm="viterbi"):
+        """
+        Decode the most likely chord of each observation.
+
+        Args:
+            X (np.array): The observations, one column.
+            algorithm (str): Only "viterbi" is supported.
+
+        Returns:
+            logprob (float) and the chord index of each observation
+        """
+        with np.errstate(divide='ignore'):
+            log_emission = np.log(self.emissionprob_[:, np.ravel(X)]).transpose()
+
+        return beam_viterbi(log_emission, self.startprob_, self.transmat_, self.beam_width, unigram=self.unigram_)
+
+
+def ensemble_sparse_hmm_model(transition_matrix: sparse.csr_matrix, emission_matrix: np.array, chord_list: list,
+                              key_signature: str, unigram: np.array) -> SparseChordModel:
+    """
+    the function to ensemble the hmm model of the large chord vocabulary
+
+    Args:
+        transition_matrix (sparse.csr_matrix): the sparse transition matrix
+        emission_matrix (np.array): the emission matrix
+        chord_list (list): the chord vocabulary
+        key_signature (str): the key signature
+        unigram (np.array): the chord frequency used as backoff
     Returns:
-        model(hmm.CategoricalHMM) the ensembled hmm model
-        vocal_tempo(float) the vocal tempo
-        start_time(float) the start time of the vocal time
-        chord_list(list) the trimmed chord list
-        split_notes_list(list) the list of notes already split by the measure
+        the ensembled sparse model
     """
 
-    transition__chord_matrix_file = "C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\data_process\\transition__chord_matrix\\csv_file\\transition_chord.csv"
-    melody_observation_matrix_file = 'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\data_process\\melody observation matrix\\csv_file\\all_pitch.csv'
-    original_chord_list = get_the_chord_list(
-        'C:\\Users\\Hsieh\\Documents\\nccucs\\specialTopic\\special_topic\\src\\data_process\\transition__chord_matrix\\csv_file\\all_chord.csv')
+    # same start probability as ensemble_hmm_model
+    start_probability = np.zeros(len(chord_list))
+    key_index = get_key_chord_index(chord_list, key_signature)
+    if key_index is not None:
+        start_probability[key_index] = 1
+    start_probability = softmax(start_probability)
+
+    return SparseChordModel(start_probability, transition_matrix, emission_matrix, unigram)
 
-    # 1. get the vocal tempo, time section, start time
-    vocal_tempo, time_section, the_start_time = get_beat_info(vocal_file)
 
-    vocal_tempo = int(vocal_tempo)
-    # 2. split the vocal melody to measure
-    split_notes_list = split_midi_to_measure(vocal_midi_file, time_section)
+def generate_duration_probability(segments_per_measure: int, max_measures: int = 2) -> np.array:
+    """
+    the function to generate the chord duration prior of the beat level
+    decoding, chords lasting whole half bars are twice as likely
+
+    Args:
+        segments_per_measure (int): the number of segments of each measure
+        max_measures (int): the longest chord in measures
+
+    Returns:
+        the probability of a chord lasting 1..segments_per_measure * max_measures segments
+    """
 
-    # 3. get enharmonic scale
-    enharmonic_scale_tonic_name = get_scale_tones_enharmonic_equivalent(
-        vocal_midi_file)
+    duration = np.arange(1, segments_per_measure * max_measures + 1)
+    half_bar = max(segments_per_measure // 2, 1)
+    duration_probability = np.where(duration % half_bar == 0, 2.0, 1.0)
 
-    # 4. get the trimmed chord list
-    chord_list, chord_len = trim_the_chord(
-        original_chord_list, enharmonic_scale_tonic_name)
+    return duration_probability / duration_probability.sum()
 
-    # 5. get the melody observation matrix
-    df_pitch = preprocess_melody_observation_matrix(
-        melody_observation_matrix_file, chord_list)
 
-    # 6. caculate the emission probability
-    loglikelihood_list = caculate_emission_probability(
-        split_notes_list, df_pitch)
+def hmm_pipeline(vocal_file, vocal_midi_file, beat_info=None, large_vocabulary=False,
+                 segments_per_measure=1, note_activation=None) -> (hmm.CategoricalHMM, list, float, list, list, str, str):
+    """
+    the pipeline to generate the hmm model
+
+    Args:
+        vocal_file (str): the vocal file name
+        vocal_midi_file (str): the transcribed vocal midi file name
+        beat_info (tuple): the result of get_beat_info if already computed
+        large_vocabulary (bool): use the sparse model of the full chord vocabulary
+        segments_per_measure (int): split each measure into beats or half bars
+        note_activation (np.array): the frame note activations of the transcription model,
+            the measures are read from them instead of the midi file if given
 
-    # 7. generate the emission matrix
-    emission_matrix = generate_emission_matrix(loglikelihood_list)
+    Returns:
+        model(hmm.CategoricalHMM) the ensembled hmm model
+        vocal_tempo(list) the vocal tempo of each measure
+        start_time(float) the start time of the vocal time
+        chord_list(list) the trimmed chord list
+        split_notes_list(list) the list of notes (or chroma) already split by the measure (or segment)
+        time_signature(str) the detected time signature
+        keysignature(str) the detected key
+    """
 
-    # 8. generate the transition matrix
-    transition_matrix = generate_transition_matrix(
-        transition__chord_matrix_file, chord_list)
+    # 1. get the vocal tempo, time section, start time
+    if beat_info is None:
+        with stage("beat_tracking"):
+            beat_info = get_beat_info(vocal_file)
+    vocal_tempo, time_section, the_start_time, time_signature = beat_info
 
-    # 9. ensemble the hmm model
-    keysignature = predict_key_of_song(vocal_midi_file)
-    model = ensemble_hmm_model(
-        transition_matrix, emission_matrix, chord_list, keysignature)
+    # the tempo of each measure from the detected downbeats
+    vocal_tempo = get_tempo_map(time_section, int(time_signature.split('/')[0]))
+    # 2. split the vocal melody to measure
+    with stage("measure_split"):
+        if segments_per_measure > 1:
+            time_section = split_time_section(time_section, segments_per_measure)
+        if note_activation is not None:
+            measure_chroma = split_activation_to_measure(note_activation, time_section)
+            split_notes_list = list(measure_chroma)
+        else:
+            split_notes_list = split_midi_to_measure(vocal_midi_file, time_section)
+
+    # 3. predict the key of the song
+    with stage("key_detection"):
+        if note_activation is not None:
+            keysignature = estimate_key_from_chroma(measure_chroma.sum(axis=0))
+        else:
+            keysignature = predict_key_of_song(vocal_midi_file)
+
+    with stage("emission"):
+        # 4. look up the trimmed chord list, the transition matrix and the
+        # melody observation matrix precomputed for the key
+        if large_vocabulary:
+            chord_list, transition_matrix, unigram, observation_matrix = load_vocabulary_model()
+        else:
+            chord_list, transition_matrix, observation_matrix = get_key_table(
+                keysignature)
+
+        # 5. caculate the emission probability
+        if note_activation is not None:
+            loglikelihood_list = caculate_chroma_emission_probability(
+                measure_chroma, observation_matrix)
+        else:
+            loglikelihood_list = caculate_emission_probability(
+                split_notes_list, observation_matrix)
+
+        # 6. generate the emission matrix
+        emission_matrix = generate_emission_matrix(loglikelihood_list)
+
+    # 7. ensemble the hmm model
+    if large_vocabulary:
+        model = ensemble_sparse_hmm_model(
+            transition_matrix, emission_matrix, chord_list, keysignature, unigram)
+    else:
+        model = ensemble_hmm_model(
+            transition_matrix, emission_matrix, chord_list, keysignature)
 
-    return model, vocal_tempo, the_start_time, chord_list, split_notes_list
+    return model, vocal_tempo, the_start_time, chord_list, split_notes_list, time_signature, keysignature
@@ -1,10 +1,17 @@
 import pandas as pd
+import numpy as np
 import pretty_midi
 import os
 from pathlib import Path
+from data_process.corpus_store import chord_corpus_dir, full_chord_corpus_dir, has_corpus, melody_corpus_dir, write_corpus
+from data_process.model_artifact import to_relative_observation, update_model_artifact
+from data_process.transition__chord_matrix.transition_chord import data_preprocess as chord_data_preprocess, load_all_df
 # relative path
 relative_path = os.path.dirname(os.path.realpath(__file__))
 
+# Equal temperament
+pitch_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
 
 def midi_note_to_pitch(midi_note) -> str:
     """
@@ -13,8 +20,6 @@ def midi_note_to_pitch(midi_note) -> str:
     return: str
     """
 
-    # Equal temperament
-    pitch_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
     octave = (midi_note - 12) // 12 + 1
     pitch_class = midi_note % 12
     pitch_name = pitch_names[pitch_class]
@@ -32,12 +37,9 @@ def get_midi_file(relative_path) -> list:
 
     # get the file in the upper folder POP909
     parent_path = Path(relative_path).parent
-    file_list = os.listdir(os.path.join(parent_path, 'POP909'))
 
-    # remove file that fileName is not number
-    for file in file_list:
-        if not file.isdigit():
-            file_list.remove(file)
+    # only the song folders, sorted in the song_num order of the chord corpus
+    file_list = sorted(file for file in os.listdir(os.path.join(parent_path, 'POP909')) if file.isdigit())
 
     for file in file_list:
 
@@ -62,42 +64,133 @@ def data_preprocess(midi_data) -> pd.DataFrame:
 
     for note in midi_data.instruments[0].notes:
         if note.velocity != 0:
-            melody.append([float(note.start), midi_note_to_pitch(note.pitch)])
-    melody_df = pd.DataFrame(melody, columns=['start', 'note'])
+            melody.append([float(note.start), float(note.end), midi_note_to_pitch(note.pitch), note.pitch % 12])
+    melody_df = pd.DataFrame(melody, columns=['start', 'end', 'note', 'pitch_class'])
 
     return melody_df
 
 
-def merge_all_df(file_list) -> pd.DataFrame:
+def chord_preprocess(chord_file, simplify=True) -> pd.DataFrame:
+    """
+    read the chord annotation of a song with the data preprocess of the
+    transition chord pipeline, with float times for the join
+    :param chord_file: the chord_midi.txt file of the song
+    :param simplify: strip the bass and the extensions of the chord
+    :return: chord_df
+    """
+
+    chord_df = pd.read_csv(chord_file, sep='\t', header=None, names=['start_time', 'end_time', 'chord'])
+    chord_df = chord_data_preprocess(chord_df, simplify)
+
+    chord_df['start_time'] = chord_df['start_time'].astype(float)
+    chord_df['end_time'] = chord_df['end_time'].astype(float)
+
+    return chord_df
+
+
+def join_melody_to_chord(melody_df, chord_df) -> pd.DataFrame:
     """
-    merge all midi_df
-    :param file_list: the midi file list
-    :return all_df 
+    join every melody note to the chord interval sounding at its onset
+    with a searchsorted join over the sorted chord start times
+    :param melody_df: the melody DataFrame of a song
+    :param chord_df: the chord DataFrame of the same song
+    :return: DataFrame with chord, pitch_class and weight (the note duration
+        clipped to the chord interval)
     """
 
-    all_df = pd.DataFrame()
+    chord_df = chord_df.sort_values('start_time')
+    chord_start = chord_df['start_time'].to_numpy()
+    chord_end = chord_df['end_time'].to_numpy()
+
+    note_start = melody_df['start'].to_numpy()
+    note_end = melody_df['end'].to_numpy()
+
+    # index of the last chord starting at or before each note onset
+    chord_index = np.searchsorted(chord_start, note_start, side='right') - 1
+    inside = chord_index >= 0
+    inside[inside] &= note_start[inside] < chord_end[chord_index[inside]]
+
+    chord_index = chord_index[inside]
+    weight = np.minimum(note_end[inside], chord_end[chord_index]) - note_start[inside]
 
-    for index, file in enumerate(file_list):
+    return pd.DataFrame({'chord': chord_df['chord'].to_numpy()[chord_index],
+                         'pitch_class': melody_df['pitch_class'].to_numpy()[inside],
+                         'weight': weight})
+
+
+def get_melody_observation_matrix(joined_df) -> pd.DataFrame:
+    """
+    accumulate the duration weighted pitch class counts of each chord, the
+    durations are in units of the mean note duration so the matrix stays on
+    the scale of note counts (and of the "imaginary" +1 instance added to
+    every cell before normalizing)
+    :param joined_df: the melody notes joined to the chords
+    :return: the melody observation matrix, chord by pitch
+    """
 
-        mid = pretty_midi.PrettyMIDI(file)
+    chord_code, chord_list = pd.factorize(joined_df['chord'], sort=True)
 
-        midi_df = data_preprocess(mid)
+    weight = joined_df['weight'].to_numpy(dtype=float)
+    weight = weight * len(weight) / max(weight.sum(), 1e-10)
 
-        midi_df['song_num'] = index
-        all_df = pd.concat([all_df, midi_df])
+    observation = np.zeros((len(chord_list), len(pitch_names)))
+    np.add.at(observation, (chord_code, joined_df['pitch_class'].to_numpy()), weight)
 
-    return all_df
+    return pd.DataFrame(observation, index=chord_list, columns=pitch_names)
 
 
-def pipeline() -> pd.DataFrame:
+def pipeline(large_vocabulary=False) -> pd.DataFrame:
     """
-    pipeline
+    pipeline, the chords of each song are taken from the chord corpus and
+    only read from the chord_midi.txt files when the corpus is missing
+    :param large_vocabulary: keep the full chord vocabulary (extensions,
+        inversions, slash chords) for the sparse large vocabulary model
     """
     midi_file_list = get_midi_file(relative_path)
-    all_df = merge_all_df(midi_file_list)
 
-    all_df.to_csv('all_melody_df.csv', index=True, header=True)
+    corpus_dir = full_chord_corpus_dir if large_vocabulary else chord_corpus_dir
+    song_chords = None
+    if has_corpus(corpus_dir):
+        all_df = load_all_df(corpus_dir, min_count=1 if large_vocabulary else 31)
+        song_chords = dict(tuple(all_df.groupby('song_num')))
+
+    joined_list = []
+    for song_num, midi_file in enumerate(midi_file_list):
+        if song_chords is None:
+            chord_df = chord_preprocess(os.path.join(os.path.dirname(midi_file), 'chord_midi.txt'),
+                                        simplify=not large_vocabulary)
+        elif song_num in song_chords:
+            chord_df = song_chords[song_num]
+        else:
+            continue
+        melody_df = data_preprocess(pretty_midi.PrettyMIDI(midi_file))
+        joined_list.append(join_melody_to_chord(melody_df, chord_df))
+
+    joined_df = pd.concat(joined_list, ignore_index=True)
+
+    if large_vocabulary:
+        observation_df = get_melody_observation_matrix(joined_df)
+        update_model_artifact(vocabulary_observation_chord_list=observation_df.index.to_numpy(dtype=str),
+                              vocabulary_observation_matrix=observation_df.to_numpy())
+        return observation_df
+
+    write_corpus(joined_df, melody_corpus_dir)
+
+    observation_df = get_melody_observation_matrix(joined_df)
+
+    # keep the csv for inspection and emit the matrix into the model artifact
+    file_path = os.path.join(relative_path, 'csv_file', 'all_pitch.csv')
+    observation_df.to_csv(file_path, index=True, header=True)
+    # the counts of the 12 roots pooled into the root relative model
+    qualities, relative_observation = to_relative_observation(observation_df.index.to_list(), observation_df.to_numpy())
+    update_model_artifact(observation_chord_list=observation_df.index.to_numpy(dtype=str),
+                          observation_matrix=observation_df.to_numpy(),
+                          relative_observation_qualities=np.array(qualities),
+                          relative_observation=relative_observation)
+
+    return observation_df
 
 
 if __name__ == "__main__":
-    pipeline()
+    import sys
+    pipeline('--large-vocabulary' in sys.argv)
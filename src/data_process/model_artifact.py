@@ -0,0 +1,707 @@
+import hashlib
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from pychord.utils import note_to_val
+from data_process.chord_table import ChordTable
+from data_process.corpus_store import chord_corpus_dir, has_corpus
+
+# relative path
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+# the compiled model artifact shared by the training pipelines and the api
+model_artifact_file = os.path.join(dir_path, 'model', 'chord_hmm.npz')
+
+# the artifact compiled on load when the shipped one has no per key tables,
+# kept out of the package directory which may be read-only
+artifact_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'auto_accompany')
+
+# the csv files shipped with the repo, used when the corpus is not available
+transition_chord_csv_file = os.path.join(dir_path, 'transition__chord_matrix', 'csv_file', 'transition_chord.csv')
+all_pitch_csv_file = os.path.join(dir_path, 'melody observation matrix', 'csv_file', 'all_pitch.csv')
+
+# pitch class of the scale tones, music21 MinorScale is the natural minor
+scale_intervals = {'maj': [0, 2, 4, 5, 7, 9, 11], 'min': [0, 2, 3, 5, 7, 8, 10]}
+key_tonic_names = ['C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
+key_names = [tonic + ':' + quality for quality in scale_intervals for tonic in key_tonic_names]
+
+
+def load_model_artifact(artifact_file: str = model_artifact_file) -> dict:
+    """
+    the function to load the compiled model artifact
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        the dict of arrays stored in the artifact, empty if the artifact
+        is not built yet
+    """
+
+    if not os.path.exists(artifact_file):
+        return {}
+
+    with np.load(artifact_file, allow_pickle=False) as artifact:
+        return {name: artifact[name] for name in artifact.files}
+
+
+def save_model_artifact(artifact: dict, artifact_file: str = model_artifact_file) -> None:
+    """
+    the function to save the compiled model artifact
+
+    Args:
+        artifact (dict): the dict of arrays to store
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        None
+    """
+
+    os.makedirs(os.path.dirname(artifact_file), exist_ok=True)
+    np.savez_compressed(artifact_file, **artifact)
+
+
+def update_model_artifact(artifact_file: str = model_artifact_file, **arrays) -> dict:
+    """
+    the function to add or replace arrays in the compiled model artifact,
+    so each training pipeline only rewrites its own part
+
+    Args:
+        artifact_file (str): the model artifact file name
+        arrays: the arrays to store, keyed by name
+
+    Returns:
+        the updated artifact
+    """
+
+    artifact = load_model_artifact(artifact_file)
+    artifact.update({name: np.asarray(value) for name, value in arrays.items()})
+    save_model_artifact(artifact, artifact_file)
+
+    return artifact
+
+
+def import_csv_tables(artifact_file: str = model_artifact_file, transition_file: str = transition_chord_csv_file,
+                      observation_file: str = all_pitch_csv_file, overwrite: bool = True) -> dict:
+    """
+    the function to put the transition and melody observation csv files
+    into the model artifact, for trees without the POP909 corpus
+
+    Args:
+        artifact_file (str): the model artifact file name
+        transition_file (str): the transition chord csv file name
+        observation_file (str): the melody observation csv file name
+        overwrite (bool): replace the tables a training pipeline already stored
+
+    Returns:
+        the updated artifact
+    """
+
+    for file in (transition_file, observation_file):
+        if not os.path.exists(file):
+            raise FileNotFoundError(f"{file} is missing, run the training pipelines to build the model artifact")
+
+    artifact = load_model_artifact(artifact_file)
+    tables = {}
+
+    transition_df = pd.read_csv(transition_file, index_col=0)
+    transition_df = transition_df.apply(lambda x: x.str.replace('%', '').astype(float) / 100)
+
+    observation_df = pd.read_csv(observation_file, index_col=0)
+    observation_df = observation_df.drop(['start_chord', 'end_chord'], errors='ignore')
+
+    if overwrite or 'transition_matrix' not in artifact:
+        tables.update(transition_chord_list=transition_df.index.to_numpy(dtype=str),
+                      transition_matrix=transition_df.to_numpy(dtype=float))
+    if overwrite or 'observation_matrix' not in artifact:
+        tables.update(observation_chord_list=observation_df.index.to_numpy(dtype=str),
+                      observation_matrix=observation_df.to_numpy(dtype=float))
+
+    return update_model_artifact(artifact_file, **tables)
+
+
+def to_second_order_transition(all_df: pd.DataFrame) -> (np.array, sparse.csr_matrix):
+    """
+    the function to count the second order transition (chord pair -> chord)
+    of the chord corpus, the triples crossing two songs are left out
+
+    Args:
+        all_df (pd.DataFrame): the chord corpus with the chord and song_num columns
+
+    Returns:
+        chord_list (np.array) the chords without start_chord and end_chord
+        transitions (sparse.csr_matrix) row i * len(chord_list) + j holds P(k | i, j)
+    """
+
+    chord_list = np.sort(all_df['chord'].unique())
+    chord_list = chord_list[~np.isin(chord_list, ['start_chord', 'end_chord'])]
+    n_chords = len(chord_list)
+
+    # chord code of each row, -1 for start_chord and end_chord
+    code = pd.Index(chord_list).get_indexer(all_df['chord']).astype(np.int64)
+    song_num = all_df['song_num'].to_numpy()
+
+    # every three consecutive chords in the same song
+    first, second, third = code[:-2], code[1:-1], code[2:]
+    same_song = (song_num[:-2] == song_num[1:-1]) & (song_num[1:-1] == song_num[2:])
+    valid = same_song & (first >= 0) & (second >= 0) & (third >= 0)
+
+    counts = sparse.coo_matrix((np.ones(valid.sum()), (first[valid] * n_chords + second[valid], third[valid])),
+                               shape=(n_chords * n_chords, n_chords)).tocsr()
+
+    # normalize each row to 1
+    row_sum = np.asarray(counts.sum(axis=1)).ravel()
+    transitions = sparse.diags(np.divide(1, row_sum, out=np.zeros_like(row_sum), where=row_sum > 0)) @ counts
+
+    return chord_list.astype(str), transitions.tocsr()
+
+
+def import_second_order_table(artifact_file: str = model_artifact_file, corpus_dir: str = chord_corpus_dir,
+                              overwrite: bool = True) -> dict:
+    """
+    the function to put the second order transition counted from the
+    shipped chord corpus into the model artifact
+
+    Args:
+        artifact_file (str): the model artifact file name
+        corpus_dir (str): the chord corpus directory
+        overwrite (bool): replace the table the training pipeline already stored
+
+    Returns:
+        the updated artifact
+    """
+
+    artifact = load_model_artifact(artifact_file)
+    if not overwrite and 'second_order_chord_list' in artifact:
+        return artifact
+
+    if not has_corpus(corpus_dir):
+        raise FileNotFoundError(f"{corpus_dir} is missing, run python data_process/transition__chord_matrix/"
+                                f"transition_chord.py --refresh to build the chord corpus")
+
+    # imported here, the training pipeline imports this module
+    from data_process.transition__chord_matrix.transition_chord import load_all_df
+
+    chord_list, transitions = to_second_order_transition(load_all_df(corpus_dir))
+
+    return update_model_artifact(artifact_file, second_order_chord_list=chord_list,
+                                 second_order_data=transitions.data,
+                                 second_order_indices=transitions.indices,
+                                 second_order_indptr=transitions.indptr)
+
+
+def has_key_tables(artifact: dict) -> bool:
+    """
+    the function to check the artifact has the per key tables or a complete
+    root relative model to build them from
+
+    Args:
+        artifact (dict): the loaded model artifact
+
+    Returns:
+        True if the per key tables can be loaded
+    """
+
+    return 'chord_list' in artifact or has_relative_model(artifact)
+
+
+def get_cached_artifact_file(artifact_file: str = model_artifact_file) -> str:
+    """
+    the function to get the file of the artifact compiled on load for an
+    artifact, in the user cache directory
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        the compiled artifact file name
+    """
+
+    name = hashlib.sha1(os.path.abspath(artifact_file).encode()).hexdigest()[:16]
+
+    return os.path.join(artifact_cache_dir, f'chord_hmm_{name}.npz')
+
+
+def build_model_artifact(artifact_file: str = model_artifact_file) -> str:
+    """
+    the function to find the artifact to load the per key tables from. An
+    artifact without them (e.g. on a fresh checkout) is compiled into the
+    user cache directory, the tables the training pipelines did not store
+    are taken from the shipped csv files and the second order transition is
+    counted from the shipped chord corpus. The package directory is only
+    written by the training pipelines and python -m data_process.model_artifact.
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        the file name of the artifact with the per key tables
+    """
+
+    if has_key_tables(load_model_artifact(artifact_file)):
+        return artifact_file
+
+    # compiled again once the artifact is trained further
+    cached_file = get_cached_artifact_file(artifact_file)
+    if os.path.exists(cached_file) and has_key_tables(load_model_artifact(cached_file)) and (
+            not os.path.exists(artifact_file) or os.path.getmtime(cached_file) >= os.path.getmtime(artifact_file)):
+        return cached_file
+
+    save_model_artifact(load_model_artifact(artifact_file), cached_file)
+    import_csv_tables(cached_file, overwrite=False)
+    compile_relative_model(cached_file)
+    if has_corpus(chord_corpus_dir):
+        import_second_order_table(cached_file, overwrite=False)
+
+    return cached_file
+
+
+def build_key_tables(chord_list: list, transition_matrix: np.array, observation_matrix: np.array) -> dict:
+    """
+    the function to find, for the 24 major and minor keys, the chords whose
+    components are all in the scale and renormalize the transition and
+    observation submatrices of these chords
+
+    Args:
+        chord_list (list): the chord vocabulary
+        transition_matrix (np.array): the transition matrix of the vocabulary
+        observation_matrix (np.array): the melody observation counts of the vocabulary
+
+    Returns:
+        dict of key index to (chord index, transition_matrix, observation_matrix)
+    """
+
+    # add the "imaginary" instances of every note over every chord
+    observation_matrix = observation_matrix + 1
+
+    chord_table = ChordTable(chord_list)
+
+    key_tables = {}
+    for key_index, key_name in enumerate(key_names):
+        tonic, quality = key_name.split(':')
+        scale_mask = np.zeros(12, dtype=bool)
+        scale_mask[(note_to_val(tonic) + np.array(scale_intervals[quality])) % 12] = True
+
+        index = np.flatnonzero(chord_table.in_scale(scale_mask))
+
+        key_transition = transition_matrix[np.ix_(index, index)]
+        row_sum = key_transition.sum(axis=1, keepdims=True)
+        key_transition = np.divide(key_transition, row_sum, out=np.full_like(key_transition, 1 / len(index)),
+                                   where=row_sum > 0)
+
+        key_observation = observation_matrix[index]
+        key_observation = key_observation / key_observation.sum(axis=1, keepdims=True)
+
+        key_tables[key_index] = index, key_transition, key_observation
+
+    return key_tables
+
+
+def compile_key_tables(artifact_file: str = model_artifact_file) -> dict:
+    """
+    the function to precompute and store the tables of the 24 major and
+    minor keys from the absolute transition and observation tables
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        the updated artifact
+    """
+
+    artifact = load_model_artifact(artifact_file)
+
+    transition_chord_list = list(artifact['transition_chord_list'])
+    observation_chord_list = list(artifact['observation_chord_list'])
+
+    # the vocabulary is the chords known by both tables
+    chord_list = sorted(set(transition_chord_list) & set(observation_chord_list))
+    transition_index = np.array([transition_chord_list.index(i) for i in chord_list])
+    observation_index = np.array([observation_chord_list.index(i) for i in chord_list])
+
+    key_tables = {}
+    for key_index, (index, key_transition, key_observation) in build_key_tables(
+            chord_list, artifact['transition_matrix'][np.ix_(transition_index, transition_index)],
+            artifact['observation_matrix'][observation_index]).items():
+        key_tables[f'key_chord_index_{key_index}'] = index
+        key_tables[f'key_transition_{key_index}'] = key_transition
+        key_tables[f'key_observation_{key_index}'] = key_observation
+
+    # the stored tables replace a relative model
+    artifact = {name: value for name, value in artifact.items() if not name.startswith('relative_')}
+    artifact.update(chord_list=np.array(chord_list), key_names=np.array(key_names), **key_tables)
+    save_model_artifact(artifact, artifact_file)
+
+    load_key_tables.cache_clear()
+    load_chord_table.cache_clear()
+    load_relative_model.cache_clear()
+
+    return artifact
+
+
+def split_chord_list(chord_list: list, qualities: list = None) -> (np.array, np.array, list):
+    """
+    the function to split the chord names into root and quality, the
+    start_chord and end_chord markers get the quality -1
+
+    Args:
+        chord_list (list): the chord names, e.g. 'Bb:maj7'
+        qualities (list): the quality vocabulary, the sorted qualities of the chords if None
+
+    Returns:
+        roots (np.array) the pitch class of the root of each chord
+        quality_code (np.array) the index of the quality of each chord, -1 if unknown
+        qualities (list) the quality vocabulary
+    """
+
+    parts = [str(i).partition(':') for i in chord_list]
+    if qualities is None:
+        qualities = sorted({quality for root, _, quality in parts if quality})
+
+    quality_index = {quality: i for i, quality in enumerate(qualities)}
+    roots = np.array([note_to_val(root) if quality else 0 for root, _, quality in parts], dtype=int)
+    quality_code = np.array([quality_index.get(quality, -1) for root, _, quality in parts], dtype=int)
+
+    return roots, quality_code, list(qualities)
+
+
+def to_relative_transition(chord_list: list, transition_counts: np.array) -> (list, np.array):
+    """
+    the function to pool the transitions of the 12 roots into a root
+    relative (interval + quality) model, every chord pair is transposed so
+    its first chord is on C
+
+    Args:
+        chord_list (list): the chord names of the rows and columns
+        transition_counts (np.array): the transition counts (or probabilities)
+
+    Returns:
+        qualities (list) the quality vocabulary
+        relative_transition (np.array) Q x 12 x Q, the weight of quality q1 moving
+            by an interval to quality q2
+    """
+
+    roots, quality_code, qualities = split_chord_list(chord_list)
+    known = np.flatnonzero(quality_code >= 0)
+    roots, quality_code = roots[known], quality_code[known]
+
+    # root x quality -> root x quality counts
+    absolute = np.zeros((12, len(qualities), 12, len(qualities)))
+    np.add.at(absolute, (roots[:, None], quality_code[:, None], roots[None, :], quality_code[None, :]),
+              np.asarray(transition_counts, dtype=float)[np.ix_(known, known)])
+
+    # transpose each source root to C, the target root becomes the interval
+    relative_transition = np.zeros((len(qualities), 12, len(qualities)))
+    for root in range(12):
+        relative_transition += np.roll(absolute[root], -root, axis=1)
+
+    return qualities, relative_transition
+
+
+def to_relative_observation(chord_list: list, observation_counts: np.array) -> (list, np.array):
+    """
+    the function to pool the melody observation of the 12 roots into a root
+    relative model, the pitch classes are counted from the root
+
+    Args:
+        chord_list (list): the chord names of the rows
+        observation_counts (np.array): the chord x 12 pitch class counts
+
+    Returns:
+        qualities (list) the quality vocabulary
+        relative_observation (np.array) Q x 12 counts of each interval above the root
+    """
+
+    roots, quality_code, qualities = split_chord_list(chord_list)
+    known = np.flatnonzero(quality_code >= 0)
+
+    absolute = np.zeros((12, len(qualities), 12))
+    np.add.at(absolute, (roots[known], quality_code[known]), np.asarray(observation_counts, dtype=float)[known])
+
+    relative_observation = np.zeros((len(qualities), 12))
+    for root in range(12):
+        relative_observation += np.roll(absolute[root], -root, axis=1)
+
+    return qualities, relative_observation
+
+
+def expand_relative_model(qualities: list, relative_transition: np.array, observation_qualities: list,
+                          relative_observation: np.array) -> (list, np.array, np.array):
+    """
+    the function to expand the root relative model to the absolute chords of
+    the 12 roots, the qualities never seen with a melody get the pitch
+    classes of the chord as observation
+
+    Args:
+        qualities (list): the quality vocabulary of the transitions
+        relative_transition (np.array): Q x 12 x Q relative transition weights
+        observation_qualities (list): the quality vocabulary of the observation
+        relative_observation (np.array): the interval counts of each observed quality
+
+    Returns:
+        chord_list (list) the 12 x Q chords
+        transition_matrix (np.array) the row normalized transition matrix
+        observation_matrix (np.array) the melody observation counts
+    """
+
+    chord_list = [key_tonic_names[root] + ':' + quality for root in range(12) for quality in qualities]
+    roots = np.repeat(np.arange(12), len(qualities))
+    quality_code = np.tile(np.arange(len(qualities)), 12)
+
+    interval = (roots[None, :] - roots[:, None]) % 12
+    transition_matrix = relative_transition[quality_code[:, None], interval, quality_code[None, :]]
+    row_sum = transition_matrix.sum(axis=1, keepdims=True)
+    transition_matrix = np.divide(transition_matrix, row_sum, out=np.full_like(transition_matrix, 1 / len(chord_list)),
+                                  where=row_sum > 0)
+
+    # chord template on C for the unobserved qualities, then rolled to each root
+    observation_index = {quality: i for i, quality in enumerate(observation_qualities)}
+    template = ChordTable([key_tonic_names[0] + ':' + quality for quality in qualities]).masks * 10.0
+    for row, quality in enumerate(qualities):
+        if quality in observation_index:
+            template[row] = relative_observation[observation_index[quality]]
+    observation_matrix = template[quality_code[:, None], (np.arange(12)[None, :] - roots[:, None]) % 12]
+
+    return chord_list, transition_matrix, observation_matrix
+
+
+def compile_relative_model(artifact_file: str = model_artifact_file) -> dict:
+    """
+    the function to turn the absolute tables of the artifact into the root
+    relative model, the per key tables are then built on load and are
+    dropped from the artifact
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        the compiled artifact
+    """
+
+    artifact = load_model_artifact(artifact_file)
+
+    qualities, relative_transition = to_relative_transition(
+        artifact['transition_chord_list'], artifact['transition_matrix'])
+    observation_qualities, relative_observation = to_relative_observation(
+        artifact['observation_chord_list'], artifact['observation_matrix'])
+
+    artifact = {name: value for name, value in artifact.items()
+                if not name.startswith('key_') and name not in ('chord_list', 'key_names')}
+    artifact.update(relative_qualities=np.array(qualities), relative_transition=relative_transition,
+                    relative_observation_qualities=np.array(observation_qualities),
+                    relative_observation=relative_observation)
+    save_model_artifact(artifact, artifact_file)
+
+    load_key_tables.cache_clear()
+    load_chord_table.cache_clear()
+    load_relative_model.cache_clear()
+
+    return artifact
+
+
+def has_relative_model(artifact: dict) -> bool:
+    """
+    the function to check the artifact has both halves of the root relative
+    model, the transition and melody pipelines each store their own half
+
+    Args:
+        artifact (dict): the loaded model artifact
+
+    Returns:
+        True if the relative transition and observation are both stored
+    """
+
+    return all(name in artifact for name in ('relative_qualities', 'relative_transition',
+                                             'relative_observation_qualities', 'relative_observation'))
+
+
+@lru_cache(maxsize=None)
+def load_relative_model(artifact_file: str = model_artifact_file) -> (list, np.array, np.array):
+    """
+    the function to load the root relative model expanded to the absolute
+    chords once per process
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        chord_list, transition_matrix, observation_matrix as expand_relative_model,
+        None if the artifact has no complete relative model
+    """
+
+    artifact = load_model_artifact(artifact_file)
+    if not has_relative_model(artifact):
+        return None
+
+    return expand_relative_model(artifact['relative_qualities'].tolist(), artifact['relative_transition'],
+                                 artifact['relative_observation_qualities'].tolist(),
+                                 artifact['relative_observation'])
+
+
+@lru_cache(maxsize=None)
+def load_key_tables(artifact_file: str = model_artifact_file) -> dict:
+    """
+    the function to load the per key tables once per process
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        dict of (tonic pitch class, quality) to
+        (chord_list, transition_matrix, observation_matrix), built from the
+        root relative model when the artifact has one
+    """
+
+    artifact_file = build_model_artifact(artifact_file)
+
+    # the tables of the relative model are built here instead of stored
+    relative_model = load_relative_model(artifact_file)
+    if relative_model is not None:
+        chord_list = np.array(relative_model[0])
+        key_tables = {}
+        for key_index, (index, key_transition, key_observation) in build_key_tables(*relative_model).items():
+            tonic, quality = key_names[key_index].split(':')
+            key_tables[(note_to_val(tonic), quality)] = chord_list[index].tolist(), key_transition, key_observation
+        return key_tables
+
+    artifact = load_model_artifact(artifact_file)
+    chord_list = artifact['chord_list']
+
+    key_tables = {}
+    for key_index, key_name in enumerate(artifact['key_names']):
+        tonic, quality = key_name.split(':')
+        key_tables[(note_to_val(tonic), quality)] = (
+            chord_list[artifact[f'key_chord_index_{key_index}']].tolist(),
+            artifact[f'key_transition_{key_index}'],
+            artifact[f'key_observation_{key_index}'])
+
+    return key_tables
+
+
+@lru_cache(maxsize=None)
+def load_chord_table(artifact_file: str = model_artifact_file) -> ChordTable:
+    """
+    the function to build the chord table of the vocabulary once per process,
+    shared by trimming, accompaniment voicing and rendering
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        the chord table
+    """
+
+    artifact_file = build_model_artifact(artifact_file)
+
+    relative_model = load_relative_model(artifact_file)
+    if relative_model is not None:
+        return ChordTable(relative_model[0])
+
+    return ChordTable(load_model_artifact(artifact_file).get('chord_list', np.array([])).tolist())
+
+
+@lru_cache(maxsize=None)
+def load_vocabulary_model(artifact_file: str = model_artifact_file) -> (list, sparse.csr_matrix, np.array, np.array):
+    """
+    the function to load the sparse model of the large chord vocabulary
+    once per process, chords never seen with a melody get the pitch classes
+    of the chord as observation
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        chord_list (list) the chord vocabulary
+        transition_matrix (sparse.csr_matrix) the sparse transition matrix
+        unigram (np.array) the chord frequency
+        observation_matrix (np.array) the normalized melody observation matrix
+    """
+
+    artifact = load_model_artifact(artifact_file)
+
+    # only the training pipelines build the large vocabulary model, the full
+    # chord corpus is not shipped
+    if 'vocabulary_chord_list' not in artifact or 'vocabulary_observation_chord_list' not in artifact:
+        raise FileNotFoundError(
+            f"{artifact_file} has no large vocabulary model, with the POP909 dataset in src/data_process/POP909 "
+            f"run from src: PYTHONPATH=. python data_process/transition__chord_matrix/transition_chord.py "
+            f"--large-vocabulary && PYTHONPATH=. python 'data_process/melody observation matrix/melody_note.py' "
+            f"--large-vocabulary")
+
+    chord_list = artifact['vocabulary_chord_list'].tolist()
+    transition_matrix = sparse.csr_matrix((artifact['vocabulary_transition_data'],
+                                           artifact['vocabulary_transition_indices'],
+                                           artifact['vocabulary_transition_indptr']),
+                                          shape=(len(chord_list), len(chord_list)))
+
+    # chord template first, replaced by the counts of the observed chords
+    observation_matrix = ChordTable(chord_list).masks * 10.0
+    observation_index = {chord: i for i, chord in enumerate(artifact['vocabulary_observation_chord_list'])}
+    for row, chord in enumerate(chord_list):
+        if chord in observation_index:
+            observation_matrix[row] = artifact['vocabulary_observation_matrix'][observation_index[chord]]
+
+    # add the "imaginary" instances of every note over every chord
+    observation_matrix = observation_matrix + 1
+    observation_matrix /= observation_matrix.sum(axis=1, keepdims=True)
+
+    return chord_list, transition_matrix, artifact['vocabulary_unigram'], observation_matrix
+
+
+@lru_cache(maxsize=None)
+def load_second_order_model(artifact_file: str = model_artifact_file) -> (list, sparse.csr_matrix):
+    """
+    the function to load the sparse second order transition once per process
+
+    Args:
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        chord_list (list) the chords of the second order model
+        transitions (sparse.csr_matrix) row i * len(chord_list) + j holds P(k | i, j)
+        or None if the artifact has no second order transition
+    """
+
+    artifact = load_model_artifact(build_model_artifact(artifact_file))
+    if 'second_order_chord_list' not in artifact:
+        return None
+
+    chord_list = artifact['second_order_chord_list'].tolist()
+    transitions = sparse.csr_matrix((artifact['second_order_data'], artifact['second_order_indices'],
+                                     artifact['second_order_indptr']),
+                                    shape=(len(chord_list) ** 2, len(chord_list)))
+
+    return chord_list, transitions
+
+
+def get_key_table(key_signature: str, artifact_file: str = model_artifact_file) -> (list, np.array, np.array):
+    """
+    the function to look up the precomputed tables of a key
+
+    Args:
+        key_signature (str): the key signature, e.g. 'Bb:maj' or 'C#:min'
+        artifact_file (str): the model artifact file name
+
+    Returns:
+        chord_list (list) the chords in the key
+        transition_matrix (np.array) the renormalized transition matrix
+        observation_matrix (np.array) the renormalized melody observation matrix
+    """
+
+    tonic, quality = key_signature.split(':')
+
+    return load_key_tables(artifact_file)[(note_to_val(tonic), quality)]
+
+
+if __name__ == "__main__":
+    import sys
+    import_csv_tables(overwrite=False)
+    if has_corpus(chord_corpus_dir):
+        import_second_order_table(overwrite=False)
+    # the absolute per key tables are only stored on demand
+    if '--absolute' in sys.argv:
+        compile_key_tables()
+    else:
+        compile_relative_model()
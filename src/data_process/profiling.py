@@ -0,0 +1,202 @@
+import cProfile
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+    import psutil
+
+
+def get_peak_rss() -> int:
+    """
+    the function to get the peak resident set size of the process
+
+    Returns:
+        the peak rss in bytes
+    """
+
+    if resource is None:
+        return psutil.Process().memory_info().peak_wset
+
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_current_rss() -> int:
+    """
+    the function to get the current resident set size of the process
+
+    Returns:
+        the rss in bytes
+    """
+
+    if resource is None:
+        return psutil.Process().memory_info().rss
+
+    # the second field of statm is the resident pages
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class StageTimer:
+    """
+    The class to collect the stage spans of one request
+
+    Attributes:
+        stages (list): the record of each finished stage
+
+    Examples usage:
+        with track_stages() as timer:
+            with stage("decoding"):
+                ...
+        timer.as_dict()
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def as_dict(self) -> list:
+        """
+        Get the records of the stages in the order they finished.
+
+        Returns:
+            list of dict with stage, wall_time, cpu_time, rss_delta,
+            peak_rss and peak_rss_delta
+        """
+        return list(self.stages)
+
+
+class StageMetrics:
+    """
+    The class to aggregate the stage spans of all requests for /metrics
+
+    Attributes:
+        totals (dict): stage name to [count, wall_time, cpu_time, rss_delta,
+            peak_rss_delta, peak_rss], the peak_rss is the highest seen
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def observe(self, record: dict) -> None:
+        """
+        Add one stage record.
+
+        Args:
+            record (dict): the stage record
+        """
+        with self._lock:
+            total = self.totals.setdefault(record['stage'], [0, 0.0, 0.0, 0, 0, 0])
+            total[0] += 1
+            total[1] += record['wall_time']
+            total[2] += record['cpu_time']
+            total[3] += record['rss_delta']
+            total[4] += record['peak_rss_delta']
+            total[5] = max(total[5], record['peak_rss'])
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text format.
+
+        Returns:
+            the metrics text
+        """
+        lines = ['# HELP stage_wall_seconds Wall time spent in each pipeline stage.',
+                 '# TYPE stage_wall_seconds summary']
+        with self._lock:
+            for name, (count, wall_time, cpu_time, *_) in sorted(self.totals.items()):
+                lines.append(f'stage_wall_seconds_sum{{stage="{name}"}} {wall_time:.6f}')
+                lines.append(f'stage_wall_seconds_count{{stage="{name}"}} {count}')
+            lines += ['# HELP stage_cpu_seconds Process cpu time spent in each pipeline stage.',
+                      '# TYPE stage_cpu_seconds summary']
+            for name, (count, wall_time, cpu_time, *_) in sorted(self.totals.items()):
+                lines.append(f'stage_cpu_seconds_sum{{stage="{name}"}} {cpu_time:.6f}')
+                lines.append(f'stage_cpu_seconds_count{{stage="{name}"}} {count}')
+            lines += ['# HELP stage_rss_delta_bytes Change of the resident set size over each pipeline stage.',
+                      '# TYPE stage_rss_delta_bytes summary']
+            for name, (count, wall_time, cpu_time, rss_delta, *_) in sorted(self.totals.items()):
+                lines.append(f'stage_rss_delta_bytes_sum{{stage="{name}"}} {rss_delta}')
+                lines.append(f'stage_rss_delta_bytes_count{{stage="{name}"}} {count}')
+            # a stage raising the peak of the process is the one to look at for the memory
+            lines += ['# HELP stage_peak_rss_delta_bytes Rise of the process peak resident set size over each '
+                      'pipeline stage.',
+                      '# TYPE stage_peak_rss_delta_bytes summary']
+            for name, (count, *_, peak_rss_delta, peak_rss) in sorted(self.totals.items()):
+                lines.append(f'stage_peak_rss_delta_bytes_sum{{stage="{name}"}} {peak_rss_delta}')
+                lines.append(f'stage_peak_rss_delta_bytes_count{{stage="{name}"}} {count}')
+            lines += ['# HELP stage_peak_rss_bytes Highest process peak resident set size at the end of each '
+                      'pipeline stage.',
+                      '# TYPE stage_peak_rss_bytes gauge']
+            for name, (count, *_, peak_rss_delta, peak_rss) in sorted(self.totals.items()):
+                lines.append(f'stage_peak_rss_bytes{{stage="{name}"}} {peak_rss}')
+        lines += ['# HELP process_peak_rss_bytes Peak resident set size over the lifetime of the process.',
+                  '# TYPE process_peak_rss_bytes gauge',
+                  f'process_peak_rss_bytes {get_peak_rss()}']
+
+        return '\n'.join(lines) + '\n'
+
+
+# the timer of the running request and the process wide metrics
+_current_timer = contextvars.ContextVar('stage_timer', default=None)
+metrics = StageMetrics()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    the context manager to measure one pipeline stage
+
+    Args:
+        name (str): the stage name, e.g. "decoding"
+    """
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    rss_start = get_current_rss()
+    peak_rss_start = get_peak_rss()
+    try:
+        yield
+    finally:
+        # the peak is process wide: a stage below the earlier peak adds 0
+        peak_rss = get_peak_rss()
+        record = {'stage': name,
+                  'wall_time': time.perf_counter() - wall_start,
+                  'cpu_time': time.process_time() - cpu_start,
+                  'rss_delta': get_current_rss() - rss_start,
+                  'peak_rss': peak_rss,
+                  'peak_rss_delta': peak_rss - peak_rss_start}
+        metrics.observe(record)
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.stages.append(record)
+
+
+@contextmanager
+def track_stages(profile_file: str = None):
+    """
+    the context manager to collect the stages of one request and
+    optionally dump its cProfile output
+
+    Args:
+        profile_file (str): the file to dump the cProfile stats, no profiling if None
+    """
+
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    profiler = None
+    if profile_file is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield timer
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+        _current_timer.reset(token)
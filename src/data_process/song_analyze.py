@@ -1,7 +1,15 @@
 import librosa
+import numpy as np
 import pretty_midi
 from music21 import converter, pitch, scale
-from pychord import Chord
+from data_process.model_artifact import load_chord_table
+
+# the frame rate and lowest midi note of the basic-pitch note activations
+activation_frame_rate = 22050 / 256
+activation_lowest_note = 21
+
+# the candidate bar lengths (in tracked beats) of the meter detection
+meter_candidates = {3: '3/4', 4: '4/4', 6: '6/8'}
 
 
 def midi_note_to_pitch(midi_note: int) -> str:
@@ -24,9 +32,10 @@ def midi_note_to_pitch(midi_note: int) -> str:
     return f'{pitch_name}'
 
 
-def get_beat_info(mp3Filanme: str) -> (float, list, float):
+def get_beat_info(mp3Filanme: str) -> (float, list, float, str):
     """
     the function to get beat info: including tempo, time_section, start_time
+    and time_signature
 
     Args:
         mp3Filanme (str): the mp3 file name
@@ -35,20 +44,80 @@ def get_beat_info(mp3Filanme: str) -> (float, list, float):
         tempo (float): the tempo of the mp3
         time_section (list): the time section of the mp3
         start_time (float): the start time of the mp3
+        time_signature (str): the time signature of the mp3, e.g. '3/4'
     """
 
     # Load the audio as a waveform `y`
     # Store the sampling rate as `sr`
     y, sr = librosa.load(mp3Filanme)
 
+    return get_beat_info_from_audio(y, sr)
+
+
+def estimate_meter(onset_envelope: np.array, beat_frames: np.array) -> int:
+    """
+    the function to estimate the bar length from the autocorrelation of the
+    onset envelope, the candidate bar length (in beats) with the strongest
+    periodicity wins, 4/4 on ties
+
+    Args:
+        onset_envelope (np.array): the onset strength envelope of the beat tracker
+        beat_frames (np.array): the frame index of each beat
+
+    Returns:
+        the number of beats of each measure, one of meter_candidates
+    """
+
+    if len(beat_frames) < 2:
+        return 4
+    beat_period = (beat_frames[-1] - beat_frames[0]) / (len(beat_frames) - 1)
+    lags = {bar_length: int(round(bar_length * beat_period)) for bar_length in meter_candidates}
+    if max(lags.values()) + 2 >= len(onset_envelope) // 2:
+        return 4
+
+    # unbiased autocorrelation of the envelope, summed over the lags around
+    # each bar length so the tempo jitter of the beat tracker does not matter
+    envelope = onset_envelope - onset_envelope.mean()
+    correlation = librosa.autocorrelate(envelope) / np.arange(len(envelope), 0, -1)
+    score = {bar_length: correlation[lag - 2:lag + 3].sum() for bar_length, lag in lags.items()}
+
+    # a bar of 3 beats also repeats every 6 beats, the longer bar has to be clearly stronger
+    for bar_length in meter_candidates:
+        for shorter in meter_candidates:
+            if shorter < bar_length and bar_length % shorter == 0 and score[bar_length] < 1.1 * score[shorter]:
+                score[bar_length] = -np.inf
+
+    return max(sorted(score, key=lambda bar_length: bar_length != 4), key=score.get)
+
+
+def get_beat_info_from_audio(y: np.array, sr: int) -> (float, list, float, str):
+    """
+    the function to get beat info from an audio buffer already in memory
+
+    Args:
+        y (np.array): the mono waveform
+        sr (int): the sampling rate
+
+    Returns:
+        tempo (float): the tempo of the audio
+        time_section (list): the time section of the audio
+        start_time (float): the start time of the audio
+        time_signature (str): the time signature of the audio, e.g. '3/4'
+    """
+
+    # the onset envelope is computed once for the beat tracker and the meter
+    onset_envelope = librosa.onset.onset_strength(y=y, sr=sr)
+
     # Run the default beat tracker
-    vocal_tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
+    vocal_tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr)
+    vocal_tempo = float(np.atleast_1d(vocal_tempo)[0])
 
     # Convert the frame indices of beat events into timestamps
     beat_times = librosa.frames_to_time(beat_frames, sr=sr)
 
-    # get A  element index multiple of 4 from 0 aka 4/4
-    down_beat = beat_times[0::4]
+    # get the first beat of every measure
+    beats_per_bar = estimate_meter(onset_envelope, beat_frames)
+    down_beat = beat_times[0::beats_per_bar]
 
     the_start_time = down_beat[0]
 
@@ -58,7 +127,150 @@ def get_beat_info(mp3Filanme: str) -> (float, list, float):
         time_section.append([down_beat[i], down_beat[i+1]])
     time_section.append([down_beat[-1], librosa.get_duration(y=y, sr=sr)])
 
-    return vocal_tempo, time_section, the_start_time
+    return vocal_tempo, time_section, the_start_time, meter_candidates[beats_per_bar]
+
+
+def detect_voice_activity(y: np.array, sr: int, frame_length: int = 2048, hop_length: int = 512,
+                          threshold_db: float = -40, flux_ratio: float = 0.1, min_silence: float = 0.5,
+                          padding: float = 0.2) -> list:
+    """
+    the function to find the sung parts of the take in one vectorized pass,
+    a frame is active when its energy is close to the loudest frame or its
+    spectral flux shows an onset, short gaps are bridged
+
+    Args:
+        y (np.array): the mono waveform
+        sr (int): the sampling rate
+        frame_length (int): the samples of each analysis frame
+        hop_length (int): the samples between two frames
+        threshold_db (float): the energy gate below the loudest frame
+        flux_ratio (float): the spectral flux gate relative to the strong onsets
+        min_silence (float): the shortest silence in seconds kept as a gap
+        padding (float): the seconds added around each active region
+
+    Returns:
+        the list of active [start, end] in seconds
+    """
+
+    if len(y) < frame_length:
+        return [[0.0, len(y) / sr]] if np.abs(y).max(initial=0) > 0 else []
+
+    frames = np.lib.stride_tricks.sliding_window_view(y, frame_length)[::hop_length]
+
+    # energy gate
+    rms_db = 10 * np.log10((frames.astype(np.float64) ** 2).mean(axis=1) + 1e-12)
+    active = rms_db > rms_db.max() + threshold_db
+
+    # spectral flux gate, the rise of the log magnitude spectrum
+    spectrum = np.log1p(np.abs(np.fft.rfft(frames * np.hanning(frame_length), axis=1)))
+    flux = np.maximum(np.diff(spectrum, axis=0, prepend=spectrum[:1]), 0).sum(axis=1)
+    active |= flux > flux_ratio * np.percentile(flux, 99) + 1e-12
+
+    # bridge the short gaps and pad the regions
+    frame_time = hop_length / sr
+    reach = int(np.ceil(max(min_silence / 2, padding) / frame_time))
+    active = np.convolve(active, np.ones(2 * reach + 1), mode='same') > 0
+    if not active.any():
+        return []
+
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], active.astype(int), [0]])))
+    duration = len(y) / sr
+
+    return [[float(start * frame_time), float(min(end * frame_time + frame_length / sr, duration))]
+            for start, end in zip(edges[0::2], edges[1::2])]
+
+
+def estimate_key_from_audio(y: np.array, sr: int) -> str:
+    """
+    the function to estimate the key of the song straight from the audio,
+    correlating the mean chroma with the Krumhansl-Kessler key profiles,
+    so the key is known before the transcription
+
+    Args:
+        y (np.array): the mono waveform
+        sr (int): the sampling rate
+
+    Returns:
+        the key of the song, e.g. 'Bb:maj'
+    """
+
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr).mean(axis=1)
+
+    return estimate_key_from_chroma(chroma)
+
+
+def estimate_key_from_chroma(chroma: np.array) -> str:
+    """
+    the function to estimate the key of the song from its 12 bin chroma,
+    correlating it with the Krumhansl-Kessler key profiles
+
+    Args:
+        chroma (np.array): the 12 bin chroma of the song, C first
+
+    Returns:
+        the key of the song, e.g. 'Bb:maj'
+    """
+
+    tonic_names = ['C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
+    major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+    minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+    # 24 x 12 profiles, row i is the profile with tonic i (major then minor)
+    profiles = np.array([np.roll(profile, tonic)
+                         for profile in (major_profile, minor_profile) for tonic in range(12)])
+
+    # pearson correlation of the chroma with every profile
+    profiles = profiles - profiles.mean(axis=1, keepdims=True)
+    chroma = chroma - chroma.mean()
+    correlation = profiles @ chroma / (np.linalg.norm(profiles, axis=1) * np.linalg.norm(chroma) + 1e-10)
+
+    best = int(correlation.argmax())
+    quality = 'maj' if best < 12 else 'min'
+
+    return tonic_names[best % 12] + ':' + quality
+
+
+def get_tempo_map(time_section: list, beats_per_bar: int) -> list:
+    """
+    the function to get the tempo of every measure from the detected
+    downbeats, so the accompaniment follows a singer who speeds up
+
+    Args:
+        time_section (list): the time section of the measures
+        beats_per_bar (int): the number of beats of each measure
+
+    Returns:
+        the tempo (beats per minute) of each measure
+    """
+
+    section = np.array(time_section, dtype=float)
+    tempo_map = 60 * beats_per_bar / (section[:, 1] - section[:, 0])
+
+    # the last measure runs to the end of the audio, not to a downbeat
+    if len(tempo_map) > 1:
+        tempo_map[-1] = tempo_map[-2]
+
+    return tempo_map.tolist()
+
+
+def split_time_section(time_section: list, segments_per_measure: int) -> list:
+    """
+    the function to split every measure into equal segments, e.g. 4 for
+    beats or 2 for half bars in 4/4
+
+    Args:
+        time_section (list): the time section of the measures
+        segments_per_measure (int): the number of segments of each measure
+
+    Returns:
+        the time section of the segments
+    """
+
+    section = np.array(time_section, dtype=float)
+    fraction = np.arange(segments_per_measure + 1) / segments_per_measure
+    bounds = section[:, :1] + (section[:, 1:] - section[:, :1]) * fraction
+
+    return np.stack([bounds[:, :-1], bounds[:, 1:]], axis=-1).reshape(-1, 2).tolist()
 
 
 def split_midi_to_measure(midi_file: str, time_section: list) -> list:
@@ -87,6 +299,43 @@ def split_midi_to_measure(midi_file: str, time_section: list) -> list:
     return measure_list
 
 
+def split_activation_to_measure(note_activation: np.array, time_section: list, frame_threshold: float = 0.3,
+                                frame_rate: float = activation_frame_rate,
+                                lowest_note: int = activation_lowest_note) -> np.array:
+    """
+    the function to fold the frame note activations of the transcription
+    model into a 12 bin chroma per measure, weighted by how long and how
+    strongly each pitch class sounds
+
+    Args:
+        note_activation (np.array): frames x semitones activations, model_output["note"]
+        time_section (list): the time section of the measures
+        frame_threshold (float): the activations below are treated as silence
+        frame_rate (float): the frames per second of the activations
+        lowest_note (int): the midi note of the first activation bin
+
+    Returns:
+        the measures x 12 chroma, C first
+    """
+
+    activation = np.where(note_activation >= frame_threshold, note_activation, 0)
+
+    # shift the bins so bin 0 is a C, then fold the octaves with one reshape
+    n_frames, n_notes = activation.shape
+    shift = lowest_note % 12
+    n_octaves = -(-(shift + n_notes) // 12)
+    padded = np.zeros((n_frames, n_octaves * 12), dtype=activation.dtype)
+    padded[:, shift:shift + n_notes] = activation
+    chroma = padded.reshape(n_frames, n_octaves, 12).sum(axis=1)
+
+    # sum the frames of each measure
+    section = np.array(time_section, dtype=float)
+    bounds = np.clip(np.round(section * frame_rate).astype(int), 0, n_frames)
+    cumulative = np.vstack([np.zeros(12), np.cumsum(chroma, axis=0)])
+
+    return cumulative[bounds[:, 1]] - cumulative[bounds[:, 0]]
+
+
 def predict_key_of_song(midi_file: str) -> str:
     """
     the function to predict the key of the song
@@ -179,34 +428,6 @@ def get_scale_tones_enharmonic_equivalent(midi_file: str) -> list:
     return adjust_key_tonic_name
 
 
-def convert_to_note_name(chord_str) -> str:
-    """
-    the function to convert the chord name to adjust chord name
-
-    Args:
-        chord_str (str): the chord name
-
-    Returns:
-        the adjust chord name    
-    """
-    chord_parts = chord_str.split(':')
-    chord_name = chord_parts[0]
-    chord_type = chord_parts[1]
-
-    if 'min' in chord_type:
-        # replace min with m
-        chord_type = chord_type.replace('min', 'm')
-
-    # if last character is 6
-    if chord_type[-1] == '6':
-        chord_type = chord_type.replace('6', '')
-    # if last character is not num
-    if chord_type[-1].isdigit() == False:
-        if "maj" in chord_type:
-            chord_type = chord_type.replace('maj', '')
-    return chord_name + chord_type
-
-
 def get_each_chord_componetns(chord_sequence: list) -> list:
     """
     The function to get the chord components of each chord
@@ -227,11 +448,7 @@ def get_each_chord_componetns(chord_sequence: list) -> list:
                 ['F#', 'A', 'C#']]
     """
 
-    chord_each_component = []
-    for i in chord_sequence:
-
-        c = Chord(convert_to_note_name(i))
-
-        chord_each_component.append(c.components())
+    # look up the shared chord table instead of parsing every occurrence
+    chord_each_component = load_chord_table().get_components(chord_sequence)
 
     return chord_each_component
@@ -0,0 +1,166 @@
+import json
+import os
+import struct
+import numpy as np
+from pydub import AudioSegment
+
+# the gains (dB) of the default mix, as Mixer
+default_gains = {"vocal": -5.0, "piano": -5.0, "drum": 5.0}
+
+
+def audio_segment_to_float(segment: AudioSegment) -> np.array:
+    """
+    the function to get the samples of an AudioSegment as float32 in [-1, 1)
+
+    Args:
+        segment (AudioSegment): the audio
+
+    Returns:
+        the frames x channels samples
+    """
+
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    samples /= 2 ** (8 * segment.sample_width - 1)
+
+    return samples.reshape(-1, segment.channels)
+
+
+class StemStore:
+    """
+    The class to keep the aligned stems (vocal, piano, drum) of a job as raw
+    float32 files, so a new mix is one pass over the memory mapped stems
+    instead of rendering the song again.
+
+    Every stem is stereo at the same sampling rate and cut to the same
+    length, the layout is kept in stems.json.
+
+    Attributes:
+        stem_dir (str): the folder of the stems
+        layout (dict): the frame_rate, channels and n_frames of the stems
+
+    Examples usage:
+        stem_store = StemStore('job/stems')
+        stem_store.write({'vocal': voice, 'piano': piano, 'drum': drum})
+        stem_store.mix('combined.wav', {'drum': 0.0}, mutes=['piano'])
+    """
+
+    def __init__(self, stem_dir):
+        """
+        Args:
+            stem_dir (str): The folder of the stems.
+        """
+        self.stem_dir = stem_dir
+        self.layout = None
+        layout_file = os.path.join(stem_dir, "stems.json")
+        if os.path.exists(layout_file):
+            with open(layout_file) as f:
+                self.layout = json.load(f)
+
+    def get_stem_file(self, name) -> str:
+        """
+        Get the raw file of the stem.
+        """
+        return os.path.join(self.stem_dir, f"{name}.f32")
+
+    def write(self, stems) -> None:
+        """
+        Write the stems, converted to the highest sampling rate of them.
+
+        Args:
+            stems (dict): stem name to its AudioSegment, already aligned
+        """
+        os.makedirs(self.stem_dir, exist_ok=True)
+        frame_rate = max(segment.frame_rate for segment in stems.values())
+
+        samples = {name: audio_segment_to_float(segment.set_frame_rate(frame_rate).set_channels(2))
+                   for name, segment in stems.items()}
+        n_frames = min(len(i) for i in samples.values())
+        for name, stem in samples.items():
+            stem[:n_frames].tofile(self.get_stem_file(name))
+
+        self.layout = {"frame_rate": frame_rate, "channels": 2, "n_frames": n_frames, "stems": list(stems)}
+        with open(os.path.join(self.stem_dir, "stems.json"), "w") as f:
+            json.dump(self.layout, f)
+
+        return None
+
+    def open(self, name) -> np.memmap:
+        """
+        Get the memory mapped samples of the stem.
+
+        Args:
+            name (str): The stem name.
+
+        Returns:
+            the frames x channels float32 samples
+        """
+        if self.layout is None:
+            raise FileNotFoundError(f"no stems in {self.stem_dir}")
+
+        return np.memmap(self.get_stem_file(name), dtype=np.float32, mode="r",
+                         shape=(self.layout["n_frames"], self.layout["channels"]))
+
+    def mix(self, output_file, gains=None, mutes=(), block_frames=2 ** 16) -> str:
+        """
+        Mix the stems block by block into a 16 bit wav file.
+
+        Args:
+            output_file (str): The file name of the mix.
+            gains (dict): stem name to its gain in dB, default_gains for the others.
+            mutes (list): the stem names left out of the mix.
+            block_frames (int): the number of frames mixed at a time.
+
+        Returns:
+            the file name of the mix
+        """
+        for _ in self.stream_mix(output_file, gains, mutes, block_frames):
+            pass
+
+        return output_file
+
+    def stream_mix(self, output_file, gains=None, mutes=(), block_frames=2 ** 16):
+        """
+        Mix the stems block by block, each block of the 16 bit wav file is
+        yielded as soon as it is written, the wav header first. The file is
+        written to a .part file and only replaces output_file once complete.
+
+        Args:
+            output_file (str): The file name of the mix.
+            gains (dict): stem name to its gain in dB, default_gains for the others.
+            mutes (list): the stem names left out of the mix.
+            block_frames (int): the number of frames mixed at a time.
+
+        Yields:
+            the bytes of the wav file
+        """
+        gains = {**default_gains, **(gains or {})}
+        stems = [(self.open(name), np.float32(10 ** (gains.get(name, 0.0) / 20)))
+                 for name in self.layout["stems"] if name not in mutes]
+        n_frames, channels = self.layout["n_frames"], self.layout["channels"]
+
+        # the length is known, so the header is written first
+        data_size = n_frames * channels * 2
+        header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, channels,
+                             self.layout["frame_rate"], self.layout["frame_rate"] * channels * 2, channels * 2, 16,
+                             b"data", data_size)
+
+        # a client leaving mid stream must not leave a truncated mix behind
+        partial_file = output_file + ".part"
+        try:
+            with open(partial_file, "wb") as f:
+                f.write(header)
+                yield header
+                for begin in range(0, n_frames, block_frames):
+                    end = min(begin + block_frames, n_frames)
+                    block = np.zeros((end - begin, channels), dtype=np.float32)
+                    for stem, gain in stems:
+                        block += stem[begin:end] * gain
+                    block = (np.clip(block, -1, 1 - 2 ** -15) * 2 ** 15).astype("<i2").tobytes()
+                    f.write(block)
+                    yield block
+        except BaseException:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            raise
+
+        os.replace(partial_file, output_file)
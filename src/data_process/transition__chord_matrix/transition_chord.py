@@ -2,6 +2,9 @@ import pandas as pd
 import numpy as np
 import os
 from pathlib import Path
+from scipy import sparse
+from data_process.corpus_store import chord_corpus_dir, full_chord_corpus_dir, has_corpus, read_corpus, write_corpus
+from data_process.model_artifact import to_relative_transition, to_second_order_transition, update_model_artifact
 # relative path
 relative_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -18,12 +21,9 @@ def get_chord_file(relative_path) -> list:
 
     # get the file in the upper folder POP909
     parent_path = Path(relative_path).parent
-    file_list = os.listdir(os.path.join(parent_path, 'POP909'))
 
-    # remove file that fileName is not number
-    for file in file_list:
-        if not file.isdigit():
-            file_list.remove(file)
+    # only the song folders, sorted so the song_num of the corpus is stable
+    file_list = sorted(file for file in os.listdir(os.path.join(parent_path, 'POP909')) if file.isdigit())
 
     for file in file_list:
 
@@ -33,10 +33,11 @@ def get_chord_file(relative_path) -> list:
     return chord_file_list
 
 
-def data_preprocess(chord_df) -> pd.DataFrame:
+def data_preprocess(chord_df, simplify=True) -> pd.DataFrame:
     """
     data preprocess to remove empty chord and add start_chord and end_chord
     :param chord_df: the chord DataFrame
+    :param simplify: strip the bass and the extensions of the chord
     :return: chord_df
     """
 
@@ -51,15 +52,19 @@ def data_preprocess(chord_df) -> pd.DataFrame:
     chord_df = pd.concat([chord_df, pd.DataFrame(end_chord).T], ignore_index=True)
 
     # simplfy the chord by change remove chord after '/' and remove chord after '(')
-    chord_df['chord'] = chord_df['chord'].apply(lambda x: x.split('/')[0])
-    chord_df['chord'] = chord_df['chord'].apply(lambda x: x.split('(')[0])
+    if simplify:
+        chord_df['chord'] = chord_df['chord'].apply(lambda x: x.split('/')[0])
+        chord_df['chord'] = chord_df['chord'].apply(lambda x: x.split('(')[0])
     return chord_df
 
 
-def merge_all_df(file_list) -> pd.DataFrame:
+def merge_all_df(file_list, simplify=True, min_count=31, corpus_dir=chord_corpus_dir) -> pd.DataFrame:
     """
     merge all chord_df
     :param file_list: the chord file list
+    :param simplify: strip the bass and the extensions of the chord
+    :param min_count: drop the chords appeared less than min_count times
+    :param corpus_dir: the directory to write the corpus
     :return: all_df
     """
 
@@ -69,25 +74,49 @@ def merge_all_df(file_list) -> pd.DataFrame:
 
         chord_df = pd.read_csv(file, sep='\t', header=None, names=['start_time', 'end_time', 'chord'])
 
-        chord_df = data_preprocess(chord_df)
+        chord_df = data_preprocess(chord_df, simplify)
         chord_df['song_num'] = index
 
         all_df = pd.concat([all_df, chord_df])
 
-    # filter chords apeared less than 10 times
+    all_df = filter_rare_chord(all_df, min_count)
+
+    # columnar corpus instead of the all_chord.csv text dump
+    write_corpus(all_df, corpus_dir)
+    return all_df
+
+
+def filter_rare_chord(all_df, min_count=31) -> pd.DataFrame:
+    """
+    drop the chords appeared less than min_count times
+    :param all_df: the all_df
+    :param min_count: the least count of a kept chord
+    :return: all_df
+    """
+
+    # filter chords apeared less than min_count times
     chord_count = all_df['chord'].value_counts()
-    chord_count = chord_count[chord_count <= 30]
+    chord_count = chord_count[chord_count < min_count]
 
     # get chord name
     chord_name = chord_count.index.to_list()
 
     # filter chord
     all_df = all_df[~all_df['chord'].isin(chord_name)]
-    all_df = all_df.reset_index(drop=True)
+    return all_df.reset_index(drop=True)
 
-    file_path = os.path.join(relative_path, 'csv_file\\all_chord.csv')
-    all_df.to_csv(file_path, index=True, header=True)
-    return all_df
+
+def load_all_df(corpus_dir=chord_corpus_dir, min_count=31) -> pd.DataFrame:
+    """
+    read the merged chord corpus written by merge_all_df
+    :param corpus_dir: the corpus directory
+    :param min_count: drop the chords appeared less than min_count times
+    :return: all_df
+    """
+
+    all_df = read_corpus(corpus_dir)
+    all_df['chord'] = all_df['chord'].astype(str)
+    return filter_rare_chord(all_df, min_count)
 
 
 def get_transition_chord_normalize_each_time(all_df) -> pd.DataFrame:
@@ -144,8 +173,16 @@ def get_transition_chord(all_df) -> pd.DataFrame:
     transitions = transitions.drop(['start_chord', 'end_chord'], axis=0)
     transitions = transitions.drop(['start_chord', 'end_chord'], axis=1)
 
+    # the counts of the 12 roots pooled into the root relative model
+    qualities, relative_transition = to_relative_transition(transitions.index.to_list(), transitions.to_numpy())
+    update_model_artifact(relative_qualities=np.array(qualities), relative_transition=relative_transition)
+
     transitions = transitions.apply(lambda x: x/x.sum(), axis=1)
 
+    # the model artifact keeps the numbers, the csv keeps the percentage for reading
+    update_model_artifact(transition_chord_list=transitions.index.to_numpy(dtype=str),
+                          transition_matrix=transitions.to_numpy(dtype=float))
+
     transitions = transitions.applymap(lambda x: '{:.2%}'.format(x))
 
     file_path = os.path.join(relative_path, 'csv_file\\transition_chord.csv')
@@ -154,17 +191,86 @@ def get_transition_chord(all_df) -> pd.DataFrame:
     return transitions
 
 
-def pipeline() -> pd.DataFrame:
+def get_second_order_transition_chord(all_df) -> sparse.csr_matrix:
     """
-    pipeline process
+    get the second order transition (chord pair -> chord) as sparse matrix,
+    row i * len(chord_list) + j holds P(k | i, j), and save it in the model artifact
+    :param all_df: the all_df
+    :return: second order transitions
+    """
+
+    chord_list, transitions = to_second_order_transition(all_df)
+
+    update_model_artifact(second_order_chord_list=chord_list,
+                          second_order_data=transitions.data,
+                          second_order_indices=transitions.indices,
+                          second_order_indptr=transitions.indptr)
+    return transitions
+
+
+def get_vocabulary_transition_chord(all_df) -> sparse.csr_matrix:
+    """
+    get the first order transition of a large chord vocabulary as sparse
+    matrix and the chord frequency used as backoff, and save them in the
+    model artifact
+    :param all_df: the all_df
+    :return: transitions
+    """
+
+    chord_list = np.sort(all_df['chord'].unique())
+    chord_list = chord_list[~np.isin(chord_list, ['start_chord', 'end_chord'])]
+    n_chords = len(chord_list)
+
+    code = pd.Index(chord_list).get_indexer(all_df['chord']).astype(np.int64)
+    song_num = all_df['song_num'].to_numpy()
+
+    valid = (song_num[:-1] == song_num[1:]) & (code[:-1] >= 0) & (code[1:] >= 0)
+    counts = sparse.coo_matrix((np.ones(valid.sum()), (code[:-1][valid], code[1:][valid])),
+                               shape=(n_chords, n_chords)).tocsr()
+
+    # normalize each row to 1
+    row_sum = np.asarray(counts.sum(axis=1)).ravel()
+    transitions = (sparse.diags(np.divide(1, row_sum, out=np.zeros_like(row_sum), where=row_sum > 0)) @ counts).tocsr()
+
+    unigram = np.bincount(code[code >= 0], minlength=n_chords).astype(float)
+    unigram /= unigram.sum()
+
+    update_model_artifact(vocabulary_chord_list=chord_list.astype(str),
+                          vocabulary_transition_data=transitions.data,
+                          vocabulary_transition_indices=transitions.indices,
+                          vocabulary_transition_indptr=transitions.indptr,
+                          vocabulary_unigram=unigram)
+    return transitions
+
+
+def pipeline(large_vocabulary=False, refresh=False) -> pd.DataFrame:
+    """
+    pipeline process, the chords are read from the corpus and only parsed
+    from POP909 when the corpus is missing or refreshed
+    :param large_vocabulary: build the sparse model of the full chord
+        vocabulary (extensions, inversions, slash chords) instead
+    :param refresh: parse POP909 again and rewrite the corpus
     :return: chord_transition_matrix
     """
 
-    chord_file_list = get_chord_file(relative_path)
-    all_df = merge_all_df(chord_file_list)
+    corpus_dir = full_chord_corpus_dir if large_vocabulary else chord_corpus_dir
+    if refresh or not has_corpus(corpus_dir):
+        chord_file_list = get_chord_file(relative_path)
+        if large_vocabulary:
+            all_df = merge_all_df(chord_file_list, simplify=False, min_count=1, corpus_dir=corpus_dir)
+        else:
+            all_df = merge_all_df(chord_file_list)
+    else:
+        all_df = load_all_df(corpus_dir, min_count=1 if large_vocabulary else 31)
+
+    if large_vocabulary:
+        return get_vocabulary_transition_chord(all_df)
+
     get_transition_chord_normalize_each_time(all_df)
+    get_second_order_transition_chord(all_df)
     return get_transition_chord(all_df)
 
 
 if __name__ == "__main__":
-    chord_transition_matrix = pipeline()
+    import sys
+    chord_transition_matrix = pipeline('--large-vocabulary' in sys.argv, '--refresh' in sys.argv)
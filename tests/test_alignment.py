@@ -0,0 +1,54 @@
+from data_process.alignment import AlignmentCache, estimate_offset
+from scipy.io import wavfile
+import numpy as np
+
+# test the vocal offset estimation against the beat grid
+
+
+def _clicks(sr, seconds=10, delay=0.0, bpm=100, seed=0):
+    """
+    Synthesizes a click on every beat with random loudness, started late by delay seconds.
+    """
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(seconds * sr), dtype=np.float32)
+    t = np.arange(int(0.03 * sr)) / sr
+    click = np.sin(2 * np.pi * 300 * t) * np.exp(-60 * t)
+    for beat_time in np.arange(0.2, seconds - 0.5, 60 / bpm) + delay:
+        begin = int(round(beat_time * sr))
+        audio[begin:begin + len(click)] += click * rng.uniform(0.2, 1.0)
+    return audio
+
+
+def test_estimate_offset():
+    """
+    Tests the offset is found across different sampling rates.
+    """
+    reference = _clicks(44100)
+    vocal = _clicks(22050, delay=0.1234)
+
+    offset = estimate_offset(reference, 44100, vocal, 22050)
+
+    assert abs(offset - 0.1234 * 22050) < 0.005 * 22050
+
+
+def test_alignment_cache(tmp_path):
+    """
+    Tests the offset is kept in the cache file and reused.
+    """
+    wavfile.write(tmp_path / "drum.wav", 22050, (_clicks(22050) * 32767).astype(np.int16))
+    wavfile.write(tmp_path / "vocal.wav", 22050, (_clicks(22050, delay=0.55) * 32767).astype(np.int16))
+    cache_file = str(tmp_path / "alignment.json")
+
+    offset = AlignmentCache(cache_file).get_offset(str(tmp_path / "drum.wav"), str(tmp_path / "vocal.wav"), 0.5)
+
+    assert abs(offset - 0.05 * 22050) < 0.005 * 22050
+    assert AlignmentCache(cache_file).offsets
+
+    # the same grid rendered again hits, another start time is a new entry
+    keys = list(AlignmentCache(cache_file).offsets)
+    wavfile.write(tmp_path / "drum.wav", 22050, (_clicks(22050) * 32767).astype(np.int16))
+    alignment_cache = AlignmentCache(cache_file, max_entries=1)
+    assert alignment_cache.get_offset(str(tmp_path / "drum.wav"), str(tmp_path / "vocal.wav"), 0.5) == offset
+    assert list(alignment_cache.offsets) == keys
+    alignment_cache.get_offset(str(tmp_path / "drum.wav"), str(tmp_path / "vocal.wav"), 0.4)
+    assert len(AlignmentCache(cache_file).offsets) == 1
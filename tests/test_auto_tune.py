@@ -0,0 +1,92 @@
+from auto_accompany.shared_buffer import get_array, release, share_array
+import importlib.util
+import io
+import sys
+import types
+import wave
+import numpy as np
+import pytest
+
+# test the block streaming of the auto tuner, the tuner itself is replaced
+
+
+@pytest.fixture
+def tuner_calls(monkeypatch):
+    """
+    Replaces the AutoTune extension by a stub whose Tuner is an identity
+    function recording the chunk lengths.
+    """
+    calls = []
+
+    def identity(signal_chunk, fs, n_samples, *args):
+        assert signal_chunk.dtype == np.float32 and len(signal_chunk) == n_samples
+        calls.append(n_samples)
+        return signal_chunk.copy()
+
+    monkeypatch.setitem(sys.modules, "AutoTune", types.SimpleNamespace(Tuner=identity))
+    return calls
+
+
+@pytest.fixture
+def autoTune(tuner_calls):
+    """
+    A private copy of auto_accompany.autoTune importing the stubbed AutoTune,
+    the module in sys.modules is left alone.
+    """
+    spec = importlib.util.find_spec("auto_accompany.autoTune")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_tune_buffer(autoTune, tuner_calls):
+    """
+    Tests the buffer is tuned chunk by chunk into the given output.
+    """
+    signal = np.random.default_rng(0).uniform(-1, 1, 10000).astype(np.float32)
+    out = np.zeros_like(signal)
+
+    tuned = autoTune.tune_buffer(signal, 22050, chunk=4096, out=out)
+
+    assert tuned is out
+    assert np.array_equal(out, signal)
+    assert tuner_calls == [4096, 4096, 1808]
+
+
+def test_tune_shared(autoTune):
+    """
+    Tests the tuned samples are written to the shared output buffer.
+    """
+    signal = np.random.default_rng(1).uniform(-1, 1, 5000).astype(np.float32)
+    signal_buffer = share_array(signal)
+    tuned_buffer = share_array(shape=signal.shape, dtype=np.float32)
+
+    autoTune.tune_shared(signal_buffer, tuned_buffer, 22050)
+
+    assert np.array_equal(get_array(tuned_buffer), signal)
+    release(signal_buffer)
+    release(tuned_buffer)
+
+
+def test_tune_blocks_stereo(autoTune, tuner_calls):
+    """
+    Tests a stereo wav is read in blocks, each channel tuned on its own and
+    interleaved back in order.
+    """
+    rng = np.random.default_rng(2)
+    frames = rng.integers(-2 ** 15, 2 ** 15, size=(5000, 2), dtype=np.int16)
+    wav = io.BytesIO()
+    with wave.open(wav, "wb") as writer:
+        writer.setnchannels(2)
+        writer.setsampwidth(2)
+        writer.setframerate(22050)
+        writer.writeframes(frames.tobytes())
+    wav.seek(0)
+
+    with wave.open(wav, "rb") as reader:
+        blocks = list(autoTune.tune_blocks(reader, chunk=2048))
+
+    assert [block.shape for block in blocks] == [(2048, 2), (2048, 2), (904, 2)]
+    assert np.array_equal(np.concatenate(blocks), frames)
+    # the left and the right channel of every block
+    assert tuner_calls == [2048, 2048, 2048, 2048, 904, 904]
@@ -0,0 +1,49 @@
+from data_process.generatemusic import ChordGenerator
+from types import SimpleNamespace
+import numpy as np
+
+# test the chord generator on the measures of both transcription paths
+
+
+def _model(n_measures, n_states=3, seed=0):
+    """
+    Builds a random first order model with one observation per measure.
+    """
+    rng = np.random.default_rng(seed)
+    start_probability = rng.random(n_states)
+    transition_matrix = rng.random((n_states, n_states))
+    emission_probability = rng.random((n_states, n_measures))
+    return SimpleNamespace(startprob_=start_probability / start_probability.sum(),
+                           transmat_=transition_matrix / transition_matrix.sum(axis=1, keepdims=True),
+                           emissionprob_=emission_probability / emission_probability.sum(axis=1, keepdims=True))
+
+
+def test_note_name_measures():
+    """
+    Tests the note names of the midi path, a silent measure holds the chord before it.
+    """
+    measure_list_vector = [['C4', 'E4'], [], ['G4'], ['A4', 'C5']]
+    chord_generator = ChordGenerator(_model(4), measure_list_vector, ['C:maj', 'F:maj', 'G:maj'])
+
+    assert list(chord_generator.get_active_measures()) == [0, 2, 3]
+
+    (_, progression), = chord_generator.generate_n_best(1)
+    assert len(progression) == 4 and progression[1] == progression[0]
+
+    _, progression = chord_generator.reharmonize({1: 'G:maj'})
+    assert progression[1] == 'G:maj'
+
+
+def test_chroma_measures():
+    """
+    Tests the chroma rows of the activation path, an all zero row is silent.
+    """
+    measure_list_vector = np.zeros((4, 12))
+    measure_list_vector[[0, 3], 0] = 1.0
+    chord_generator = ChordGenerator(_model(4), measure_list_vector, ['C:maj', 'F:maj', 'G:maj'])
+
+    assert list(chord_generator.get_active_measures()) == [0, 3]
+
+    # a silent take decodes every measure
+    chord_generator = ChordGenerator(_model(4), np.zeros((4, 12)), ['C:maj', 'F:maj', 'G:maj'])
+    assert list(chord_generator.get_active_measures()) == [0, 1, 2, 3]
@@ -0,0 +1,42 @@
+from data_process.chord_table import ChordTable
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# test the chord table lookups
+
+
+def test_chord_table():
+    """
+    Tests the chord components, masks and scale check of the chord table.
+    """
+    table = ChordTable(['C:maj', 'A:min7', 'G:7'])
+
+    assert table.get_components(['A:min7', 'C:maj']) == [['A', 'C', 'E', 'G'], ['C', 'E', 'G']]
+    assert table.roots.tolist() == [0, 9, 7]
+    assert table.qualities == ['maj', 'min7', '7']
+
+    # unknown chord is parsed once and appended
+    assert table.lookup(['Bb:maj', 'C:maj']).tolist() == [3, 0]
+    assert np.flatnonzero(table.masks[3]).tolist() == [2, 5, 10]
+
+    c_major = np.zeros(12, dtype=bool)
+    c_major[[0, 2, 4, 5, 7, 9, 11]] = True
+    assert table.in_scale(c_major).tolist() == [True, True, True, False]
+
+
+def test_chord_table_no_chord_and_threads():
+    """
+    Tests the no-chord symbol has no components, and chords added by many
+    threads at once each get one complete row.
+    """
+    table = ChordTable(['C:maj', 'N'])
+    assert table.get_components(['N']) == [[]]
+    assert table.roots.tolist() == [0, -1]
+
+    chords = [root + ':' + quality for root in ['C', 'D', 'E', 'F', 'G', 'A', 'B'] for quality in ['maj', 'min', '7']]
+    with ThreadPoolExecutor(8) as pool:
+        rows = list(pool.map(lambda i: table.lookup(chords[i % 5:] + chords[:i % 5]), range(64)))
+
+    assert len(table.chord_list) == len(chords) + 1 == len(table.masks) == len(table.components)
+    assert all(len(set(row.tolist())) == len(chords) for row in rows)
+    assert [table.chord_list[i] for i in table.lookup(chords)] == chords
@@ -0,0 +1,44 @@
+from data_process.corpus_store import dir_path, read_categories, read_corpus, read_corpus_columns, write_corpus
+from data_process.transition__chord_matrix.transition_chord import load_all_df
+import os
+import pandas as pd
+
+# test the columnar corpus round trip
+
+
+def test_write_and_read_corpus(tmp_path):
+    """
+    Tests the corpus is read back with categorical chord codes.
+    """
+    all_df = pd.DataFrame({'start_time': [0, 0.5, 2.0],
+                           'end_time': [0.5, 2.0, 3.0],
+                           'chord': ['start_chord', 'C:maj', 'A:min'],
+                           'song_num': [0, 0, 0]}, dtype=object)
+
+    write_corpus(all_df, str(tmp_path))
+
+    assert read_categories(str(tmp_path), 'chord') == ['A:min', 'C:maj', 'start_chord']
+
+    # only the needed columns are loaded
+    columns = read_corpus_columns(str(tmp_path), ['chord'])
+    assert list(columns) == ['chord']
+    assert columns['chord'].itemsize == 1
+
+    corpus = read_corpus(str(tmp_path))
+    assert corpus['chord'].tolist() == ['start_chord', 'C:maj', 'A:min']
+    assert corpus['end_time'].tolist() == [0.5, 2.0, 3.0]
+
+
+def test_shipped_chord_corpus():
+    """
+    Tests the shipped chord corpus covers every song of POP909 and the
+    chords of the transition table.
+    """
+    all_df = load_all_df()
+
+    assert all_df['song_num'].nunique() == 909
+    assert (all_df['chord'] == 'start_chord').sum() == 909
+
+    transition_df = pd.read_csv(os.path.join(dir_path, 'transition__chord_matrix', 'csv_file', 'transition_chord.csv'),
+                                index_col=0)
+    assert set(transition_df.index) == set(all_df['chord']) - {'start_chord', 'end_chord'}
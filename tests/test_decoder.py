@@ -0,0 +1,161 @@
+from data_process.decoder import (beam_viterbi, constrained_viterbi, k_best_viterbi, second_order_viterbi,
+                                  semi_markov_viterbi, viterbi_messages)
+from scipy import sparse
+import itertools
+import numpy as np
+
+# test the decoders against brute force search
+
+
+def _random_model(n_states, n_measures, seed=0):
+    """
+    Builds a random first order model and log emission.
+    """
+    rng = np.random.default_rng(seed)
+    log_emission = np.log(rng.random((n_measures, n_states)))
+    start_probability = rng.random(n_states)
+    start_probability /= start_probability.sum()
+    transition_matrix = rng.random((n_states, n_states))
+    transition_matrix /= transition_matrix.sum(axis=1, keepdims=True)
+    return rng, log_emission, start_probability, transition_matrix
+
+
+def test_second_order_viterbi():
+    """
+    Tests the sparse second order decoder finds the best sequence.
+    """
+    n_states, n_measures, interpolation = 3, 5, 0.7
+    rng, log_emission, start_probability, transition_matrix = _random_model(n_states, n_measures)
+
+    second_order = rng.random((n_states * n_states, n_states)) * (rng.random((n_states * n_states, n_states)) < 0.5)
+    row_sum = second_order.sum(axis=1, keepdims=True)
+    second_order = np.divide(second_order, row_sum, out=np.zeros_like(second_order), where=row_sum > 0)
+
+    def score(path):
+        total = np.log(start_probability[path[0]]) + log_emission[0, path[0]]
+        total += np.log(transition_matrix[path[0], path[1]]) + log_emission[1, path[1]]
+        for t in range(2, n_measures):
+            i, j, k = path[t - 2], path[t - 1], path[t]
+            p = transition_matrix[j, k]
+            if second_order[i * n_states + j].sum() > 0:
+                p = interpolation * second_order[i * n_states + j, k] + (1 - interpolation) * p
+            total += np.log(p) + log_emission[t, k]
+        return total
+
+    best = max(itertools.product(range(n_states), repeat=n_measures), key=score)
+
+    logprob, chord_sequence = second_order_viterbi(
+        log_emission, start_probability, transition_matrix, sparse.csr_matrix(second_order), interpolation)
+
+    assert tuple(chord_sequence) == best
+    assert np.isclose(logprob, score(best))
+
+
+def test_beam_viterbi():
+    """
+    Tests the beam decoder finds the best sequence when the beam holds every
+    chord, with the unigram backoff on the sparse transitions.
+    """
+    n_states, n_measures, backoff = 4, 5, 0.05
+    rng, log_emission, start_probability, transition_matrix = _random_model(n_states, n_measures)
+    transition_matrix = transition_matrix * (rng.random((n_states, n_states)) < 0.5)
+    unigram = rng.random(n_states)
+    unigram /= unigram.sum()
+
+    def score(path):
+        total = np.log(start_probability[path[0]]) + log_emission[0, path[0]]
+        for t in range(1, n_measures):
+            i, j = path[t - 1], path[t]
+            total += np.log((1 - backoff) * transition_matrix[i, j] + backoff * unigram[j]) + log_emission[t, j]
+        return total
+
+    best = max(itertools.product(range(n_states), repeat=n_measures), key=score)
+
+    logprob, chord_sequence = beam_viterbi(
+        log_emission, start_probability, sparse.csr_matrix(transition_matrix), n_states, backoff, unigram)
+
+    assert tuple(chord_sequence) == best
+    assert np.isclose(logprob, score(best))
+
+
+def test_semi_markov_viterbi():
+    """
+    Tests the explicit duration decoder finds the best segmentation.
+    """
+    n_states, n_segments = 3, 6
+    rng, log_emission, start_probability, transition_matrix = _random_model(n_states, n_segments)
+    duration_probability = np.array([0.2, 0.5, 0.3])
+
+    def segmentations(length):
+        if length == 0:
+            yield []
+        for d in range(1, min(len(duration_probability), length) + 1):
+            for rest in segmentations(length - d):
+                yield [d] + rest
+
+    def score(durations, states):
+        total, start = np.log(start_probability[states[0]]), 0
+        for n, (d, state) in enumerate(zip(durations, states)):
+            if n > 0:
+                total += np.log(transition_matrix[states[n - 1], state])
+            total += np.log(duration_probability[d - 1]) + log_emission[start:start + d, state].sum()
+            start += d
+        return total
+
+    best_score, best = max((score(durations, states), np.repeat(states, durations))
+                           for durations in segmentations(n_segments)
+                           for states in itertools.product(range(n_states), repeat=len(durations)))
+
+    logprob, chord_sequence = semi_markov_viterbi(
+        log_emission, start_probability, transition_matrix, duration_probability)
+
+    assert np.isclose(logprob, best_score)
+    assert tuple(chord_sequence) == tuple(best)
+
+
+def test_k_best_viterbi():
+    """
+    Tests the list decoder returns the k best distinct sequences in order.
+    """
+    n_states, n_measures, k = 3, 4, 5
+    rng, log_emission, start_probability, transition_matrix = _random_model(n_states, n_measures)
+
+    def score(path):
+        total = np.log(start_probability[path[0]]) + log_emission[0, path[0]]
+        for t in range(1, n_measures):
+            total += np.log(transition_matrix[path[t - 1], path[t]]) + log_emission[t, path[t]]
+        return total
+
+    best = sorted(itertools.product(range(n_states), repeat=n_measures), key=score, reverse=True)[:k]
+
+    sequences = k_best_viterbi(log_emission, start_probability, transition_matrix, k)
+
+    assert [tuple(chord_sequence) for _, chord_sequence in sequences] == best
+    assert np.allclose([logprob for logprob, _ in sequences], [score(path) for path in best])
+
+
+def test_constrained_viterbi():
+    """
+    Tests the pinned decoder with cached messages finds the best sequence
+    through the pinned chords.
+    """
+    n_states, n_measures = 3, 7
+    rng, log_emission, start_probability, transition_matrix = _random_model(n_states, n_measures)
+
+    def score(path):
+        total = np.log(start_probability[path[0]]) + log_emission[0, path[0]]
+        for t in range(1, n_measures):
+            total += np.log(transition_matrix[path[t - 1], path[t]]) + log_emission[t, path[t]]
+        return total
+
+    messages = viterbi_messages(log_emission, start_probability, transition_matrix)
+    for pins in [{}, {0: 2}, {3: 1}, {1: 0, 5: 2}, {2: 1, 3: 1, 6: 0}]:
+        paths = [path for path in itertools.product(range(n_states), repeat=n_measures)
+                 if all(path[t] == chord for t, chord in pins.items())]
+        best = max(paths, key=score)
+
+        logprob, chord_sequence = constrained_viterbi(
+            log_emission, start_probability, transition_matrix, pins, messages)
+
+        assert tuple(chord_sequence) == best
+        assert np.isclose(logprob, score(best))
@@ -0,0 +1,26 @@
+from data_process.delivery import iter_file, parse_range
+import pytest
+
+# test the byte ranges of the result delivery
+
+
+@pytest.mark.parametrize("range_header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-200", (800, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=1000-", None),
+    ("bytes=50-10", None),
+    ("bytes=0-1,5-9", None),
+    ("items=0-1", None),
+])
+def test_parse_range(range_header, expected):
+    assert parse_range(range_header, 1000) == expected
+
+
+def test_iter_file(tmp_path):
+    file = tmp_path / "mix.wav"
+    file.write_bytes(bytes(range(256)) * 4)
+
+    assert b"".join(iter_file(str(file), 10, 300, chunk_size=64)) == (bytes(range(256)) * 4)[10:301]
+    assert b"".join(iter_file(str(file))) == bytes(range(256)) * 4
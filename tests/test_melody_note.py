@@ -0,0 +1,41 @@
+import importlib.util
+import os
+import numpy as np
+import pandas as pd
+
+# test the melody observation matrix of the training pipeline
+
+# the pipeline folder has spaces in its name, so it is loaded by path
+dir_path = os.path.dirname(os.path.abspath(__file__))
+spec = importlib.util.spec_from_file_location('melody_note', os.path.join(
+    dir_path, '..', 'src', 'data_process', 'melody observation matrix', 'melody_note.py'))
+melody_note = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(melody_note)
+
+
+def test_melody_observation_matrix():
+    """
+    Tests the notes are joined to the chord at their onset, clipped to the
+    chord and counted in units of the mean note duration.
+    """
+    chord_df = pd.DataFrame({'start_time': [1.0, 3.0], 'end_time': [3.0, 5.0], 'chord': ['C:maj', 'G:maj']})
+    melody_df = pd.DataFrame({'start': [0.0, 1.0, 2.5, 3.0, 6.0],
+                              'end': [0.5, 2.0, 4.0, 5.0, 7.0],
+                              'pitch_class': [2, 0, 4, 7, 9]})
+
+    joined_df = melody_note.join_melody_to_chord(melody_df, chord_df)
+
+    # the note before the first chord and the note after the last one are left out,
+    # the note over the boundary belongs to C:maj and is clipped at 3.0
+    assert joined_df['chord'].tolist() == ['C:maj', 'C:maj', 'G:maj']
+    assert joined_df['pitch_class'].tolist() == [0, 4, 7]
+    assert np.allclose(joined_df['weight'], [1.0, 0.5, 2.0])
+
+    observation_df = melody_note.get_melody_observation_matrix(joined_df)
+
+    assert observation_df.index.tolist() == ['C:maj', 'G:maj']
+    # the mean note is 7 / 6 seconds, so the total is the number of notes
+    assert np.isclose(observation_df.to_numpy().sum(), 3)
+    assert np.isclose(observation_df.loc['C:maj', 'C'], 6 / 7)
+    assert np.isclose(observation_df.loc['C:maj', 'E'], 3 / 7)
+    assert np.isclose(observation_df.loc['G:maj', 'G'], 12 / 7)
@@ -0,0 +1,119 @@
+from data_process import model_artifact
+from data_process.hmm_model_generate import generate_second_order_transition_matrix
+from data_process.model_artifact import (expand_relative_model, get_cached_artifact_file, get_key_table,
+                                         load_model_artifact, load_vocabulary_model, save_model_artifact,
+                                         to_relative_observation, to_relative_transition)
+import numpy as np
+import os
+import pytest
+
+# test the root relative chord model
+
+
+def test_relative_model_shares_the_roots():
+    """
+    Tests a transition seen on one root is expanded to every root, and the
+    observation follows the root.
+    """
+    chord_list = ['C:maj', 'G:maj', 'A:min', 'start_chord']
+    transition_counts = np.zeros((4, 4))
+    transition_counts[0, 1] = 3  # C:maj -> G:maj, a fifth up
+    transition_counts[2, 0] = 1  # A:min -> C:maj, a minor third up
+    transition_counts[3, 0] = 5  # the marker is left out
+
+    qualities, relative_transition = to_relative_transition(chord_list, transition_counts)
+    assert qualities == ['maj', 'min']
+    assert relative_transition.sum() == 4
+    assert relative_transition[0, 7, 0] == 3 and relative_transition[1, 3, 0] == 1
+
+    observation_counts = np.zeros((4, 12))
+    observation_counts[0, [0, 4, 7]] = 1  # C E G over C:maj
+    observation_counts[1, [7, 11, 2]] = 1  # G B D over G:maj
+    observation_qualities, relative_observation = to_relative_observation(chord_list[:2], observation_counts[:2])
+    assert observation_qualities == ['maj']
+    assert relative_observation[0, [0, 4, 7]].tolist() == [2, 2, 2]
+
+    chord_list, transition_matrix, observation_matrix = expand_relative_model(
+        qualities, relative_transition, observation_qualities, relative_observation)
+    index = {chord: i for i, chord in enumerate(chord_list)}
+    assert len(chord_list) == 24
+
+    # D:maj -> A:maj was never seen
+    assert transition_matrix[index['D:maj'], index['A:maj']] == 1
+    assert np.allclose(transition_matrix.sum(axis=1), 1)
+    assert np.flatnonzero(observation_matrix[index['D:maj']]).tolist() == [2, 6, 9]
+    # the minor quality has no melody, the chord template is used
+    assert np.flatnonzero(observation_matrix[index['E:min']]).tolist() == [4, 7, 11]
+
+
+def test_build_from_the_csv_tables(tmp_path, monkeypatch):
+    """
+    Tests a missing artifact is compiled from the shipped csv tables on load,
+    into the cache directory instead of next to the artifact.
+    """
+    monkeypatch.setattr(model_artifact, "artifact_cache_dir", str(tmp_path / "cache"))
+    artifact_file = str(tmp_path / "model" / "chord_hmm.npz")
+
+    chord_list, transition_matrix, observation_matrix = get_key_table('G:maj', artifact_file)
+    assert 'G:maj' in chord_list and 'D:maj' in chord_list
+    assert np.allclose(transition_matrix.sum(axis=1), 1)
+    assert np.allclose(observation_matrix.sum(axis=1), 1)
+    assert not os.path.exists(artifact_file)
+    assert 'relative_transition' in load_model_artifact(get_cached_artifact_file(artifact_file))
+
+
+def test_half_relative_model(tmp_path, monkeypatch):
+    """
+    Tests an artifact with only the transition half of the relative model
+    is compiled again instead of loaded, and left as it is.
+    """
+    monkeypatch.setattr(model_artifact, "artifact_cache_dir", str(tmp_path / "cache"))
+    artifact_file = str(tmp_path / "chord_hmm.npz")
+    qualities, relative_transition = to_relative_transition(['C:maj', 'G:maj'], np.array([[0, 1], [1, 0]]))
+    save_model_artifact({'relative_qualities': np.array(qualities), 'relative_transition': relative_transition},
+                        artifact_file)
+
+    chord_list, _, _ = get_key_table('Db:maj', artifact_file)
+    assert 'C#:maj' in chord_list
+    assert 'relative_observation' not in load_model_artifact(artifact_file)
+    assert 'relative_observation' in load_model_artifact(get_cached_artifact_file(artifact_file))
+
+
+def test_second_order_from_the_corpus(tmp_path, monkeypatch):
+    """
+    Tests the missing second order transition is counted from the shipped
+    chord corpus, an unknown chord gets empty rows for the backoff.
+    """
+    monkeypatch.setattr(model_artifact, "artifact_cache_dir", str(tmp_path / "cache"))
+    artifact_file = str(tmp_path / "chord_hmm.npz")
+
+    second_order = generate_second_order_transition_matrix(['C:maj', 'G:maj', 'H:maj'], artifact_file)
+
+    assert second_order.shape == (9, 3)
+    row_sum = np.asarray(second_order.sum(axis=1)).ravel()
+    # C:maj G:maj -> C:maj or G:maj was seen
+    assert np.isclose(row_sum[0 * 3 + 1], 1)
+    assert row_sum[[2, 5, 6, 7, 8]].tolist() == [0] * 5
+    assert second_order[:, 2].nnz == 0
+
+
+def test_second_order_falls_back(tmp_path, monkeypatch):
+    """
+    Tests the decoding falls back to the first order without the corpus.
+    """
+    monkeypatch.setattr(model_artifact, "artifact_cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(model_artifact, "chord_corpus_dir", str(tmp_path / "corpus"))
+
+    with pytest.warns(UserWarning, match="first order"):
+        assert generate_second_order_transition_matrix(['C:maj'], str(tmp_path / "chord_hmm.npz")) is None
+
+
+def test_missing_vocabulary_model(tmp_path):
+    """
+    Tests the missing large vocabulary model names the training command.
+    """
+    artifact_file = str(tmp_path / "chord_hmm.npz")
+    save_model_artifact({'vocabulary_chord_list': np.array(['C:maj'])}, artifact_file)
+
+    with pytest.raises(FileNotFoundError, match="melody_note.py' --large-vocabulary"):
+        load_vocabulary_model(artifact_file)
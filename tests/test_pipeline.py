@@ -0,0 +1,165 @@
+from auto_accompany import pipeline, shared_buffer
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from data_process import generatemusic, song_analyze
+from fastapi.testclient import TestClient
+from types import SimpleNamespace
+import importlib.util
+import librosa
+import sys
+import threading
+import time
+import numpy as np
+import pytest
+
+# test the stages of the pipeline and the api around them, the models are replaced
+
+SR = pipeline.AUDIO_SAMPLE_RATE
+DURATION = 10
+
+
+@pytest.fixture
+def calls(monkeypatch, tmp_path):
+    """
+    Replaces the loading, beat tracking, voice activity and transcription
+    stages by stubs recording their calls, with an empty stage cache.
+    """
+    calls = []
+    audio = np.sin(2 * np.pi * 440 * np.arange(DURATION * SR) / SR).astype(np.float32)
+    spans = [(0.0, DURATION)]
+
+    def load(vocal_file, sr, mono):
+        calls.append(("load",))
+        return audio.copy(), sr
+
+    def transcribe_active_spans(audio, spans, midi_path=None, chunked=False, extract_notes=True):
+        calls.append(("active_spans", midi_path, chunked, extract_notes))
+        return np.ones((10, 88)), None, None
+
+    def transcribe_audio_chunked(audio, midi_path=None):
+        calls.append(("chunked", midi_path))
+        return SimpleNamespace(write=lambda midi_path: calls.append(("write", midi_path))), []
+
+    def transcribe_audio(audio, extract_notes=True):
+        calls.append(("whole", audio, extract_notes))
+        return {"note": np.ones((10, 88))}, None, None
+
+    monkeypatch.setattr(librosa, "load", load)
+    monkeypatch.setattr(song_analyze, "get_beat_info_from_audio", lambda audio, sr: (120.0, [0.0, 2.0], 0.0, "4/4"))
+    monkeypatch.setattr(song_analyze, "detect_voice_activity", lambda audio, sr: spans)
+    monkeypatch.setattr(pipeline, "transcribe_active_spans", transcribe_active_spans)
+    monkeypatch.setattr(pipeline, "transcribe_audio_chunked", transcribe_audio_chunked)
+    monkeypatch.setattr(pipeline, "transcribe_audio", transcribe_audio)
+    monkeypatch.setattr(pipeline, "_stage_cache", OrderedDict())
+    monkeypatch.setattr(pipeline, "_analysis_cache", OrderedDict())
+
+    vocal_file = tmp_path / "vocal.wav"
+    vocal_file.write_bytes(b"take")
+    return SimpleNamespace(list=calls, audio=audio, spans=spans, vocal_file=str(vocal_file),
+                           midi_file=str(tmp_path / "vocal.mid"))
+
+
+def test_pitch_correction(calls, monkeypatch):
+    """
+    Tests the tuner reads the loaded audio and writes the tuned audio
+    through the shared buffers, the buffers are freed afterwards.
+    """
+    monkeypatch.setitem(sys.modules, "AutoTune",
+                        SimpleNamespace(Tuner=lambda signal_chunk, fs, n_samples, *args: signal_chunk * 0.5))
+    spec = importlib.util.find_spec("auto_accompany.autoTune")
+    autoTune = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(autoTune)
+    monkeypatch.setitem(sys.modules, "auto_accompany.autoTune", autoTune)
+    monkeypatch.setattr(song_analyze, "estimate_key_from_audio", lambda audio, sr: "A:min")
+
+    with ThreadPoolExecutor(1) as pool:
+        monkeypatch.setattr(pipeline, "get_pool", lambda: pool)
+        n_owned = len(shared_buffer._owned)
+
+        pipeline.prepare_vocal(calls.vocal_file, calls.midi_file, pitch_correction=True)
+
+    (_, audio, _), = [call for call in calls.list if call[0] == "whole"]
+    assert np.allclose(audio, calls.audio * 0.5)
+    assert len(shared_buffer._owned) == n_owned
+
+
+@pytest.mark.parametrize("active_seconds, chunked_seconds, expected", [
+    (4.0, 300, ("active_spans", None, False, False)),
+    (4.0, 2, ("active_spans", "midi", True, False)),
+    (DURATION, 5, ("chunked", "midi")),
+    (DURATION, 300, ("whole",)),
+])
+def test_transcription_branch(calls, monkeypatch, active_seconds, chunked_seconds, expected):
+    """
+    Tests a take with long silences is transcribed by the voiced spans,
+    and a long take in chunks, the note activations are kept otherwise.
+    """
+    calls.spans[:] = [(1.0, 1.0 + active_seconds)]
+    monkeypatch.setattr(pipeline, "chunked_transcription_seconds", chunked_seconds)
+
+    _, note_activation = pipeline.prepare_vocal(calls.vocal_file, calls.midi_file)
+
+    call, = [call for call in calls.list if call[0] in ("active_spans", "chunked", "whole")]
+    expected = tuple(calls.midi_file if value == "midi" else value for value in expected)
+    assert call[:len(expected)] == expected
+    # the chunked transcription only sends the notes back
+    assert (note_activation is None) == (expected[0] == "chunked")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    The api client, the analysis and the rendering are replaced.
+    """
+    from api import main
+
+    analysis = {"key": "C:maj", "time_signature": "4/4", "tempo": 120.0, "downbeats": [0.0],
+                "chord_sequence": ["C:maj"], "progressions": [(-1.0, ["C:maj"])]}
+    monkeypatch.setattr(generatemusic, "analyze_music", lambda *args, **kwargs: analysis)
+    monkeypatch.setattr(generatemusic, "generate_music", lambda *args, **kwargs: analysis["progressions"])
+    # the upload of the api is the same take
+    monkeypatch.setattr(pipeline, "get_job_key", lambda vocal_file, pitch_correction: ("take", pitch_correction))
+    return TestClient(main.app)
+
+
+def test_analyze_then_process(calls, client):
+    """
+    Tests the audio stages of /analyze are reused by /process.
+    """
+    response = client.get("/analyze")
+    assert response.status_code == 200 and response.json()["chords"] == ["C:maj"]
+
+    response = client.get("/process")
+    assert response.status_code == 200
+    assert response.json()["progressions"] == [{"rank": 0, "logprob": -1.0, "chords": ["C:maj"]}]
+    assert [call[0] for call in calls.list] == ["load", "whole"]
+
+
+def test_ready_after_warm_up(monkeypatch):
+    """
+    Tests /ready answers 503 during the warm up and 200 once it is done.
+    """
+    from api import main
+
+    warmed_up = threading.Event()
+
+    def warm_up():
+        warmed_up.wait(10)
+        return [{"stage": "warm_up_import"}]
+
+    monkeypatch.setattr(main, "warm_up", warm_up)
+    monkeypatch.setattr(main, "warm_up_state", {"ready": False, "cold_start": None, "stages": [], "error": None})
+
+    with TestClient(main.app) as client:
+        response = client.get("/ready")
+        assert response.status_code == 503 and not response.json()["ready"]
+
+        warmed_up.set()
+        for _ in range(100):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.05)
+
+    assert response.status_code == 200
+    assert response.json()["stages"] == [{"stage": "warm_up_import"}]
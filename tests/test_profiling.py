@@ -0,0 +1,80 @@
+from data_process.profiling import StageMetrics, get_current_rss, get_peak_rss, metrics, stage, track_stages
+import numpy as np
+import threading
+
+# test the stage spans and the /metrics text
+
+
+def test_stage_records():
+    """
+    Tests the nested stages are recorded in the order they finished, with
+    the rss change and the rise of the peak rss of each stage.
+    """
+    # 32 MB over the peak of the process so far
+    size = max(get_peak_rss() - get_current_rss(), 0) + 2 ** 25
+    with track_stages() as timer:
+        with stage("outer"):
+            with stage("inner"):
+                buffer = np.ones(size, dtype=np.uint8)
+            del buffer
+            with stage("after_free"):
+                pass
+
+    records = timer.as_dict()
+    assert [record['stage'] for record in records] == ["inner", "after_free", "outer"]
+    assert records[0]['wall_time'] <= records[2]['wall_time']
+    # the buffer is allocated in the inner stage and freed in the outer one
+    assert records[0]['rss_delta'] > 2 ** 24
+    assert records[2]['rss_delta'] < records[0]['rss_delta']
+    # the peak stays after the free
+    assert records[0]['peak_rss_delta'] > 2 ** 24
+    assert records[1]['peak_rss_delta'] == 0 and records[1]['peak_rss'] >= records[0]['peak_rss']
+
+    # no stage outside of the request, but still counted by /metrics
+    with stage("after"):
+        pass
+    assert len(timer.as_dict()) == 3
+    assert 'stage_wall_seconds_count{stage="after"}' in metrics.render()
+
+
+def test_track_stages_per_thread():
+    """
+    Tests the requests of two threads collect their own stages.
+    """
+    timers = {}
+
+    def request(name):
+        with track_stages() as timer:
+            with stage(name):
+                pass
+        timers[name] = timer
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in ("first", "second")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [record['stage'] for record in timers["first"].as_dict()] == ["first"]
+    assert [record['stage'] for record in timers["second"].as_dict()] == ["second"]
+
+
+def test_render_metrics():
+    """
+    Tests the totals of each stage in the Prometheus text format.
+    """
+    stage_metrics = StageMetrics()
+    stage_metrics.observe({'stage': "decoding", 'wall_time': 1.5, 'cpu_time': 1.0, 'rss_delta': 100,
+                           'peak_rss': 1000, 'peak_rss_delta': 200})
+    stage_metrics.observe({'stage': "decoding", 'wall_time': 0.5, 'cpu_time': 0.25, 'rss_delta': -40,
+                           'peak_rss': 900, 'peak_rss_delta': 0})
+
+    lines = stage_metrics.render().splitlines()
+
+    assert 'stage_wall_seconds_sum{stage="decoding"} 2.000000' in lines
+    assert 'stage_cpu_seconds_sum{stage="decoding"} 1.250000' in lines
+    assert 'stage_rss_delta_bytes_sum{stage="decoding"} 60' in lines
+    assert 'stage_rss_delta_bytes_count{stage="decoding"} 2' in lines
+    assert 'stage_peak_rss_delta_bytes_sum{stage="decoding"} 200' in lines
+    assert 'stage_peak_rss_bytes{stage="decoding"} 1000' in lines
+    assert any(line.startswith('process_peak_rss_bytes ') for line in lines)
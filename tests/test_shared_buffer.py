@@ -0,0 +1,66 @@
+from auto_accompany.shared_buffer import _close, _pending_close, attach, get_array, release, retain, share_array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pytest
+
+# test the buffer handoff between the worker processes
+
+
+def _double(source_buffer, target_buffer):
+    """
+    Writes twice the source into the target, in a worker.
+    """
+    with attach(source_buffer) as source, attach(target_buffer) as target:
+        target[:] = source * 2
+        del source, target
+
+
+def test_share_array_across_processes():
+    """
+    Tests a worker reads and writes the buffers by name.
+    """
+    audio = np.random.default_rng(0).standard_normal(22050).astype(np.float32)
+    source_buffer = share_array(audio)
+    target_buffer = share_array(shape=audio.shape, dtype=np.float32)
+
+    with ProcessPoolExecutor(1) as pool:
+        pool.submit(_double, source_buffer, target_buffer).result()
+
+    assert np.array_equal(get_array(target_buffer), audio * 2)
+    release(source_buffer)
+    release(target_buffer)
+
+
+def test_release_after_last_reference():
+    """
+    Tests an array already in a shared buffer is not copied and the block
+    is freed with the last reference.
+    """
+    audio_buffer = share_array(np.arange(10, dtype=np.float32))
+    assert share_array(get_array(audio_buffer)).name == audio_buffer.name
+    retain(audio_buffer)
+
+    release(audio_buffer)
+    release(audio_buffer)
+    shared_memory.SharedMemory(name=audio_buffer.name).close()
+
+    release(audio_buffer)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=audio_buffer.name)
+
+
+def test_array_outlives_release():
+    """
+    Tests an array viewing a buffer stays readable after the buffer is
+    released, the block is closed once the array is gone.
+    """
+    audio_buffer = share_array(np.arange(10, dtype=np.float32))
+    audio = get_array(audio_buffer)
+
+    release(audio_buffer)
+
+    assert audio.tolist() == list(range(10))
+    del audio
+    _close(None)
+    assert not _pending_close
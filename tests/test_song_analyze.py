@@ -0,0 +1,79 @@
+from data_process.song_analyze import (detect_voice_activity, estimate_key_from_chroma, get_beat_info_from_audio,
+                                      get_tempo_map, split_activation_to_measure, split_time_section)
+import numpy as np
+import pytest
+
+# test the meter detection and the measure splitting
+
+
+def _accented_clicks(beats_per_bar, bpm=100, seconds=30, sr=22050):
+    """
+    Synthesizes a click track with an accent on the first beat of each bar.
+    """
+    audio = np.zeros(seconds * sr, dtype=np.float32)
+    t = np.arange(int(0.05 * sr)) / sr
+    click = np.sin(2 * np.pi * 200 * t) * np.exp(-40 * t)
+    for i, beat_time in enumerate(np.arange(0.5, seconds - 0.2, 60 / bpm)):
+        begin = int(beat_time * sr)
+        audio[begin:begin + len(click)] += click * (1.0 if i % beats_per_bar == 0 else 0.1)
+    return audio, sr
+
+
+@pytest.mark.parametrize("beats_per_bar, time_signature", [(3, '3/4'), (4, '4/4'), (6, '6/8')])
+def test_meter_detection(beats_per_bar, time_signature):
+    """
+    Tests the bar length is found and the measures follow it.
+    """
+    audio, sr = _accented_clicks(beats_per_bar)
+
+    vocal_tempo, time_section, the_start_time, detected = get_beat_info_from_audio(audio, sr)
+
+    assert detected == time_signature
+    bar_seconds = np.median([end - start for start, end in time_section[:-1]])
+    assert np.isclose(bar_seconds, beats_per_bar * 60 / 100, rtol=0.05)
+
+
+def test_split_time_section():
+    """
+    Tests every measure is split into equal segments.
+    """
+    assert split_time_section([[0, 4], [4, 6]], 2) == [[0, 2], [2, 4], [4, 5], [5, 6]]
+
+
+def test_get_tempo_map():
+    """
+    Tests the tempo of each measure follows the downbeats, the last one
+    keeps the tempo before it.
+    """
+    tempo_map = get_tempo_map([[0, 2], [2, 3.5], [3.5, 4]], 4)
+
+    assert np.allclose(tempo_map, [120, 160, 160])
+
+
+def test_detect_voice_activity():
+    """
+    Tests the silent lead-in and gap are left out of the active spans.
+    """
+    audio, sr = _accented_clicks(4, seconds=6)
+    silence = np.zeros(3 * sr, dtype=np.float32)
+
+    spans = detect_voice_activity(np.concatenate([silence, audio, silence, audio]), sr)
+
+    assert len(spans) == 2
+    # the first clicks are at 3.5 and 12.5 seconds, the spans start a little before
+    assert 3.0 < spans[0][0] <= 3.5 and 12.0 < spans[1][0] <= 12.5
+
+
+def test_split_activation_to_measure():
+    frame_rate = 22050 / 256
+    activation = np.zeros((int(4 * frame_rate), 88))
+    # a C4 (midi 60) in the first two seconds, an A3 (midi 57) after, a weak G4 never
+    activation[:int(2 * frame_rate), 60 - 21] = 0.8
+    activation[int(2 * frame_rate):, 57 - 21] = 0.6
+    activation[:, 67 - 21] = 0.1
+
+    measure_chroma = split_activation_to_measure(activation, [[0, 2], [2, 4]])
+    assert measure_chroma.shape == (2, 12)
+    assert measure_chroma[0].argmax() == 0 and measure_chroma[1].argmax() == 9
+    assert measure_chroma[:, 7].sum() == 0
+    assert estimate_key_from_chroma(measure_chroma.sum(axis=0)) in ("C:maj", "A:min")
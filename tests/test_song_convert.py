@@ -1,19 +1,90 @@
-from auto_accompany.song_convert import convert_to_midi
+from auto_accompany.song_convert import (AUDIO_N_SAMPLES, AUDIO_SAMPLE_RATE, FFT_HOP, convert_to_midi, load_model,
+                                         stitch_note_events, transcribe_audio, transcribe_audio_chunked)
+import numpy as np
 import os
+import pytest
 
 # test convert_to_midi
 
 
-def test_convert_to_midi():
+def test_convert_to_midi(tmp_path):
     """
     Tests the convert_to_midi function.
     """
+    pytest.importorskip("basic_pitch")
     # generate relative path
     dir_path = os.path.dirname(os.path.abspath(__file__))
     file_path_vocal = os.path.join(dir_path, 'vocal',
                                    'sarah_and_me_voice.mp3')
+    midi_path = os.path.join(tmp_path, 'sarah_and_me_voice.mid')
+
     # convert to midi
+    convert_to_midi(file_path_vocal, midi_path)
 
     # check if file exists
-    assert convert_to_midi(file_path_vocal, dir_path)
-    # remove file
+    assert os.path.exists(midi_path)
+
+
+def test_stitch_note_events():
+    """
+    Tests the notes of overlapping chunks are kept once and the notes cut
+    at a chunk boundary are joined.
+    """
+    # chunk 0 owns [0, 10) seen through [0, 12), chunk 1 owns [10, 20) seen through [8, 20)
+    chunk_bounds = [(0.0, 0.0, 10.0), (8.0, 10.0, 20.0)]
+    chunk_events = [
+        [(1.0, 2.0, 60, 0.5, None), (9.0, 9.5, 62, 0.5, None), (11.0, 12.0, 64, 0.5, None)],
+        [(1.0, 1.5, 62, 0.5, None), (3.0, 4.0, 64, 0.5, None), (0.0, 2.5, 60, 0.5, None)],
+    ]
+    chunk_events[0].append((7.0, 12.0, 67, 0.5, None))
+    chunk_events[1].append((0.0, 1.0, 67, 0.5, None))
+    # a held note starting in the owned part of chunk 0 and cut at its window end
+    chunk_events[0].append((9.5, 12.0, 65, 0.5, None))
+    chunk_events[1].append((1.5, 6.0, 65, 0.5, None))
+
+    note_events = stitch_note_events(chunk_events, chunk_bounds)
+
+    assert [(start, end, pitch) for start, end, pitch, _, _ in note_events] == [
+        (1.0, 2.0, 60), (7.0, 12.0, 67), (8.0, 10.5, 60), (9.0, 9.5, 62), (9.5, 14.0, 65), (11.0, 12.0, 64)]
+
+
+def test_basic_pitch_constants():
+    """
+    Tests the constants repeated in song_convert match basic-pitch.
+    """
+    constants = pytest.importorskip("basic_pitch.constants")
+
+    assert (AUDIO_SAMPLE_RATE, FFT_HOP, AUDIO_N_SAMPLES) == (
+        constants.AUDIO_SAMPLE_RATE, constants.FFT_HOP, constants.AUDIO_N_SAMPLES)
+
+
+def test_transcribe_chunked_after_load_model():
+    """
+    Tests the chunk workers start after the model already ran in this
+    process, as after the warm up.
+    """
+    pytest.importorskip("basic_pitch")
+
+    # a sung A4 then C5, two seconds each
+    t = np.arange(2 * AUDIO_SAMPLE_RATE) / AUDIO_SAMPLE_RATE
+    audio = np.concatenate([np.sin(2 * np.pi * 440 * t), np.sin(2 * np.pi * 523.25 * t)]).astype(np.float32) * 0.3
+
+    load_model()
+    transcribe_audio(audio)
+    _, note_events = transcribe_audio_chunked(audio, chunk_seconds=1.5, overlap_seconds=0.5, n_workers=2)
+
+    assert {pitch for _, _, pitch, _, _ in note_events} >= {69, 72}
+
+
+def test_stitch_keeps_repeated_notes():
+    """
+    Tests a note sung again right after itself inside a chunk is not merged.
+    """
+    chunk_bounds = [(0.0, 0.0, 10.0), (8.0, 10.0, 20.0)]
+    chunk_events = [[(3.0, 3.5, 60, 0.5, None), (3.52, 4.0, 60, 0.5, None)],
+                    [(5.0, 5.5, 62, 0.5, None), (5.53125, 6.0, 62, 0.5, None)]]
+
+    note_events = stitch_note_events(chunk_events, chunk_bounds)
+
+    assert [(start, end, pitch) for start, end, pitch, _, _ in note_events] == [
+        (3.0, 3.5, 60), (3.52, 4.0, 60), (13.0, 13.5, 62), (13.53125, 14.0, 62)]
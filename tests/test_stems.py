@@ -0,0 +1,56 @@
+from data_process.stems import StemStore
+from pydub import AudioSegment
+from scipy.io import wavfile
+import numpy as np
+
+# test the remix of the stored stems
+
+
+def _tone(frequency, sr, seconds=1.0, amplitude=0.2, channels=1):
+    """
+    Builds a 16 bit sine tone AudioSegment.
+    """
+    t = np.arange(int(seconds * sr)) / sr
+    samples = (amplitude * np.sin(2 * np.pi * frequency * t) * 32767).astype(np.int16)
+    samples = np.repeat(samples[:, None], channels, axis=1)
+    return AudioSegment(samples.tobytes(), frame_rate=sr, sample_width=2, channels=channels)
+
+
+def test_stem_store_mix(tmp_path):
+    """
+    Tests the stems are mixed with the gains in dB, muted stems are left out.
+    """
+    stem_store = StemStore(str(tmp_path / "stems"))
+    stem_store.write({"vocal": _tone(220, 44100), "piano": _tone(330, 44100, channels=2),
+                      "drum": _tone(440, 44100, seconds=0.5)})
+
+    # the layout is read back by a new store
+    stem_store = StemStore(str(tmp_path / "stems"))
+    assert stem_store.layout["n_frames"] == 22050
+    vocal, piano = stem_store.open("vocal"), stem_store.open("piano")
+
+    output_file = stem_store.mix(str(tmp_path / "mix.wav"), {"vocal": 0.0, "piano": -6.0}, mutes=["drum"],
+                                 block_frames=1000)
+    sr, mixed = wavfile.read(output_file)
+
+    expected = vocal + piano * 10 ** (-6 / 20)
+    assert sr == 44100 and mixed.shape == (22050, 2)
+    assert np.abs(mixed / 32768 - expected).max() < 1e-4
+
+
+def test_stream_mix_left_early(tmp_path):
+    """
+    Tests a stream closed before the end leaves the previous mix untouched.
+    """
+    stem_store = StemStore(str(tmp_path / "stems"))
+    stem_store.write({"vocal": _tone(220, 44100), "drum": _tone(440, 44100)})
+    output_file = stem_store.mix(str(tmp_path / "mix.wav"))
+    previous = (tmp_path / "mix.wav").read_bytes()
+
+    chunks = stem_store.stream_mix(output_file, {"drum": -20.0}, block_frames=1000)
+    next(chunks)
+    next(chunks)
+    chunks.close()
+
+    assert (tmp_path / "mix.wav").read_bytes() == previous
+    assert sorted(i.name for i in tmp_path.iterdir()) == ["mix.wav", "stems"]